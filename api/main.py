@@ -1,11 +1,35 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, Depends, Header
+from fastapi.responses import PlainTextResponse, JSONResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from src.models import ChatRequest, ChatResponse, HealthResponse
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.concurrency import run_in_threadpool
+from src.models import (
+    ChatRequest, ChatResponse, ClassQueryRequest, ClassQueryResponse, HealthResponse, Message,
+    SearchRequest, SearchResponse, SearchResult,
+)
 from src.rag_pipeline import get_rag_pipeline
 from src.config import config
+from src.metrics import REQUEST_COUNT, REQUEST_LATENCY, render_metrics
+from src.tracing import get_logger, start_trace, finished_spans, server_timing_header
+from src.profiler import get_profiler
+from src.warmup import get_readiness
+from src.shared_store import get_shared_store
+from src.replica import get_replica
+from src.keep_warm import ModelColdError, get_model_availability, model_status, start_keep_warm
+from src.rate_limiter import RateLimitTimeout, get_rate_limiter
+from src.similarity_graph import get_similarity_graph
+from src.capture import get_traffic_recorder
+from src.transcripts import get_transcript_log, start_usage
+from src.utils import history_digest
+from typing import Optional
 import uvicorn
+import secrets
+import json
+import time
 import os
 
+logger = get_logger("api")
+
 app = FastAPI(
     title="Student Performance Chatbot API",
     description="Conversational RAG-based chatbot for analyzing student performance",
@@ -19,21 +43,108 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Trace-Id"],
 )
 
-# Initialize RAG pipeline on startup
+@app.middleware("http")
+async def metrics_middleware(request: Request, call_next):
+    """Record request count and latency per route"""
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        # Use the route template (e.g. /students/{id}) to keep label cardinality bounded
+        route = request.scope.get("route")
+        route_path = route.path if route is not None else "unmatched"
+        REQUEST_LATENCY.labels(request.method, route_path).observe(time.perf_counter() - start)
+        REQUEST_COUNT.labels(request.method, route_path, str(status)).inc()
+
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    """Assign a trace ID, log the request and return stage timings in Server-Timing"""
+    trace_id = start_trace(request.headers.get("x-request-id"))
+    # Endpoints sample their threadpool work via in_threadpool()
+    profiled = get_profiler().begin_request()
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    except Exception:
+        logger.exception("request failed", extra={"method": request.method, "path": request.url.path})
+        raise
+    total_ms = (time.perf_counter() - start) * 1000
+    response.headers["X-Trace-Id"] = trace_id
+    response.headers["Server-Timing"] = server_timing_header(finished_spans(), total_ms)
+    logger.info("request completed", extra={
+        "method": request.method,
+        "path": request.url.path,
+        "status": response.status_code,
+        "duration_ms": round(total_ms, 3),
+        "spans": finished_spans(),
+        "profiled": profiled,
+    })
+    return response
+
+# Response compression (added last so it wraps everything, including the
+# headers set above). Brotli is used when brotli-asgi is installed, falling
+# back to gzip for clients that don't accept br.
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, minimum_size=config.COMPRESSION_MIN_BYTES, gzip_fallback=True)
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=config.COMPRESSION_MIN_BYTES)
+
+async def in_threadpool(fn, *args):
+    """run_in_threadpool, sampling the worker thread when the request is being profiled"""
+    return await run_in_threadpool(get_profiler().profiled(fn), *args)
+
+# Upstream conditions answered with 503 + Retry-After instead of a wait
+UPSTREAM_UNAVAILABLE = (ModelColdError, RateLimitTimeout)
+
+def unavailable(e: Exception) -> HTTPException:
+    """503 + Retry-After while the model loads or the shared HF budget is exhausted, so clients retry instead of waiting it out"""
+    if isinstance(e, ModelColdError):
+        get_model_availability().reject(e)
+        detail = f"The AI model is warming up, please retry in {e.retry_after_header}s"
+    else:
+        detail = f"The AI service is busy, please retry in {e.retry_after_header}s"
+    return HTTPException(
+        status_code=503,
+        detail=detail,
+        headers={"Retry-After": e.retry_after_header}
+    )
+
+def require_admin(x_admin_token: Optional[str] = Header(default=None)):
+    """Guard admin endpoints with the ADMIN_TOKEN shared secret"""
+    if not config.ADMIN_TOKEN or not x_admin_token or not secrets.compare_digest(x_admin_token, config.ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Admin token required")
+
+# Warm up in the background so the server accepts connections immediately;
+# /ready reports when the pipeline and upstream connections are warm
 @app.on_event("startup")
 async def startup_event():
-    try:
-        print("Initializing RAG pipeline...")
-        get_rag_pipeline()
-        print("✅ API is ready!")
-    except Exception as e:
-        print(f"❌ Error initializing RAG pipeline: {e}")
-        import traceback
-        traceback.print_exc()
-        # Don't crash the server - it can still serve health checks
-        print("⚠️  Server will start but chat functionality may not work")
+    logger.info("Starting background warm-up")
+    get_readiness().start()
+    shared = get_shared_store()
+    if shared is not None:
+        # Every worker competes for the loader lock; one refreshes the snapshot
+        shared.start_loader()
+    replica = get_replica()
+    if replica is not None:
+        # Likewise one worker per host keeps the SQLite replica in sync
+        replica.start_syncer()
+    # ...and one pings idle models so they don't unload
+    start_keep_warm()
+    get_transcript_log()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    transcripts = get_transcript_log()
+    if transcripts is not None:
+        # Write out buffered turns before the worker exits
+        await run_in_threadpool(transcripts.close)
 
 @app.get("/", response_model=HealthResponse)
 async def root():
@@ -45,12 +156,41 @@ async def root():
 
 @app.get("/health", response_model=HealthResponse)
 async def health_check():
-    """Detailed health check"""
+    """Liveness check - the process is up; see /ready for whether it can serve chats"""
+    readiness = get_readiness()
+    if readiness.state == "failed":
+        return HealthResponse(
+            status="degraded",
+            message="; ".join(readiness.errors) or "Warm-up failed"
+        )
+    if not readiness.is_ready:
+        return HealthResponse(status="starting", message=f"Warm-up {readiness.state}")
     return HealthResponse(
         status="healthy",
         message="All systems operational"
     )
 
+@app.get("/ready")
+async def ready():
+    """Readiness probe - 200 only once the pipeline is initialized and upstreams are warm"""
+    readiness = get_readiness()
+    content = readiness.snapshot()
+    replica = get_replica()
+    if replica is not None:
+        content["replica"] = replica.status()
+    if readiness.is_ready:
+        content["models"] = model_status()
+    return JSONResponse(
+        status_code=200 if readiness.is_ready else 503,
+        content=content
+    )
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint"""
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(request: ChatRequest):
     """
@@ -65,7 +205,8 @@ async def chat(request: ChatRequest):
     }
     ```
     
-    Example with history:
+    Example with history, asking for only the new turn back
+    (append `new_messages` to your local history; `history_digest` lets you check it):
     ```json
     {
         "student_id": "S001",
@@ -73,44 +214,237 @@ async def chat(request: ChatRequest):
         "conversation_history": [
             {"role": "user", "content": "How is this student performing?"},
             {"role": "assistant", "content": "Ahmed is performing well..."}
-        ]
+        ],
+        "response_mode": "delta"
     }
     ```
     """
+    recorder = get_traffic_recorder()
+    capture = recorder is not None and recorder.sampled()
+    transcripts = get_transcript_log()
+    usage = start_usage()
+    started_at, start = time.time(), time.perf_counter()
+    limiter = get_rate_limiter()
     try:
         rag_pipeline = get_rag_pipeline()
         
         # Convert Pydantic models to dicts for processing
         history = [{"role": msg.role, "content": msg.content} for msg in request.conversation_history]
         
-        result = rag_pipeline.process_query(
+        # Wait for the LLM token here, on the event loop, rather than in a worker
+        await limiter.acquire_async(rag_pipeline.llm_handler.rate_limit_key)
+        result = await in_threadpool(
+            rag_pipeline.process_query,
             request.student_id, 
             request.message,
             history
         )
         
-        # Convert history back to Message objects
-        from src.models import Message
-        conversation_messages = [
-            Message(role=msg["role"], content=msg["content"]) 
-            for msg in result["conversation_history"]
-        ]
-        
-        return ChatResponse(
+        new_messages = [Message(**msg) for msg in result["new_messages"]]
+        chat_response = ChatResponse(
             student_id=request.student_id,
             message=request.message,
             response=result["response"],
             performance_category=result["performance_category"],
-            conversation_history=conversation_messages,
+            new_messages=new_messages,
+            history_digest=history_digest(result["new_messages"], history_digest(history)),
             suggestions=result["suggestions"]
         )
+        if request.response_mode == "full":
+            # Reuse the already-validated request messages instead of rebuilding them
+            chat_response.conversation_history = request.conversation_history + new_messages
+            exclude = None
+        else:
+            exclude = {"conversation_history"}
+        
+        # Serialize with pydantic-core's native JSON encoder (skips jsonable_encoder)
+        content = chat_response.model_dump_json(exclude=exclude)
+        duration_ms = (time.perf_counter() - start) * 1000
+        if capture:
+            recorder.record_chat("/chat", request, 200, started_at, duration_ms, len(result["response"]))
+        if transcripts is not None:
+            transcripts.record_turn(
+                "/chat", request.student_id, request.message, 200, started_at, duration_ms, usage,
+                result["response"], result["performance_category"], len(history)
+            )
+        return Response(content=content, media_type="application/json")
     
+    except UPSTREAM_UNAVAILABLE as e:
+        duration_ms = (time.perf_counter() - start) * 1000
+        if capture:
+            recorder.record_chat("/chat", request, 503, started_at, duration_ms, 0)
+        if transcripts is not None:
+            transcripts.record_turn("/chat", request.student_id, request.message, 503, started_at, duration_ms, usage)
+        raise unavailable(e)
     except Exception as e:
+        duration_ms = (time.perf_counter() - start) * 1000
+        if capture:
+            recorder.record_chat("/chat", request, 500, started_at, duration_ms, 0)
+        if transcripts is not None:
+            transcripts.record_turn("/chat", request.student_id, request.message, 500, started_at, duration_ms, usage)
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+    finally:
+        # e.g. an unknown student or a speculative answer needed no LLM call
+        limiter.return_unused()
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    """
+    Same as /chat, but streams the answer while the LLM generates it.
+    
+    The body is newline-delimited JSON, one event per line:
+    ```
+    {"type": "start", "performance_category": "Average"}
+    {"type": "token", "content": "Ahmed "}
+    {"type": "token", "content": "is doing well..."}
+    {"type": "done", "new_messages": [...], "suggestions": [...], "history_digest": "..."}
+    ```
+    Append `new_messages` from the final event to your local history
+    (`{"type": "error", "detail": ...}` replaces it if generation fails).
+    """
+    recorder = get_traffic_recorder()
+    capture = recorder is not None and recorder.sampled()
+    transcripts = get_transcript_log()
+    usage = start_usage()
+    started_at, start = time.time(), time.perf_counter()
+    limiter = get_rate_limiter()
+    try:
+        history = [{"role": msg.role, "content": msg.content} for msg in request.conversation_history]
+        rag_pipeline = get_rag_pipeline()
+        # Wait for the LLM token here, on the event loop, rather than in a worker
+        await limiter.acquire_async(rag_pipeline.llm_handler.rate_limit_key)
+        events = await in_threadpool(rag_pipeline.stream_query, request.student_id, request.message, history)
+    except UPSTREAM_UNAVAILABLE as e:
+        limiter.return_unused()
+        duration_ms = (time.perf_counter() - start) * 1000
+        if capture:
+            recorder.record_chat("/chat/stream", request, 503, started_at, duration_ms, 0)
+        if transcripts is not None:
+            transcripts.record_turn("/chat/stream", request.student_id, request.message, 503, started_at, duration_ms, usage)
+        raise unavailable(e)
+    except Exception as e:
+        limiter.return_unused()
+        duration_ms = (time.perf_counter() - start) * 1000
+        if capture:
+            recorder.record_chat("/chat/stream", request, 500, started_at, duration_ms, 0)
+        if transcripts is not None:
+            transcripts.record_turn("/chat/stream", request.student_id, request.message, 500, started_at, duration_ms, usage)
+        raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
+    
+    previous_digest = history_digest(history)
+    
+    def ndjson():
+        first_token_ms, response_chars, status = None, 0, 200
+        parts, category = [], None
+        try:
+            for event in events:
+                if event["type"] == "token":
+                    if first_token_ms is None:
+                        first_token_ms = (time.perf_counter() - start) * 1000
+                    response_chars += len(event["content"])
+                    parts.append(event["content"])
+                elif event["type"] == "start":
+                    category = event["performance_category"]
+                elif event["type"] == "done":
+                    event["history_digest"] = history_digest(event["new_messages"], previous_digest)
+                elif event["type"] == "error":
+                    status = 500
+                yield json.dumps(event) + "\n"
+            if capture:
+                recorder.record_chat(
+                    "/chat/stream", request, status, started_at,
+                    (time.perf_counter() - start) * 1000, response_chars, first_token_ms
+                )
+        except GeneratorExit:
+            status = 499  # client went away mid-answer
+            raise
+        finally:
+            limiter.return_unused()
+            duration_ms = (time.perf_counter() - start) * 1000
+            if transcripts is not None:
+                transcripts.record_turn(
+                    "/chat/stream", request.student_id, request.message, status, started_at,
+                    duration_ms, usage, "".join(parts), category, len(history), first_token_ms
+                )
+            # Server-Timing went out with the headers, before the LLM call; log the
+            # full span tree (including the streamed upstream call) once the body ends
+            logger.info("stream completed", extra={
+                "path": "/chat/stream",
+                "status": status,
+                "duration_ms": round(duration_ms, 3),
+                "spans": finished_spans(),
+            })
+    
+    return StreamingResponse(
+        get_profiler().profiled_iter(ndjson()),
+        media_type="application/x-ndjson",
+        # Identity encoding keeps the compression middleware from buffering tokens;
+        # X-Accel-Buffering does the same for nginx in front of the API
+        headers={"Content-Encoding": "identity", "Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.post("/search", response_model=SearchResponse)
+async def search_students(request: SearchRequest):
+    """
+    Semantic student search with metadata filters
+    
+    All queries are embedded in one call and answered in one database round-trip,
+    so dashboards can issue many searches at once.
+    """
+    try:
+        vector_store = get_rag_pipeline().vector_store
+        if len(request.queries) == 1:
+            results = [await in_threadpool(vector_store.search, request.queries[0], request.k, request.filters)]
+        else:
+            results = await in_threadpool(vector_store.search_many, request.queries, request.k, request.filters)
+        return SearchResponse(results=[
+            SearchResult(query=query, students=metadata)
+            for query, (_, metadata) in zip(request.queries, results)
+        ])
+    except UPSTREAM_UNAVAILABLE as e:
+        raise unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching students: {str(e)}")
+
+@app.post("/class/query", response_model=ClassQueryResponse)
+async def class_query(request: ClassQueryRequest):
+    """
+    Answer a question about a whole class (optionally narrowed by filters)
+    
+    Statistics are aggregated locally over every matching student; only
+    narrative questions read students' notes through parallel LLM calls over
+    chunks of the class. Answers are cached until the roster changes.
+    """
+    transcripts = get_transcript_log()
+    usage = start_usage()
+    started_at, start = time.time(), time.perf_counter()
+    
+    def record(status: int, response: str = ""):
+        if transcripts is not None:
+            transcripts.record_turn(
+                "/class/query", None, request.question, status, started_at,
+                (time.perf_counter() - start) * 1000, usage, response
+            )
+    
+    try:
+        result = await in_threadpool(
+            get_rag_pipeline().process_class_query, request.question, request.filters, request.detail
+        )
+    except UPSTREAM_UNAVAILABLE as e:
+        record(503)
+        raise unavailable(e)
+    except Exception as e:
+        record(500)
+        raise HTTPException(status_code=500, detail=f"Error answering class query: {str(e)}")
+    record(200, result["response"])
+    return ClassQueryResponse(**result)
 
 @app.get("/students")
 async def list_students():
     """Get list of all available student IDs"""
+    replica = get_replica()
+    if replica is not None and replica.is_fresh():
+        return {"students": replica.list_students()}
     from src.utils import load_student_data
     students = load_student_data()
     return {
@@ -120,6 +454,52 @@ async def list_students():
         ]
     }
 
+@app.post("/students/{student_id}/prefetch")
+async def prefetch_student(student_id: str, speculate: Optional[bool] = None):
+    """
+    Warm up a student's first turn (call when the student is selected)
+    
+    Loads the record and renders the prompt context into the cache; with
+    `speculate` (default PREFETCH_SPECULATE) the answer to the usual opening
+    question is generated in the background, so asking it is served warm.
+    """
+    if speculate is None:
+        speculate = config.PREFETCH_SPECULATE
+    try:
+        result = await in_threadpool(get_rag_pipeline().prefetch, student_id, speculate)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error prefetching student: {str(e)}")
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"Student {student_id} not found")
+    return {"student_id": student_id, **result}
+
+@app.get("/students/{student_id}/similar")
+async def similar_students(student_id: str, k: int = 5):
+    """Students most similar to this one, from the graph precomputed at index build"""
+    graph = await in_threadpool(get_similarity_graph)
+    if graph is None:
+        raise HTTPException(status_code=404, detail="Similarity graph not built yet (run the indexer)")
+    similar = graph.similar(student_id, k)
+    if similar is None:
+        raise HTTPException(status_code=404, detail=f"Student {student_id} not found")
+    return {"student_id": student_id, "similar": similar}
+
+@app.post("/admin/profile", dependencies=[Depends(require_admin)])
+async def arm_profiler(requests: int = 10, interval: float = 0.005):
+    """Capture a sampling CPU profile of the next N requests"""
+    get_profiler().arm(requests, interval)
+    return {"message": f"Profiling the next {requests} requests", "interval": interval}
+
+@app.get("/admin/profile", dependencies=[Depends(require_admin)])
+async def profile_report(top: int = 25):
+    """Summary of the captured profile (hottest functions by self samples)"""
+    return get_profiler().report(top)
+
+@app.get("/admin/profile/collapsed", response_class=PlainTextResponse, dependencies=[Depends(require_admin)])
+async def profile_collapsed():
+    """Captured samples as collapsed stacks (load into speedscope or flamegraph.pl)"""
+    return get_profiler().collapsed()
+
 @app.post("/reset-conversation")
 async def reset_conversation():
     """Reset conversation (for new chat session)"""
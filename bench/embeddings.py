@@ -0,0 +1,86 @@
+"""
+Latency and throughput of the remote embedding API vs the local ONNX backend.
+
+    python -m bench.embeddings --backends remote,onnx --single 50 --batch 256
+
+Single-text latency is what a chat query pays; batch throughput is what
+index builds pay. Also reports cosine agreement between backends on the
+same texts, to confirm the vectors are interchangeable in one index.
+"""
+import argparse
+import json
+import statistics
+import time
+from typing import Any, Dict, List
+import numpy as np
+from bench.roster import generate_roster
+from src.utils import format_student_data_for_embedding
+
+
+def make_backend(name: str):
+    if name == "onnx":
+        from src.onnx_embeddings import OnnxEmbeddingModel
+        return OnnxEmbeddingModel()
+    from src.embeddings import EmbeddingModel
+    return EmbeddingModel()
+
+
+def bench_backend(model, texts: List[str], single: int, batch: int) -> Dict[str, Any]:
+    # Warm-up (connection / session initialization)
+    model.embed_text(texts[0])
+
+    latencies = []
+    for text in texts[:single]:
+        start = time.perf_counter()
+        model.embed_text(text)
+        latencies.append(time.perf_counter() - start)
+    latencies.sort()
+
+    batch_texts = texts[:batch]
+    start = time.perf_counter()
+    if hasattr(model, "pool"):
+        model.embed_texts(batch_texts)
+    else:
+        # The remote embed_texts throttles between calls; measure raw API cost
+        for text in batch_texts:
+            model.embed_text(text)
+    elapsed = time.perf_counter() - start
+    return {
+        "single_ms": {
+            "p50": round(statistics.median(latencies) * 1000, 2),
+            "p95": round(latencies[int(0.95 * (len(latencies) - 1))] * 1000, 2),
+            "mean": round(statistics.fmean(latencies) * 1000, 2),
+        },
+        "batch_texts": len(batch_texts),
+        "batch_seconds": round(elapsed, 3),
+        "throughput_texts_per_s": round(len(batch_texts) / elapsed, 2),
+    }
+
+
+def agreement(a, b, texts: List[str]) -> float:
+    """Mean cosine similarity between two backends' vectors for the same texts"""
+    va = np.array([a.embed_text(t) for t in texts], dtype=np.float32)
+    vb = np.array([b.embed_text(t) for t in texts], dtype=np.float32)
+    va /= np.linalg.norm(va, axis=1, keepdims=True)
+    vb /= np.linalg.norm(vb, axis=1, keepdims=True)
+    return float(np.mean(np.sum(va * vb, axis=1)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare embedding backends")
+    parser.add_argument("--backends", default="remote,onnx")
+    parser.add_argument("--single", type=int, default=50, help="texts for single-call latency")
+    parser.add_argument("--batch", type=int, default=256, help="texts for batch throughput")
+    args = parser.parse_args()
+
+    texts = [format_student_data_for_embedding(s) for s in generate_roster(max(args.single, args.batch), seed=1)]
+    models = {name: make_backend(name) for name in args.backends.split(",")}
+    report = {name: bench_backend(model, texts, args.single, args.batch) for name, model in models.items()}
+    if len(models) == 2:
+        a, b = models.values()
+        report["cosine_agreement"] = round(agreement(a, b, texts[:20]), 5)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
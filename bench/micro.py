@@ -0,0 +1,201 @@
+"""
+Scaling micro-benchmarks for the student data path.
+
+    python -m bench.micro --sizes 10000,100000,1000000 --save my-branch
+    python -m bench.micro --sizes 10000,100000 --compare my-branch
+
+Each benchmark runs against a synthetic roster (bench/roster.py) of every
+requested size and reports the best wall time over `--repeats` runs and the
+peak Python heap allocation (tracemalloc, measured in a separate run so it
+does not skew timings). Baselines are stored in bench/baselines/<name>.json.
+"""
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from typing import Any, Callable, Dict, List, Optional
+from bench.roster import generate_roster
+from src.utils import calculate_average_marks, format_student_data_for_embedding
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+EMBEDDING_DIM = 384
+FAISS_QUERIES = 100
+
+
+def measure(fn: Callable[[], Any], repeats: int) -> Dict[str, float]:
+    """Best/median wall time and peak traced memory of fn()"""
+    timings = []
+    for _ in range(repeats):
+        gc.collect()
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    gc.collect()
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "best_s": min(timings),
+        "median_s": statistics.median(timings),
+        "peak_mb": peak / (1024 * 1024),
+    }
+
+
+def bench_format(roster: List[Dict[str, Any]]) -> Callable[[], Any]:
+    return lambda: [format_student_data_for_embedding(s) for s in roster]
+
+
+def bench_average(roster: List[Dict[str, Any]]) -> Callable[[], Any]:
+    return lambda: [calculate_average_marks(s["subjects"]) for s in roster]
+
+
+def bench_students_json(roster: List[Dict[str, Any]]) -> Callable[[], Any]:
+    """What GET /students does: project id/name then serialize"""
+    def run():
+        body = {"students": [{"student_id": s["student_id"], "name": s["name"]} for s in roster]}
+        return json.dumps(body)
+    return run
+
+
+def bench_students_encoder(roster: List[Dict[str, Any]]) -> Optional[Callable[[], Any]]:
+    """Same as above through FastAPI's jsonable_encoder (the path an untyped route takes)"""
+    try:
+        from fastapi.encoders import jsonable_encoder
+    except ImportError:
+        return None
+
+    def run():
+        body = {"students": [{"student_id": s["student_id"], "name": s["name"]} for s in roster]}
+        return json.dumps(jsonable_encoder(body))
+    return run
+
+
+def bench_faiss_search(roster: List[Dict[str, Any]]) -> Optional[Callable[[], Any]]:
+    """Exact L2 search of FAISS_QUERIES queries (k=5) over one vector per student"""
+    try:
+        import faiss
+        import numpy as np
+    except ImportError:
+        return None
+    rng = np.random.default_rng(0)
+    index = faiss.IndexFlatL2(EMBEDDING_DIM)
+    # Add in chunks so building a 1M index doesn't double peak memory
+    for start in range(0, len(roster), 50000):
+        count = min(50000, len(roster) - start)
+        index.add(rng.standard_normal((count, EMBEDDING_DIM), dtype=np.float32))
+    queries = rng.standard_normal((FAISS_QUERIES, EMBEDDING_DIM), dtype=np.float32)
+    return lambda: index.search(queries, 5)
+
+
+BENCHMARKS = {
+    "format_student_data_for_embedding": bench_format,
+    "calculate_average_marks": bench_average,
+    "students_endpoint_json": bench_students_json,
+    "students_endpoint_jsonable_encoder": bench_students_encoder,
+    "faiss_flat_search_100q": bench_faiss_search,
+}
+
+
+def run_benchmarks(sizes: List[int], repeats: int, selected: Optional[List[str]] = None,
+                   subject_count: int = 4, note_words: int = 25) -> Dict[str, Any]:
+    results: Dict[str, Dict[str, Any]] = {}
+    for size in sizes:
+        roster = generate_roster(size, seed=0, subject_count=subject_count, note_words=note_words)
+        for name, factory in BENCHMARKS.items():
+            if selected and name not in selected:
+                continue
+            fn = factory(roster)
+            if fn is None:
+                print(f"  skip {name} (optional dependency missing)")
+                continue
+            stats = measure(fn, repeats)
+            stats["per_item_us"] = stats["best_s"] / size * 1e6
+            results.setdefault(name, {})[str(size)] = stats
+            print(f"  {name:<38} n={size:<9} best={stats['best_s'] * 1000:10.2f} ms  "
+                  f"per-item={stats['per_item_us']:8.3f} us  peak={stats['peak_mb']:8.1f} MB")
+            del fn
+        del roster
+        gc.collect()
+    return {"meta": _metadata(sizes, repeats, subject_count, note_words), "results": results}
+
+
+def _metadata(sizes: List[int], repeats: int, subject_count: int, note_words: int) -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "sizes": sizes,
+        "repeats": repeats,
+        "subjects": subject_count,
+        "note_words": note_words,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+
+def save_baseline(name: str, report: Dict[str, Any]):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(f"Baseline saved to {path}")
+
+
+def compare(name: str, report: Dict[str, Any], threshold: float) -> bool:
+    """Print current/baseline ratios; return False if anything regressed past threshold"""
+    with open(os.path.join(BASELINE_DIR, f"{name}.json"), "r", encoding="utf-8") as f:
+        baseline = json.load(f)
+    ok = True
+    print(f"\nComparison against baseline '{name}' (commit {baseline['meta'].get('commit')}):")
+    for bench, by_size in report["results"].items():
+        for size, stats in by_size.items():
+            base = baseline["results"].get(bench, {}).get(size)
+            if not base:
+                continue
+            time_ratio = stats["best_s"] / base["best_s"] if base["best_s"] else float("inf")
+            mem_ratio = stats["peak_mb"] / base["peak_mb"] if base["peak_mb"] else 1.0
+            flag = ""
+            if time_ratio > threshold or mem_ratio > threshold:
+                flag = "  <-- REGRESSION"
+                ok = False
+            print(f"  {bench:<38} n={size:<9} time x{time_ratio:5.2f}  memory x{mem_ratio:5.2f}{flag}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Data-path scaling micro-benchmarks")
+    parser.add_argument("--sizes", default="10000,100000", help="comma-separated roster sizes")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--only", default=None, help="comma-separated benchmark names")
+    parser.add_argument("--subjects", type=int, default=4)
+    parser.add_argument("--note-words", type=int, default=25)
+    parser.add_argument("--save", default=None, help="save results as baseline NAME")
+    parser.add_argument("--compare", default=None, help="compare against baseline NAME")
+    parser.add_argument("--threshold", type=float, default=1.2, help="regression ratio for --compare")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(",")]
+    report = run_benchmarks(
+        sizes,
+        args.repeats,
+        selected=args.only.split(",") if args.only else None,
+        subject_count=args.subjects,
+        note_words=args.note_words,
+    )
+    if args.save:
+        save_baseline(args.save, report)
+    if args.compare and not compare(args.compare, report, args.threshold):
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,127 @@
+"""
+Deterministic synthetic roster generator.
+
+    python -m bench.roster --count 100000 --subjects 8 --output data/roster_100k.jsonl
+
+Records have the same shape as data/student_data.json. The same seed and
+parameters always produce byte-identical output, so benchmark baselines are
+comparable between commits. `.jsonl` output is written record by record, so
+million-student rosters never sit in memory at once.
+"""
+import argparse
+import json
+import random
+from typing import Any, Dict, Iterator, List, Optional
+
+SUBJECT_POOL = [
+    "Mathematics", "Physics", "Programming", "English", "Chemistry", "Biology",
+    "Statistics", "Databases", "Networks", "Operating Systems", "Economics",
+    "Discrete Structures", "Linear Algebra", "Software Engineering", "History",
+    "Psychology",
+]
+FIRST_NAMES = ["Ahmed", "Fatima", "Ali", "Ayesha", "Hassan", "Zainab", "Usman", "Maryam",
+               "Bilal", "Sara", "Omar", "Hina", "Zeeshan", "Noor", "Hamza", "Amna"]
+LAST_NAMES = ["Khan", "Ali", "Ahmed", "Malik", "Hussain", "Sheikh", "Raza", "Butt",
+              "Qureshi", "Siddiqui", "Chaudhry", "Mirza"]
+NOTE_WORDS = ("shows strong consistent improvement needs attention in assignments participation "
+              "analytical skills communication attendance effort excellent average below expectations "
+              "programming mathematics lab work group projects deadlines motivated").split()
+
+
+def _bounded_gauss(rng: random.Random, mean: float, sd: float, low: float, high: float) -> float:
+    return min(high, max(low, rng.gauss(mean, sd)))
+
+
+def generate_student(
+    index: int,
+    rng: random.Random,
+    subject_count: int = 4,
+    note_words: int = 25,
+    marks_mean: float = 72,
+    marks_sd: float = 14,
+    attendance_mean: float = 82,
+    attendance_sd: float = 10,
+    semesters: int = 8,
+) -> Dict[str, Any]:
+    """Generate one student record"""
+    subjects = rng.sample(SUBJECT_POOL, min(subject_count, len(SUBJECT_POOL)))
+    total_assignments = rng.choice([10, 15, 20, 25])
+    # Correlate marks within a student so performance categories are realistic
+    ability = rng.gauss(0, marks_sd * 0.7)
+    return {
+        "student_id": f"S{index + 1:07d}",
+        "name": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "semester": rng.randint(1, semesters),
+        "subjects": {
+            subject: {
+                "marks": int(round(_bounded_gauss(rng, marks_mean + ability, marks_sd * 0.7, 0, 100))),
+                "total": 100,
+            }
+            for subject in subjects
+        },
+        "attendance": int(round(_bounded_gauss(rng, attendance_mean, attendance_sd, 0, 100))),
+        "assignments_submitted": rng.randint(total_assignments // 2, total_assignments),
+        "total_assignments": total_assignments,
+        "performance_notes": " ".join(rng.choice(NOTE_WORDS) for _ in range(note_words)).capitalize() + ".",
+    }
+
+
+def iter_roster(count: int, seed: int = 0, **kwargs) -> Iterator[Dict[str, Any]]:
+    """Lazily yield `count` students"""
+    rng = random.Random(seed)
+    for i in range(count):
+        yield generate_student(i, rng, **kwargs)
+
+
+def generate_roster(count: int, seed: int = 0, **kwargs) -> List[Dict[str, Any]]:
+    """Generate a full roster in memory"""
+    return list(iter_roster(count, seed, **kwargs))
+
+
+def write_roster(path: str, count: int, seed: int = 0, **kwargs):
+    """Write a roster as a JSON array (.json) or one record per line (.jsonl)"""
+    with open(path, "w", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for student in iter_roster(count, seed, **kwargs):
+                f.write(json.dumps(student))
+                f.write("\n")
+            return
+        f.write("[\n")
+        for i, student in enumerate(iter_roster(count, seed, **kwargs)):
+            if i:
+                f.write(",\n")
+            f.write(json.dumps(student))
+        f.write("\n]\n")
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Generate a synthetic student roster")
+    parser.add_argument("--count", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--subjects", type=int, default=4, help="subjects per student")
+    parser.add_argument("--note-words", type=int, default=25, help="words in performance_notes")
+    parser.add_argument("--marks-mean", type=float, default=72)
+    parser.add_argument("--marks-sd", type=float, default=14)
+    parser.add_argument("--attendance-mean", type=float, default=82)
+    parser.add_argument("--attendance-sd", type=float, default=10)
+    parser.add_argument("--semesters", type=int, default=8)
+    parser.add_argument("--output", required=True, help=".json or .jsonl path")
+    args = parser.parse_args(argv)
+
+    write_roster(
+        args.output,
+        args.count,
+        seed=args.seed,
+        subject_count=args.subjects,
+        note_words=args.note_words,
+        marks_mean=args.marks_mean,
+        marks_sd=args.marks_sd,
+        attendance_mean=args.attendance_mean,
+        attendance_sd=args.attendance_sd,
+        semesters=args.semesters,
+    )
+    print(f"Wrote {args.count} students to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,12 +1,40 @@
+import argparse
 from src.supabase_vector_store import get_vector_store
+from src.keep_warm import wait_for_models
+from src.rate_limiter import reserve_for_api
 
-print("=" * 60)
-print("Creating vector embeddings from Supabase students...")
-print("=" * 60)
+parser = argparse.ArgumentParser(description="Build a new index version and switch searches to it")
+parser.add_argument("--no-activate", action="store_true", help="build and validate, but keep the current version live")
+parser.add_argument("--activate", type=int, metavar="VERSION", help="switch to a validated or retired version (rollback)")
+parser.add_argument("--list", action="store_true", help="list index versions")
+parser.add_argument("--gc", action="store_true", help="delete failed and expired retired versions")
+args = parser.parse_args()
 
 vector_store = get_vector_store()
-vector_store.create_index()
 
-print("\n" + "=" * 60)
-print("✅ Embeddings created successfully!")
-print("=" * 60)
\ No newline at end of file
+if args.list:
+    for v in vector_store.list_index_versions():
+        print(f"{v['version']:>12}  {v['status']:<10} rows={v['rows']} recall={v['recall']} created={v['created_at']}")
+elif args.activate is not None:
+    vector_store.activate_index_version(args.activate)
+    print(f"✅ Index version {args.activate} is now active")
+elif args.gc:
+    deleted = vector_store.collect_index_garbage()
+    print(f"✅ Deleted index versions: {deleted or 'none'}")
+else:
+    print("=" * 60)
+    print("Creating vector embeddings from Supabase students...")
+    print("=" * 60)
+
+    wait_for_models()
+    reserve_for_api()
+    version = vector_store.create_index(activate=not args.no_activate)
+
+    print("\n" + "=" * 60)
+    if version is None:
+        print("⚠️ No students found, nothing to index")
+    elif args.no_activate:
+        print(f"✅ Index version {version} built and validated (not active)")
+    else:
+        print(f"✅ Embeddings created successfully! Index version {version} is active")
+    print("=" * 60)
@@ -0,0 +1,169 @@
+"""
+Open-loop load driver for the /chat endpoint.
+
+    python -m loadtest.driver --url http://127.0.0.1:8000 --rps 20 --duration 60 --scenario multi_turn
+
+Requests are issued on a fixed schedule regardless of how fast earlier ones
+complete, and latency is measured from the scheduled send time, so a slow
+server cannot hide its queueing delay (no coordinated omission).
+"""
+import argparse
+import json
+import math
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import requests
+
+OPENING_QUESTIONS = [
+    "How is this student performing?",
+    "Hi",
+    "What subjects need improvement?",
+    "Show attendance details",
+]
+FOLLOW_UPS = [
+    "What about Mathematics specifically?",
+    "How can we improve performance?",
+    "Compare performance across all subjects",
+    "Why is attendance low?",
+]
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, math.ceil(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[rank]
+
+
+def build_payload(scenario: str, student_ids: List[str], rng: random.Random) -> Dict[str, Any]:
+    """Build one /chat request body for the scenario"""
+    student_id = rng.choice(student_ids)
+    if scenario == "single_turn":
+        turns = 0
+    elif scenario == "multi_turn":
+        turns = rng.randint(1, 10)
+    else:  # mixed
+        turns = 0 if rng.random() < 0.5 else rng.randint(1, 10)
+    history = []
+    for _ in range(turns):
+        history.append({"role": "user", "content": rng.choice(FOLLOW_UPS)})
+        history.append({"role": "assistant", "content": "Stub answer " * rng.randint(20, 120)})
+    message = rng.choice(FOLLOW_UPS if turns else OPENING_QUESTIONS)
+    return {"student_id": student_id, "message": message, "conversation_history": history}
+
+
+class LoadResult:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies: List[float] = []
+        self.statuses: Dict[str, int] = {}
+        self.bytes_received = 0
+
+    def record(self, latency: float, status: str, size: int = 0):
+        with self.lock:
+            self.latencies.append(latency)
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+            self.bytes_received += size
+
+    def summary(self, elapsed: float) -> Dict[str, Any]:
+        latencies = sorted(self.latencies)
+        total = len(latencies)
+        ok = self.statuses.get("200", 0)
+        return {
+            "requests": total,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(ok / elapsed, 3) if elapsed else 0,
+            "error_rate": round((total - ok) / total, 4) if total else 0,
+            "statuses": dict(sorted(self.statuses.items())),
+            "latency_ms": {
+                "p50": round(percentile(latencies, 50) * 1000, 2),
+                "p95": round(percentile(latencies, 95) * 1000, 2),
+                "p99": round(percentile(latencies, 99) * 1000, 2),
+                "max": round(latencies[-1] * 1000, 2) if latencies else 0,
+                "mean": round(sum(latencies) / total * 1000, 2) if total else 0,
+            },
+            "bytes_per_request": round(self.bytes_received / total) if total else 0,
+        }
+
+
+def run_load(
+    url: str,
+    rps: float,
+    duration: float,
+    scenario: str = "mixed",
+    student_ids: Optional[List[str]] = None,
+    timeout: float = 60,
+    max_workers: int = 256,
+    seed: int = 0,
+) -> Dict[str, Any]:
+    """Drive /chat at a fixed arrival rate and return the latency summary"""
+    rng = random.Random(seed)
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    if not student_ids:
+        student_ids = [s["student_id"] for s in session.get(f"{url}/students", timeout=timeout).json()["students"]]
+
+    result = LoadResult()
+
+    def fire(scheduled: float, payload: Dict[str, Any]):
+        try:
+            response = session.post(f"{url}/chat", json=payload, timeout=timeout)
+            result.record(time.perf_counter() - scheduled, str(response.status_code), len(response.content))
+        except requests.exceptions.Timeout:
+            result.record(time.perf_counter() - scheduled, "timeout")
+        except requests.exceptions.RequestException:
+            result.record(time.perf_counter() - scheduled, "connection_error")
+
+    total_requests = int(rps * duration)
+    interval = 1.0 / rps
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for i in range(total_requests):
+            scheduled = start + i * interval
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(fire, scheduled, build_payload(scenario, student_ids, rng))
+    elapsed = time.perf_counter() - start
+    summary = result.summary(elapsed)
+    summary.update({"scenario": scenario, "target_rps": rps})
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the /chat endpoint")
+    parser.add_argument("--url", default="http://127.0.0.1:8000")
+    parser.add_argument("--rps", type=float, default=10)
+    parser.add_argument("--duration", type=float, default=30, help="seconds")
+    parser.add_argument("--scenario", choices=["single_turn", "multi_turn", "mixed"], default="mixed")
+    parser.add_argument("--students", default=None, help="comma-separated student IDs (default: GET /students)")
+    parser.add_argument("--timeout", type=float, default=60)
+    parser.add_argument("--max-workers", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=None, help="write the JSON summary to this file")
+    args = parser.parse_args()
+
+    summary = run_load(
+        args.url,
+        args.rps,
+        args.duration,
+        scenario=args.scenario,
+        student_ids=args.students.split(",") if args.students else None,
+        timeout=args.timeout,
+        max_workers=args.max_workers,
+        seed=args.seed,
+    )
+    print(json.dumps(summary, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
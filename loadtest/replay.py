@@ -0,0 +1,260 @@
+"""
+Replay captured /chat traffic (see src/capture.py) and compare two runs.
+
+    # 1. record traffic: CAPTURE_ENABLED=true uvicorn api.main:app ...
+    # 2. replay it against a build whose upstreams point at the stubs
+    python -m loadtest.stubs --port 9100 &
+    python -m loadtest.replay run captures/chat.jsonl --url http://127.0.0.1:8000 --speed 1 --output base.jsonl
+    # ... switch builds ...
+    python -m loadtest.replay run captures/chat.jsonl --url http://127.0.0.1:8000 --speed 1 --output head.jsonl
+    python -m loadtest.replay compare base.jsonl head.jsonl --threshold 10
+
+`--speed` scales the recorded inter-arrival gaps (2 = twice as fast); `max`
+sends as fast as `--concurrency` allows. As in loadtest.driver, paced runs
+measure latency from the scheduled send time. Hashed student IDs are mapped
+consistently onto the target's roster, and redacted text / history lengths
+are rebuilt as filler of the recorded size, so prompts keep their shape.
+Leave CAPTURE_ENABLED off on the replay target, or the replay is recorded too.
+`compare` exits non-zero when a latency percentile regresses by more than
+`--threshold` percent.
+"""
+import argparse
+import difflib
+import hashlib
+import json
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+import requests
+from loadtest.driver import LoadResult, percentile
+
+FILLER = "lorem ipsum dolor sit amet consectetur adipiscing elit sed do eiusmod tempor "
+
+
+def load_jsonl(path: str) -> List[Dict[str, Any]]:
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def filler(chars: int) -> str:
+    repeats = chars // len(FILLER) + 1
+    return (FILLER * repeats)[:chars]
+
+
+def map_student(captured_id: str, roster: List[str]) -> str:
+    """Same captured student -> same target student, spread evenly over the roster"""
+    if captured_id in roster:
+        return captured_id
+    digest = hashlib.sha256(captured_id.encode("utf-8")).digest()
+    return roster[int.from_bytes(digest[:8], "big") % len(roster)]
+
+
+def build_payload(entry: Dict[str, Any], roster: List[str]) -> Dict[str, Any]:
+    return {
+        "student_id": map_student(entry["student_id"], roster),
+        "message": entry["message"],
+        "conversation_history": [
+            {"role": turn["role"], "content": filler(turn["chars"])} for turn in entry.get("history", [])
+        ],
+        "response_mode": entry.get("response_mode", "full"),
+    }
+
+
+def send(session: requests.Session, url: str, entry: Dict[str, Any], payload: Dict[str, Any],
+         timeout: float, started: float) -> Dict[str, Any]:
+    """Issue one request; latency is measured from `started` (the scheduled time when paced)"""
+    endpoint = entry.get("endpoint", "/chat")
+    outcome: Dict[str, Any] = {"endpoint": endpoint}
+    try:
+        if endpoint == "/chat/stream":
+            parts, first_token = [], None
+            with session.post(f"{url}{endpoint}", json=payload, stream=True, timeout=timeout) as response:
+                outcome["status"] = str(response.status_code)
+                for line in response.iter_lines(decode_unicode=True):
+                    if not line:
+                        continue
+                    event = json.loads(line)
+                    if event["type"] == "token":
+                        if first_token is None:
+                            first_token = time.perf_counter() - started
+                        parts.append(event["content"])
+                    elif event["type"] == "error":
+                        outcome["status"] = "stream_error"
+            outcome["response"] = "".join(parts).strip()
+            if first_token is not None:
+                outcome["first_token_ms"] = round(first_token * 1000, 3)
+        else:
+            response = session.post(f"{url}{endpoint}", json=payload, timeout=timeout)
+            outcome["status"] = str(response.status_code)
+            outcome["response"] = response.json().get("response") if response.status_code == 200 else response.text[:500]
+            outcome["bytes"] = len(response.content)
+    except requests.exceptions.Timeout:
+        outcome["status"] = "timeout"
+    except requests.exceptions.RequestException:
+        outcome["status"] = "connection_error"
+    outcome["latency_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return outcome
+
+
+def run_replay(
+    capture_path: str,
+    url: str,
+    speed: Optional[float] = 1.0,
+    concurrency: int = 64,
+    timeout: float = 60,
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """Replay a capture; speed=None means as fast as possible"""
+    entries = sorted(load_jsonl(capture_path), key=lambda e: e["ts"])[:limit]
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    roster = [s["student_id"] for s in session.get(f"{url}/students", timeout=timeout).json()["students"]]
+    if not roster:
+        raise SystemExit("Target returned an empty roster")
+
+    results: List[Optional[Dict[str, Any]]] = [None] * len(entries)
+    lock = threading.Lock()
+
+    def fire(index: int, entry: Dict[str, Any], scheduled: Optional[float]):
+        started = scheduled if scheduled is not None else time.perf_counter()
+        outcome = send(session, url, entry, build_payload(entry, roster), timeout, started)
+        outcome["index"] = index
+        outcome["recorded_ms"] = entry.get("duration_ms")
+        with lock:
+            results[index] = outcome
+
+    first_ts = entries[0]["ts"] if entries else 0
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for index, entry in enumerate(entries):
+            scheduled = None
+            if speed:
+                scheduled = start + (entry["ts"] - first_ts) / speed
+                delay = scheduled - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+            pool.submit(fire, index, entry, scheduled)
+    return results
+
+
+def summarize(results: List[Dict[str, Any]], elapsed: Optional[float] = None) -> Dict[str, Any]:
+    load = LoadResult()
+    for outcome in results:
+        load.record(outcome["latency_ms"] / 1000, outcome["status"], outcome.get("bytes", 0))
+    summary = load.summary(elapsed or 1.0)
+    if elapsed is None:
+        summary.pop("elapsed_s")
+        summary.pop("throughput_rps")
+    first_tokens = sorted(o["first_token_ms"] for o in results if "first_token_ms" in o)
+    if first_tokens:
+        summary["first_token_ms"] = {
+            "p50": percentile(first_tokens, 50),
+            "p95": percentile(first_tokens, 95),
+            "p99": percentile(first_tokens, 99),
+        }
+    return summary
+
+
+def ks_statistic(a: List[float], b: List[float]) -> float:
+    """Two-sample Kolmogorov-Smirnov D: max gap between the empirical CDFs"""
+    a, b = sorted(a), sorted(b)
+    i = j = 0
+    d = 0.0
+    while i < len(a) and j < len(b):
+        x = min(a[i], b[j])
+        while i < len(a) and a[i] <= x:
+            i += 1
+        while j < len(b) and b[j] <= x:
+            j += 1
+        d = max(d, abs(i / len(a) - j / len(b)))
+    return round(d, 4)
+
+
+def compare(base: List[Dict[str, Any]], head: List[Dict[str, Any]], threshold: float, max_diffs: int = 5) -> Dict[str, Any]:
+    """Latency distribution shift and response differences between two replays of the same capture"""
+    base_summary, head_summary = summarize(base), summarize(head)
+    latency_change = {}
+    regressions = []
+    for metric in ("latency_ms", "first_token_ms"):
+        if metric not in base_summary or metric not in head_summary:
+            continue
+        for pct in ("p50", "p95", "p99"):
+            before, after = base_summary[metric][pct], head_summary[metric][pct]
+            change = round((after - before) / before * 100, 2) if before else 0.0
+            latency_change[f"{metric}.{pct}"] = {"base": before, "head": after, "change_pct": change}
+            if change > threshold:
+                regressions.append(f"{metric}.{pct}")
+
+    by_index = {o["index"]: o for o in head}
+    status_changes, response_changes, diffs = 0, 0, []
+    for before in base:
+        after = by_index.get(before["index"])
+        if after is None:
+            continue
+        if before["status"] != after["status"]:
+            status_changes += 1
+        if before.get("response") != after.get("response"):
+            response_changes += 1
+            if len(diffs) < max_diffs:
+                diffs.append({
+                    "index": before["index"],
+                    "diff": "\n".join(difflib.unified_diff(
+                        (before.get("response") or "").splitlines(),
+                        (after.get("response") or "").splitlines(),
+                        "base", "head", lineterm="", n=1,
+                    ))[:2000],
+                })
+    return {
+        "requests": {"base": len(base), "head": len(head)},
+        "latency": latency_change,
+        "ks_statistic": ks_statistic([o["latency_ms"] for o in base], [o["latency_ms"] for o in head]),
+        "status_changes": status_changes,
+        "response_changes": response_changes,
+        "sample_diffs": diffs,
+        "regressions": regressions,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay captured /chat traffic and compare builds")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="replay a capture against a server")
+    run.add_argument("capture")
+    run.add_argument("--url", default="http://127.0.0.1:8000")
+    run.add_argument("--speed", default="1", help="time scale for recorded gaps, or 'max'")
+    run.add_argument("--concurrency", type=int, default=64)
+    run.add_argument("--timeout", type=float, default=60)
+    run.add_argument("--limit", type=int, default=None, help="replay only the first N requests")
+    run.add_argument("--output", default=None, help="write per-request results (JSONL) for compare")
+
+    cmp = commands.add_parser("compare", help="compare two replay outputs")
+    cmp.add_argument("base")
+    cmp.add_argument("head")
+    cmp.add_argument("--threshold", type=float, default=10.0, help="allowed percentile slowdown, percent")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        speed = None if args.speed == "max" else float(args.speed)
+        start = time.perf_counter()
+        results = run_replay(args.capture, args.url, speed, args.concurrency, args.timeout, args.limit)
+        summary = summarize(results, time.perf_counter() - start)
+        summary["speed"] = args.speed
+        print(json.dumps(summary, indent=2))
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                for outcome in results:
+                    f.write(json.dumps(outcome) + "\n")
+    else:
+        report = compare(load_jsonl(args.base), load_jsonl(args.head), args.threshold)
+        print(json.dumps(report, indent=2))
+        if report["regressions"]:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,603 @@
+"""
+Local stand-ins for the HuggingFace router and Supabase REST/RPC APIs.
+
+One server answers all three upstreams (plus a minimal Supabase Storage) so the API can be load tested offline:
+
+    python -m loadtest.stubs --port 9100 --chat-latency lognormal:1500:0.4 --chat-503-rate 0.02
+
+then start the API with
+
+    HF_API_KEY=stub SUPABASE_KEY=stub.stub.stub SUPABASE_URL=http://127.0.0.1:9100 \\
+    HF_ROUTER_ENDPOINT=http://127.0.0.1:9100/hf-inference/models \\
+    HF_CHAT_COMPLETIONS_ENDPOINT=http://127.0.0.1:9100/v1/chat/completions \\
+    uvicorn api.main:app --port 8000
+
+Latency specs: `fixed:MS`, `uniform:LO_MS:HI_MS`, `normal:MEAN_MS:SD_MS`,
+`lognormal:MEDIAN_MS:SIGMA`.
+"""
+import argparse
+import email.parser
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import urlparse, parse_qs
+
+EMBEDDING_DIM = 384
+
+
+def parse_latency(spec: str) -> Callable[[], float]:
+    """Turn a latency spec into a sampler returning seconds"""
+    kind, *params = spec.split(":")
+    values = [float(p) for p in params]
+    if kind == "fixed":
+        return lambda: values[0] / 1000
+    if kind == "uniform":
+        return lambda: random.uniform(values[0], values[1]) / 1000
+    if kind == "normal":
+        return lambda: max(0.0, random.gauss(values[0], values[1])) / 1000
+    if kind == "lognormal":
+        mu = math.log(values[0])
+        return lambda: random.lognormvariate(mu, values[1]) / 1000
+    raise ValueError(f"Unknown latency spec: {spec}")
+
+
+@dataclass
+class StubConfig:
+    chat_latency: str = "lognormal:1200:0.5"
+    embed_latency: str = "lognormal:80:0.3"
+    supabase_latency: str = "lognormal:40:0.3"
+    chat_503_rate: float = 0.0
+    embed_503_rate: float = 0.0
+    hf_quota_rps: float = 0.0  # 0 = unlimited; otherwise excess HF calls get 429 + Retry-After
+    idle_unload_s: float = 0.0  # 0 = never; otherwise a model idle this long 503s while it reloads
+    load_s: float = 20.0
+    stream_chunk_ms: float = 30.0
+    completion_tokens: int = 120
+    roster_path: str = "./data/student_data.json"
+    seed: Optional[int] = None
+    samplers: Dict[str, Callable[[], float]] = field(default_factory=dict)
+
+    def __post_init__(self):
+        self.samplers = {
+            "chat": parse_latency(self.chat_latency),
+            "embed": parse_latency(self.embed_latency),
+            "supabase": parse_latency(self.supabase_latency),
+        }
+        if self.seed is not None:
+            random.seed(self.seed)
+
+
+def now_iso() -> str:
+    return datetime.now(timezone.utc).isoformat()
+
+
+def fake_embedding(text: str) -> List[float]:
+    """Deterministic unit-norm 384-d vector derived from the text"""
+    rng = random.Random(hashlib.sha256(text.encode("utf-8")).digest())
+    vec = [rng.gauss(0, 1) for _ in range(EMBEDDING_DIM)]
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+class StubState:
+    """Roster and request counters shared by all handler threads"""
+
+    def __init__(self, config: StubConfig):
+        self.config = config
+        with open(config.roster_path, "r", encoding="utf-8") as f:
+            self.students: List[Dict[str, Any]] = json.load(f)
+        self.by_id = {s["student_id"]: s for s in self.students}
+        # Replication versions and tombstones, as sql/replica_sync.sql maintains them
+        self.version = 0
+        self.tombstones: List[Dict[str, Any]] = []
+        for s in self.students:
+            s["version"] = self.next_version()
+        # Pretend the index was already built so reads of student_embeddings work
+        self.embeddings: List[Dict[str, Any]] = [
+            {
+                "student_id": s["student_id"],
+                "student_name": s["name"],
+                "content": json.dumps(s),
+                "metadata": s,
+                "embedding": fake_embedding(s["student_id"]),
+                "version": self.next_version(),
+                "index_version": 0,
+            }
+            for s in self.students
+        ]
+        # Blue/green index versions, as sql/index_versions.sql keeps them
+        self.index_versions: List[Dict[str, Any]] = [
+            {"version": 0, "status": "active", "rows": None, "recall": None,
+             "created_at": now_iso(), "activated_at": now_iso(), "retired_at": None}
+        ]
+        # Supabase Storage objects by (bucket, path)
+        self.objects: Dict[Any, Dict[str, Any]] = {}
+        self.lock = threading.Lock()
+        self.counters: Dict[str, int] = {}
+        self.quota_tokens = config.hf_quota_rps
+        self.quota_updated = time.monotonic()
+        self.model_used = {"chat": time.monotonic(), "embed": time.monotonic()}
+        self.model_loading_until = {"chat": 0.0, "embed": 0.0}
+
+    def next_version(self) -> int:
+        self.version += 1
+        return self.version
+
+    def active_index_version(self) -> int:
+        return next((v["version"] for v in self.index_versions if v["status"] == "active"), 0)
+
+    def tombstone(self, table: str, student_id: str):
+        self.tombstones.append({"table_name": table, "student_id": student_id, "version": self.next_version()})
+
+    def count(self, key: str):
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    def over_quota(self) -> Optional[float]:
+        """Provider-side token bucket (1 s burst); seconds until the next call is allowed"""
+        rate = self.config.hf_quota_rps
+        if not rate:
+            return None
+        with self.lock:
+            now = time.monotonic()
+            self.quota_tokens = min(rate, self.quota_tokens + (now - self.quota_updated) * rate)
+            self.quota_updated = now
+            if self.quota_tokens >= 1:
+                self.quota_tokens -= 1
+                return None
+            return (1 - self.quota_tokens) / rate
+
+    def loading(self, model: str) -> float:
+        """Seconds until a model unloaded after --idle-unload-s is loaded again (0 = ready)"""
+        with self.lock:
+            now = time.monotonic()
+            if self.model_loading_until[model] > now:
+                return max(0.1, round(self.model_loading_until[model] - now, 1))
+            if self.model_loading_until[model]:
+                # Just finished loading
+                self.model_loading_until[model] = 0.0
+                self.model_used[model] = now
+            idle = self.config.idle_unload_s
+            if idle and now - self.model_used[model] > idle:
+                # Any request to an unloaded model starts loading it
+                self.model_loading_until[model] = now + self.config.load_s
+                return self.config.load_s
+            self.model_used[model] = now
+            return 0.0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state: StubState = None  # set by make_server
+
+    def log_message(self, format, *args):
+        pass  # keep the load test output clean
+
+    # --- helpers -------------------------------------------------------
+    def _body(self) -> Any:
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        return json.loads(raw) if raw else None
+
+    def _send_json(self, status: int, payload: Any, headers: Optional[Dict[str, str]] = None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _sleep(self, upstream: str):
+        time.sleep(self.state.config.samplers[upstream]())
+
+    # --- routing -------------------------------------------------------
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/rest/v1/students":
+            return self._supabase_select(self.state.students, parse_qs(url.query))
+        if url.path == "/rest/v1/student_embeddings":
+            return self._supabase_select(self.state.embeddings, parse_qs(url.query))
+        if url.path == "/rest/v1/replica_tombstones":
+            return self._supabase_select(self.state.tombstones, parse_qs(url.query))
+        if url.path == "/rest/v1/index_versions":
+            return self._supabase_select(self.state.index_versions, parse_qs(url.query))
+        if url.path.startswith("/storage/v1/object/"):
+            return self._storage_download(url.path)
+        if url.path == "/_stats":
+            return self._send_json(200, self.state.counters)
+        self._send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path.startswith("/storage/v1/object/") and not url.path.startswith("/storage/v1/object/list/"):
+            return self._storage_upload(url.path)
+        body = self._body()
+        if url.path.startswith("/storage/v1/object/list/"):
+            return self._storage_list(url.path.rsplit("/", 1)[-1], body or {})
+        if url.path == "/v1/chat/completions":
+            return self._chat(body)
+        if url.path.startswith("/hf-inference/models/"):
+            return self._feature_extraction(body)
+        if url.path.startswith("/rest/v1/rpc/"):
+            return self._supabase_rpc(url.path.rsplit("/", 1)[-1], body)
+        if url.path.startswith("/rest/v1/"):
+            self.state.count("supabase.insert")
+            self._sleep("supabase")
+            rows = body if isinstance(body, list) else [body]
+            if url.path.endswith("/student_embeddings"):
+                with self.state.lock:
+                    for row in rows:
+                        row["version"] = self.state.next_version()
+                    self.state.embeddings.extend(rows)
+            elif url.path.endswith("/index_versions"):
+                with self.state.lock:
+                    for row in rows:
+                        row.setdefault("created_at", now_iso())
+                        self.state.index_versions.append(row)
+            elif url.path.endswith("/students"):
+                # Upsert on student_id (Prefer: resolution=merge-duplicates)
+                with self.state.lock:
+                    for row in rows:
+                        row = dict(row, version=self.state.next_version())
+                        if row["student_id"] in self.state.by_id:
+                            self.state.by_id[row["student_id"]].update(row)
+                        else:
+                            self.state.by_id[row["student_id"]] = row
+                            self.state.students.append(row)
+            if "return=minimal" in (self.headers.get("Prefer") or ""):
+                return self._send_json(201, [])
+            return self._send_json(201, rows)
+        self._send_json(404, {"error": "not found"})
+
+    def do_PATCH(self):
+        body = self._body()
+        self.state.count("supabase.update")
+        self._sleep("supabase")
+        url = urlparse(self.path)
+        if url.path.endswith("/index_versions"):
+            with self.state.lock:
+                for row in self._filter(self.state.index_versions, parse_qs(url.query)):
+                    row.update(body)
+        self._send_json(200, [])
+
+    def do_DELETE(self):
+        self._body()  # drain it so the keep-alive connection stays in sync
+        self.state.count("supabase.delete")
+        self._sleep("supabase")
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path.endswith("/student_embeddings"):
+            with self.state.lock:
+                doomed = {id(row) for row in self._filter(self.state.embeddings, query)}
+                active = self.state.active_index_version()
+                kept = []
+                for row in self.state.embeddings:
+                    if id(row) not in doomed:
+                        kept.append(row)
+                    elif row.get("index_version", 0) == active:
+                        # Only the active version leaves tombstones (sql/index_versions.sql)
+                        self.state.tombstone("student_embeddings", row["student_id"])
+                self.state.embeddings[:] = kept
+        elif url.path.endswith("/index_versions"):
+            with self.state.lock:
+                doomed = {id(row) for row in self._filter(self.state.index_versions, query)}
+                self.state.index_versions[:] = [v for v in self.state.index_versions if id(v) not in doomed]
+        self._send_json(200, [])
+
+    # --- Supabase Storage ----------------------------------------------
+    def _storage_key(self, path: str):
+        bucket, _, name = path[len("/storage/v1/object/"):].partition("/")
+        return bucket, name
+
+    def _storage_upload(self, path: str):
+        """Multipart upload (x-upsert: true overwrites)"""
+        self.state.count("storage.upload")
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        message = email.parser.BytesParser().parsebytes(
+            f"Content-Type: {self.headers.get('Content-Type')}\r\n\r\n".encode() + raw
+        )
+        data = next(
+            (part.get_payload(decode=True) for part in message.get_payload() if part.get_param("name", header="content-disposition") == "file"),
+            b"",
+        )
+        key = self._storage_key(path)
+        with self.state.lock:
+            if key in self.state.objects and self.headers.get("x-upsert") != "true":
+                return self._send_json(400, {"statusCode": "409", "error": "Duplicate", "message": "The resource already exists"})
+            self.state.objects[key] = {"data": data, "updated_at": now_iso()}
+        self._send_json(200, {"Key": "/".join(key)})
+
+    def _storage_download(self, path: str):
+        self.state.count("storage.download")
+        obj = self.state.objects.get(self._storage_key(path))
+        if obj is None:
+            return self._send_json(400, {"statusCode": "404", "error": "not_found", "message": "Object not found"})
+        self.send_response(200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(len(obj["data"])))
+        self.end_headers()
+        self.wfile.write(obj["data"])
+
+    def _storage_list(self, bucket: str, body: Dict[str, Any]):
+        self.state.count("storage.list")
+        prefix, search = body.get("prefix") or "", body.get("search") or ""
+        with self.state.lock:
+            listed = [
+                {"name": name[len(prefix):].lstrip("/"), "id": name, "updated_at": obj["updated_at"],
+                 "metadata": {"size": len(obj["data"])}}
+                for (b, name), obj in self.state.objects.items()
+                if b == bucket and name.startswith(prefix) and search in name[len(prefix):]
+            ]
+        self._send_json(200, listed)
+
+    # --- HuggingFace ---------------------------------------------------
+    def _throttled(self, upstream: str) -> bool:
+        wait = self.state.over_quota()
+        if wait is None:
+            return False
+        self.state.count(f"{upstream}.429")
+        self._send_json(429, {"error": "Rate limit reached"}, {"Retry-After": str(max(1, math.ceil(wait)))})
+        return True
+
+    def _chat(self, body: Dict[str, Any]):
+        cfg = self.state.config
+        self._sleep("chat")
+        if self._throttled("chat"):
+            return
+        loading = self.state.loading("chat")
+        if loading or random.random() < cfg.chat_503_rate:
+            self.state.count("chat.503")
+            return self._send_json(503, {"error": "Model is currently loading", "estimated_time": loading or 20.0})
+        self.state.count("chat")
+        prompt_chars = sum(len(m.get("content", "")) for m in body.get("messages", []))
+        words = [f"token{i}" for i in range(min(cfg.completion_tokens, body.get("max_tokens", 512)))]
+        usage = {
+            "prompt_tokens": prompt_chars // 4,
+            "completion_tokens": len(words),
+            "total_tokens": prompt_chars // 4 + len(words),
+        }
+        if not body.get("stream"):
+            return self._send_json(200, {
+                "id": "stub-chat",
+                "object": "chat.completion",
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": " ".join(words)}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+        # Server-sent events, one token per chunk
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        for i, word in enumerate(words):
+            delta = {"choices": [{"index": 0, "delta": {"content": word + " "}}]}
+            self._write_chunk(f"data: {json.dumps(delta)}\n\n")
+            time.sleep(cfg.stream_chunk_ms / 1000)
+        final = {"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}], "usage": usage}
+        self._write_chunk(f"data: {json.dumps(final)}\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def _write_chunk(self, text: str):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _feature_extraction(self, body: Dict[str, Any]):
+        self._sleep("embed")
+        if self._throttled("embed"):
+            return
+        loading = self.state.loading("embed")
+        if loading or random.random() < self.state.config.embed_503_rate:
+            self.state.count("embed.503")
+            return self._send_json(503, {"error": "Model is currently loading", "estimated_time": loading or 20.0})
+        self.state.count("embed")
+        inputs = body.get("inputs")
+        if isinstance(inputs, list):
+            return self._send_json(200, [fake_embedding(t) for t in inputs])
+        self._send_json(200, fake_embedding(inputs))
+
+    # --- Supabase ------------------------------------------------------
+    def _supabase_select(self, rows: List[Dict[str, Any]], query: Dict[str, List[str]]):
+        self.state.count("supabase.select")
+        self._sleep("supabase")
+        rows = self._filter(rows, query)
+        total = len(rows)
+        if "order" in query:
+            column, _, direction = query["order"][0].partition(".")
+            rows = sorted(rows, key=lambda r: r.get(column), reverse=direction.startswith("desc"))
+        if "offset" in query:
+            rows = rows[int(query["offset"][0]):]
+        if "limit" in query:
+            rows = rows[:int(query["limit"][0])]
+        # .range(start, end) in supabase-py is sent as a Range header
+        if self.headers.get("Range"):
+            start, _, end = self.headers["Range"].partition("-")
+            rows = rows[int(start):int(end) + 1]
+        columns = query.get("select", ["*"])[0]
+        if columns != "*":
+            # "alias:expression" or a plain column
+            keep = [(c.partition(":")[0], c.partition(":")[2]) if ":" in c else (c, c) for c in columns.split(",")]
+            rows = [{alias: self._field(r, expr) for alias, expr in keep} for r in rows]
+        headers = {}
+        if "count=exact" in (self.headers.get("Prefer") or ""):
+            headers["Content-Range"] = f"0-{max(0, len(rows) - 1)}/{total}"
+        self._send_json(200, rows, headers)
+
+    def _filter(self, rows: List[Dict[str, Any]], query: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+        """Rows matching the eq/gt/is/in filters of a PostgREST query string"""
+        for column, values in query.items():
+            if column in ("select", "order", "limit", "offset"):
+                continue
+            op, _, value = values[0].partition(".")
+            if op == "eq":
+                rows = [r for r in rows if str(self._field(r, column)) == value]
+            elif op == "gt":
+                rows = [r for r in rows if self._greater(self._field(r, column), value)]
+            elif op == "is" and value == "null":
+                rows = [r for r in rows if self._field(r, column) is None]
+            elif op == "in":
+                allowed = set(self._in_values(values[0]))
+                rows = [r for r in rows if str(self._field(r, column)) in allowed]
+        return rows
+
+    @staticmethod
+    def _greater(field: Any, value: str) -> bool:
+        if isinstance(field, (int, float)):
+            return field > float(value)
+        return str(field) > value
+
+    @staticmethod
+    def _in_values(spec: str) -> List[str]:
+        """in.(a,"b c") -> ["a", "b c"]"""
+        return [v.strip().strip('"') for v in spec.partition(".")[2].strip("()").split(",")]
+
+    @staticmethod
+    def _field(row: Dict[str, Any], column: str) -> Any:
+        """Plain column, or PostgREST's json text accessor column->>key"""
+        if "->>" in column:
+            column, _, key = column.partition("->>")
+            value = (row.get(column) or {}).get(key)
+            return None if value is None else str(value)
+        return row.get(column)
+
+    def _supabase_rpc(self, name: str, body: Dict[str, Any]):
+        self.state.count(f"supabase.rpc.{name}")
+        self._sleep("supabase")
+        if name == "get_student_context":
+            return self._student_context(body["p_student_id"])
+        if name == "activate_index_version":
+            return self._activate_index_version(body["p_version"])
+        if name == "list_student_partitions":
+            return self._list_partitions(body["partition_key"], body.get("filter_index_version"))
+        k = body.get("match_count", 2)
+        if body.get("filter_index_version") is not None:
+            # Index validation: rank the version's rows for real so recall means something
+            return self._ranked_batch(body["query_embeddings"], k, body["filter_index_version"])
+        active = self.state.active_index_version()
+        embeddings = [e for e in self.state.embeddings if e.get("index_version", 0) == active]
+        rows = [
+            {
+                "student_id": e["student_id"],
+                "student_name": e["student_name"],
+                "content": e["content"],
+                "metadata": e["metadata"],
+                "similarity": 1.0 - i / max(1, len(embeddings)),
+            }
+            for i, e in enumerate(embeddings[:k])
+        ]
+        if "query_embeddings" in body:
+            # Batched search: the same top-k per query, tagged with its index
+            rows = [
+                {"query_index": q, **row}
+                for q in range(len(body["query_embeddings"]))
+                for row in rows
+            ]
+        self._send_json(200, rows)
+
+    def _ranked_batch(self, queries: List[List[float]], k: int, version: int):
+        embeddings = [e for e in self.state.embeddings if e.get("index_version", 0) == version]
+        rows = []
+        for q, query in enumerate(queries):
+            scored = sorted(
+                ((sum(a * b for a, b in zip(query, e["embedding"])), e) for e in embeddings),
+                key=lambda item: -item[0],
+            )
+            rows.extend(
+                {"query_index": q, "student_id": e["student_id"], "student_name": e["student_name"],
+                 "content": e["content"], "metadata": e["metadata"], "similarity": score}
+                for score, e in scored[:k]
+            )
+        self._send_json(200, rows)
+
+    def _list_partitions(self, key: str, version: Optional[int]):
+        version = self.state.active_index_version() if version is None else version
+        values = {e["metadata"].get(key) for e in self.state.embeddings if e.get("index_version", 0) == version}
+        self._send_json(200, [{"partition": None if v is None else str(v)} for v in values])
+
+    def _activate_index_version(self, version: int):
+        with self.state.lock:
+            target = next((v for v in self.state.index_versions if v["version"] == version), None)
+            if target is None or target["status"] not in ("validated", "retired"):
+                return self._send_json(400, {"code": "P0001", "message": f"index version {version} is not validated"})
+            for v in self.state.index_versions:
+                if v["status"] == "active":
+                    v.update(status="retired", retired_at=now_iso())
+            target.update(status="active", activated_at=now_iso(), retired_at=None)
+        self._send_json(200, None)
+
+    def _student_context(self, student_id: str):
+        """Same shape as sql/get_student_context.sql, rendered by the app's own formatter"""
+        from src.utils import calculate_average_marks, categorize_performance, format_student_data_for_embedding
+        rows = []
+        for s in self.state.students:
+            if s["student_id"] == student_id:
+                avg = calculate_average_marks(s["subjects"])
+                rows.append({
+                    "student": s,
+                    "average_marks": avg,
+                    "performance_category": categorize_performance(avg, s["attendance"]),
+                    "context": format_student_data_for_embedding(s),
+                })
+        self._send_json(200, rows)
+
+
+def make_server(host: str, port: int, config: StubConfig) -> ThreadingHTTPServer:
+    handler = type("BoundStubHandler", (StubHandler,), {"state": StubState(config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub HF router + Supabase for load testing")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--chat-latency", default=StubConfig.chat_latency)
+    parser.add_argument("--embed-latency", default=StubConfig.embed_latency)
+    parser.add_argument("--supabase-latency", default=StubConfig.supabase_latency)
+    parser.add_argument("--chat-503-rate", type=float, default=0.0)
+    parser.add_argument("--embed-503-rate", type=float, default=0.0)
+    parser.add_argument("--hf-quota-rps", type=float, default=0.0, help="429 HF calls above this rate (0 = off)")
+    parser.add_argument("--idle-unload-s", type=float, default=0.0, help="unload models idle this long (0 = never)")
+    parser.add_argument("--load-s", type=float, default=StubConfig.load_s, help="time an unloaded model takes to load")
+    parser.add_argument("--stream-chunk-ms", type=float, default=StubConfig.stream_chunk_ms)
+    parser.add_argument("--completion-tokens", type=int, default=StubConfig.completion_tokens)
+    parser.add_argument("--roster", default=StubConfig.roster_path)
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    config = StubConfig(
+        chat_latency=args.chat_latency,
+        embed_latency=args.embed_latency,
+        supabase_latency=args.supabase_latency,
+        chat_503_rate=args.chat_503_rate,
+        embed_503_rate=args.embed_503_rate,
+        hf_quota_rps=args.hf_quota_rps,
+        idle_unload_s=args.idle_unload_s,
+        load_s=args.load_s,
+        stream_chunk_ms=args.stream_chunk_ms,
+        completion_tokens=args.completion_tokens,
+        roster_path=args.roster,
+        seed=args.seed,
+    )
+    server = make_server(args.host, args.port, config)
+    print(f"Stub upstreams listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -0,0 +1,37 @@
+-- Chat transcript and usage log (src/transcripts.py, TRANSCRIPT_SINK=supabase).
+--
+-- One row per /chat, /chat/stream or /class/query turn, written in batches
+-- by each API worker's background writer. `ts` is the request start in epoch
+-- seconds; token counts are summed over the turn's chat-completions calls.
+-- student_id is a salted hash and message/response are null unless
+-- TRANSCRIPT_HASH_IDS=false / TRANSCRIPT_STORE_TEXT=true.
+
+create table if not exists chat_turns (
+    id bigint generated by default as identity primary key,
+    ts double precision not null,
+    trace_id text,
+    endpoint text not null,
+    student_id text,
+    status int not null,
+    message text,
+    response text,
+    performance_category text,
+    history_length int,
+    duration_ms float,
+    first_token_ms float,
+    model text,
+    llm_calls int,
+    prompt_tokens int,
+    completion_tokens int,
+    total_tokens int,
+    created_at timestamptz not null default now()
+);
+
+create index if not exists chat_turns_ts_idx on chat_turns (ts);
+create index if not exists chat_turns_student_idx on chat_turns (student_id, ts);
+
+-- Daily usage, e.g.:
+-- select date_trunc('day', to_timestamp(ts)) as day, count(*) as turns,
+--        sum(total_tokens) as tokens,
+--        percentile_cont(0.95) within group (order by duration_ms) as p95_ms
+-- from chat_turns group by 1 order by 1;
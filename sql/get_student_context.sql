@@ -0,0 +1,79 @@
+-- One round-trip for everything a chat turn needs about a student: the
+-- projected record, its average marks, performance category and the
+-- rendered prompt context (same text as format_student_data_for_embedding).
+--
+-- Thresholds are passed in from the app config so categories stay in sync.
+-- Numbers are rendered through to_jsonb() so they print exactly as the
+-- Python formatter prints the values PostgREST returns (85 vs 85.5).
+
+create or replace function get_student_context(
+    p_student_id text,
+    fantastic_threshold float default 85,
+    average_threshold float default 60,
+    good_attendance float default 80
+)
+returns table (
+    student jsonb,
+    average_marks float,
+    performance_category text,
+    context text
+)
+language sql stable
+as $$
+    with s as (
+        select
+            st.student_id,
+            st.name,
+            st.semester,
+            st.subjects,
+            st.attendance,
+            st.assignments_submitted,
+            st.total_assignments,
+            st.performance_notes,
+            coalesce((
+                select sum((v->>'marks')::float) / nullif(sum((v->>'total')::float), 0) * 100
+                from jsonb_each(st.subjects) as e(k, v)
+            ), 0) as average_marks
+        from students st
+        where st.student_id = p_student_id
+    ),
+    c as (
+        select
+            s.*,
+            case
+                when s.average_marks >= fantastic_threshold
+                     and s.attendance >= good_attendance then 'Fantastic'
+                when s.average_marks >= average_threshold then 'Average'
+                else 'Below Average'
+            end as performance_category
+        from s
+    )
+    select
+        jsonb_build_object(
+            'student_id', c.student_id,
+            'name', c.name,
+            'semester', c.semester,
+            'subjects', c.subjects,
+            'attendance', c.attendance,
+            'assignments_submitted', c.assignments_submitted,
+            'total_assignments', c.total_assignments,
+            'performance_notes', c.performance_notes
+        ),
+        c.average_marks,
+        c.performance_category,
+        trim(concat_ws(E'\n',
+            format('Student ID: %s', c.student_id),
+            format('Name: %s', c.name),
+            format('Semester: %s', to_jsonb(c.semester)),
+            format('Performance Category: %s', c.performance_category),
+            format('Average Marks: %s%%', to_char(c.average_marks, 'FM999990.00')),
+            format('Subjects and Marks: %s', (
+                select string_agg(format('%s: %s/%s', k, v->'marks', v->'total'), ', ' order by n)
+                from jsonb_each(c.subjects) with ordinality as e(k, v, n)
+            )),
+            format('Attendance: %s%%', to_jsonb(c.attendance)),
+            format('Assignments Submitted: %s/%s', to_jsonb(c.assignments_submitted), to_jsonb(c.total_assignments)),
+            format('Performance Notes: %s', c.performance_notes)
+        ))
+    from c;
+$$;
@@ -0,0 +1,83 @@
+-- Blue/green index builds (SupabaseVectorStore.create_index).
+--
+-- Every student_embeddings row belongs to an index version. Searches and
+-- scans only read the active one, so create_index can write a complete new
+-- version next to it, validate it, and switch with activate_index_version(),
+-- which updates the pointer in a single transaction. Retired versions stay
+-- around for rollback until collect_index_garbage() deletes their rows.
+--
+-- Fresh install order: sql/replica_sync.sql, this file, then
+-- sql/match_student_embeddings_filtered.sql (its functions read
+-- index_version and active_index_version(), and it also redefines
+-- match_student_embeddings on top of them). The tombstone trigger from
+-- replica_sync.sql is replaced below. Rows that already exist become
+-- version 0, which starts out active.
+
+alter table student_embeddings
+    add column if not exists index_version bigint not null default 0;
+
+-- Scans page by student_id within one version. If student_id carries a unique
+-- constraint, replace it with (index_version, student_id) so two versions of
+-- a student can coexist.
+create index if not exists student_embeddings_index_version_idx
+    on student_embeddings (index_version, student_id);
+
+create table if not exists index_versions (
+    version bigint primary key,
+    status text not null default 'building'
+        check (status in ('building', 'validated', 'active', 'retired', 'failed')),
+    rows int,
+    recall float,
+    created_at timestamptz not null default now(),
+    activated_at timestamptz,
+    retired_at timestamptz
+);
+
+-- At most one active version
+create unique index if not exists index_versions_one_active
+    on index_versions ((true)) where status = 'active';
+
+insert into index_versions (version, status, activated_at)
+select 0, 'active', now()
+where not exists (select 1 from index_versions);
+
+create or replace function active_index_version()
+returns bigint
+language sql stable
+as $$
+    select coalesce((select version from index_versions where status = 'active'), 0);
+$$;
+
+-- Make a validated (or, to roll back, a retired) version active and retire
+-- the current one, atomically
+create or replace function activate_index_version(p_version bigint)
+returns void
+language plpgsql
+as $$
+begin
+    perform 1 from index_versions
+    where version = p_version and status in ('validated', 'retired')
+    for update;
+    if not found then
+        raise exception 'index version % is not validated', p_version;
+    end if;
+    update index_versions set status = 'retired', retired_at = now() where status = 'active';
+    update index_versions set status = 'active', activated_at = now(), retired_at = null where version = p_version;
+end;
+$$;
+
+-- Only deletes from the active version matter to the read replica; inactive
+-- versions are built and garbage-collected without tombstones, which would
+-- otherwise delete the live rows of the same students
+create or replace function replica_record_delete()
+returns trigger
+language plpgsql
+as $$
+begin
+    if tg_table_name = 'student_embeddings' and old.index_version <> active_index_version() then
+        return old;
+    end if;
+    insert into replica_tombstones (table_name, student_id) values (tg_table_name, old.student_id);
+    return old;
+end;
+$$;
@@ -0,0 +1,165 @@
+-- Filtered and batched similarity search over student_embeddings.
+-- Filters are pushed into the query so only matching rows are ranked
+-- instead of over-fetching and filtering in Python.
+--
+-- Relies on metadata.performance_category / metadata.average_marks, which
+-- create_index() stores alongside the student row (rebuild older indexes).
+-- Subject thresholds are percentages: {"Mathematics": 60}.
+-- Only the active index version is searched unless filter_index_version names
+-- another one (create_index validates a new version that way).
+--
+-- Fresh install order: sql/replica_sync.sql, sql/index_versions.sql, then
+-- this file.
+
+create index if not exists student_embeddings_semester_idx
+    on student_embeddings (((metadata->>'semester')::int));
+create index if not exists student_embeddings_category_idx
+    on student_embeddings ((metadata->>'performance_category'));
+create index if not exists student_embeddings_attendance_idx
+    on student_embeddings (((metadata->>'attendance')::float));
+-- Partitioned search (PARTITION_KEY) loads one partition at a time; index the
+-- key you partition by if it isn't semester, e.g.:
+-- create index if not exists student_embeddings_institution_idx
+--     on student_embeddings ((metadata->>'institution_id'));
+
+-- Signatures changed (partition filter, then index version added): drop the old overloads
+drop function if exists match_student_embeddings_batch(jsonb, int, int, text, float, float, jsonb, jsonb);
+drop function if exists match_student_embeddings_filtered(vector, int, int, text, float, float, jsonb, jsonb);
+drop function if exists match_student_embeddings_batch(jsonb, int, int, text, float, float, jsonb, jsonb, text, text);
+drop function if exists match_student_embeddings_filtered(vector, int, int, text, float, float, jsonb, jsonb, text, text);
+
+create or replace function match_student_embeddings_filtered(
+    query_embedding vector(384),
+    match_count int default 2,
+    filter_semester int default null,
+    filter_category text default null,
+    min_attendance float default null,
+    max_attendance float default null,
+    subject_min_marks jsonb default null,
+    subject_max_marks jsonb default null,
+    filter_partition_key text default null,
+    filter_partition text default null,
+    filter_index_version bigint default null
+)
+returns table (
+    id bigint,
+    student_id text,
+    student_name text,
+    content text,
+    metadata jsonb,
+    similarity float
+)
+language sql stable
+as $$
+    select
+        e.id,
+        e.student_id,
+        e.student_name,
+        e.content,
+        e.metadata,
+        1 - (e.embedding <=> query_embedding) as similarity
+    from student_embeddings e
+    where e.index_version = coalesce(filter_index_version, active_index_version())
+      and (filter_semester is null or (e.metadata->>'semester')::int = filter_semester)
+      and (filter_category is null or e.metadata->>'performance_category' = filter_category)
+      and (filter_partition is null or e.metadata->>filter_partition_key = filter_partition)
+      and (min_attendance is null or (e.metadata->>'attendance')::float >= min_attendance)
+      and (max_attendance is null or (e.metadata->>'attendance')::float <= max_attendance)
+      and (subject_min_marks is null or not exists (
+            select 1
+            from jsonb_each_text(subject_min_marks) t(subject, threshold)
+            where coalesce(
+                (e.metadata->'subjects'->t.subject->>'marks')::float
+                / nullif((e.metadata->'subjects'->t.subject->>'total')::float, 0) * 100,
+                -1
+            ) < t.threshold::float
+      ))
+      and (subject_max_marks is null or not exists (
+            select 1
+            from jsonb_each_text(subject_max_marks) t(subject, threshold)
+            where coalesce(
+                (e.metadata->'subjects'->t.subject->>'marks')::float
+                / nullif((e.metadata->'subjects'->t.subject->>'total')::float, 0) * 100,
+                'infinity'::float
+            ) > t.threshold::float
+      ))
+    order by e.embedding <=> query_embedding
+    limit match_count;
+$$;
+
+-- Several queries in one round-trip. query_embeddings is a JSON array of
+-- 384-d arrays; rows come back tagged with the 0-based query_index.
+create or replace function match_student_embeddings_batch(
+    query_embeddings jsonb,
+    match_count int default 2,
+    filter_semester int default null,
+    filter_category text default null,
+    min_attendance float default null,
+    max_attendance float default null,
+    subject_min_marks jsonb default null,
+    subject_max_marks jsonb default null,
+    filter_partition_key text default null,
+    filter_partition text default null,
+    filter_index_version bigint default null
+)
+returns table (
+    query_index int,
+    id bigint,
+    student_id text,
+    student_name text,
+    content text,
+    metadata jsonb,
+    similarity float
+)
+language sql stable
+as $$
+    select (q.ord - 1)::int as query_index, m.*
+    from jsonb_array_elements(query_embeddings) with ordinality as q(embedding, ord)
+    cross join lateral match_student_embeddings_filtered(
+        (q.embedding::text)::vector(384),
+        match_count,
+        filter_semester,
+        filter_category,
+        min_attendance,
+        max_attendance,
+        subject_min_marks,
+        subject_max_marks,
+        filter_partition_key,
+        filter_partition,
+        filter_index_version
+    ) m
+    order by query_index, m.similarity desc;
+$$;
+
+-- Distinct PARTITION_KEY values of an index version (default: the active one),
+-- so the API lists partitions without paging through every embedding row
+create or replace function list_student_partitions(
+    partition_key text,
+    filter_index_version bigint default null
+)
+returns table (partition text)
+language sql stable
+as $$
+    select distinct e.metadata->>partition_key
+    from student_embeddings e
+    where e.index_version = coalesce(filter_index_version, active_index_version());
+$$;
+
+-- Unfiltered search reads the active version through the filtered function
+drop function if exists match_student_embeddings(vector, int);
+create or replace function match_student_embeddings(
+    query_embedding vector(384),
+    match_count int default 2
+)
+returns table (
+    id bigint,
+    student_id text,
+    student_name text,
+    content text,
+    metadata jsonb,
+    similarity float
+)
+language sql stable
+as $$
+    select * from match_student_embeddings_filtered(query_embedding, match_count);
+$$;
@@ -0,0 +1,70 @@
+-- Change tracking for the local SQLite read replica (src/replica.py).
+--
+-- Every insert/update of students and student_embeddings takes a fresh value
+-- from one sequence, and deletes leave a tombstone numbered from the same
+-- sequence, so the replica pulls "everything with version > what I have".
+--
+-- Versions are handed out when a row is written, not when its transaction
+-- commits, so a long transaction can make an older version visible after a
+-- newer one was already pulled. The replica's periodic full sync
+-- (REPLICA_FULL_SYNC_SECONDS) repairs anything missed that way.
+
+create sequence if not exists replica_version_seq;
+
+alter table students
+    add column if not exists version bigint not null default nextval('replica_version_seq');
+alter table student_embeddings
+    add column if not exists version bigint not null default nextval('replica_version_seq');
+
+create index if not exists students_version_idx on students (version);
+create index if not exists student_embeddings_version_idx on student_embeddings (version);
+
+create table if not exists replica_tombstones (
+    version bigint primary key default nextval('replica_version_seq'),
+    table_name text not null,
+    student_id text not null,
+    deleted_at timestamptz not null default now()
+);
+
+create or replace function replica_bump_version()
+returns trigger
+language plpgsql
+as $$
+begin
+    new.version := nextval('replica_version_seq');
+    return new;
+end;
+$$;
+
+create or replace function replica_record_delete()
+returns trigger
+language plpgsql
+as $$
+begin
+    insert into replica_tombstones (table_name, student_id) values (tg_table_name, old.student_id);
+    return old;
+end;
+$$;
+
+drop trigger if exists students_replica_version on students;
+create trigger students_replica_version
+    before update on students
+    for each row execute function replica_bump_version();
+
+drop trigger if exists student_embeddings_replica_version on student_embeddings;
+create trigger student_embeddings_replica_version
+    before update on student_embeddings
+    for each row execute function replica_bump_version();
+
+drop trigger if exists students_replica_tombstone on students;
+create trigger students_replica_tombstone
+    after delete on students
+    for each row execute function replica_record_delete();
+
+drop trigger if exists student_embeddings_replica_tombstone on student_embeddings;
+create trigger student_embeddings_replica_tombstone
+    after delete on student_embeddings
+    for each row execute function replica_record_delete();
+
+-- Tombstones older than a full sync are no longer needed, e.g. nightly:
+-- delete from replica_tombstones where deleted_at < now() - interval '1 day';
@@ -0,0 +1,130 @@
+"""
+Optional recording of sampled /chat traffic to JSONL, for replay with
+`python -m loadtest.replay`.
+
+One line per request:
+    {"ts": 1718000000.123, "endpoint": "/chat", "student_id": "anon-3f2a...",
+     "message": "xxxx xxxxx", "history": [{"role": "user", "chars": 31}, ...],
+     "history_length": 4, "response_mode": "full", "status": 200,
+     "duration_ms": 2310.4, "response_chars": 812, "trace_id": "..."}
+(/chat/stream entries also carry "first_token_ms").
+
+By default the capture is PII-safe: student IDs are salted hashes and message
+text is replaced with filler of the same length (word boundaries kept), which
+is all the load shape depends on. History is only ever stored as roles and
+lengths.
+"""
+import hashlib
+import json
+import os
+import queue
+import random
+import re
+import threading
+from typing import Any, Dict, Optional, TYPE_CHECKING
+from src.config import config
+from src.tracing import current_trace_id, get_logger
+
+if TYPE_CHECKING:
+    from src.models import ChatRequest
+
+logger = get_logger(__name__)
+
+
+def anonymize_id(student_id: str, salt: str) -> str:
+    digest = hashlib.sha256(f"{salt}\x00{student_id}".encode("utf-8")).hexdigest()
+    return f"anon-{digest[:16]}"
+
+
+def redact_message(text: str) -> str:
+    """Same length and word layout, no content"""
+    return re.sub(r"\S", "x", text)
+
+
+class TrafficRecorder:
+    """Samples chat requests and appends them to a JSONL file from a background thread"""
+
+    def __init__(self, path: str, sample_rate: float, redact_text: bool, hash_ids: bool, salt: str):
+        self.path = path
+        self.sample_rate = sample_rate
+        self.redact_text = redact_text
+        self.hash_ids = hash_ids
+        self.salt = salt
+        self._queue: "queue.Queue[Dict[str, Any]]" = queue.Queue(maxsize=10000)
+        self._dropped = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        threading.Thread(target=self._write_loop, name="traffic-capture", daemon=True).start()
+        logger.info("Capturing chat traffic", extra={
+            "path": path,
+            "sample_rate": sample_rate,
+            "redact_text": redact_text,
+            "hash_ids": hash_ids,
+        })
+
+    def sampled(self) -> bool:
+        return random.random() < self.sample_rate
+
+    def record_chat(
+        self,
+        endpoint: str,
+        request: "ChatRequest",
+        status: int,
+        started_at: float,
+        duration_ms: float,
+        response_chars: int,
+        first_token_ms: Optional[float] = None
+    ):
+        """Queue one request for writing (never blocks the request path)"""
+        entry = {
+            "ts": round(started_at, 6),
+            "endpoint": endpoint,
+            "student_id": anonymize_id(request.student_id, self.salt) if self.hash_ids else request.student_id,
+            "message": redact_message(request.message) if self.redact_text else request.message,
+            "history": [{"role": msg.role, "chars": len(msg.content)} for msg in request.conversation_history],
+            "history_length": len(request.conversation_history),
+            "response_mode": request.response_mode,
+            "status": status,
+            "duration_ms": round(duration_ms, 3),
+            "response_chars": response_chars,
+            "trace_id": current_trace_id(),
+        }
+        if first_token_ms is not None:
+            entry["first_token_ms"] = round(first_token_ms, 3)
+        try:
+            self._queue.put_nowait(entry)
+        except queue.Full:
+            self._dropped += 1
+            if self._dropped % 1000 == 1:
+                logger.warning("Traffic capture queue full, dropping entries", extra={"dropped": self._dropped})
+
+    def _write_loop(self):
+        # O_APPEND with one write per line keeps lines whole when several
+        # workers share the same file
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o600)
+        while True:
+            entry = self._queue.get()
+            try:
+                os.write(fd, (json.dumps(entry, separators=(",", ":")) + "\n").encode("utf-8"))
+            except OSError as e:
+                logger.error("Traffic capture write failed", extra={"error": str(e)})
+
+
+# Singleton instance
+_recorder = None
+_recorder_lock = threading.Lock()
+
+def get_traffic_recorder() -> Optional[TrafficRecorder]:
+    """Recorder, or None when CAPTURE_ENABLED is off"""
+    global _recorder
+    if _recorder is None and config.CAPTURE_ENABLED:
+        with _recorder_lock:
+            if _recorder is None:
+                _recorder = TrafficRecorder(
+                    config.CAPTURE_PATH,
+                    config.CAPTURE_SAMPLE_RATE,
+                    config.CAPTURE_REDACT_TEXT,
+                    config.CAPTURE_HASH_IDS,
+                    config.CAPTURE_SALT,
+                )
+    return _recorder
+
@@ -0,0 +1,216 @@
+"""
+Class-level questions ("Which subjects is semester 3 struggling with overall?").
+
+A roster never goes into a prompt whole. Instead:
+1. reduce locally: one streaming pass over the class builds per-subject,
+   per-category and attendance aggregates (ClassAggregator)
+2. map, only when the question needs narrative detail: compact per-student
+   lines (including performance notes) are summarized by parallel LLM calls
+   over chunks of CLASS_MAP_CHUNK_SIZE students; classes larger than
+   CLASS_MAP_MAX_STUDENTS are sampled evenly
+3. reduce: a single LLM call answers from the aggregates and map notes
+Aggregates and answers are cached per roster version
+(SupabaseVectorStore.roster_version), so repeating a class question costs
+nothing until a student is added, changed or removed.
+"""
+import heapq
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+from src.config import config
+from src.metrics import record_cache
+from src.models import SearchFilters
+from src.utils import calculate_average_marks, categorize_performance
+
+# Words that ask for more than statistics can answer
+NARRATIVE_HINTS = (
+    "why", "explain", "describe", "note", "feedback", "comment", "behavio",
+    "pattern", "recommend", "advice", "suggest", "reason", "strateg",
+)
+# Without a roster version, cached entries only live this long
+UNVERSIONED_CACHE_SECONDS = 300
+# Students listed at each end of the class ranking
+EXTREMES = 5
+NOTES_CHARS = 300
+# LLMHandler.generate_response reports failures as text; never cache those
+LLM_FAILURES = ("Error generating response", "Failed to generate", "Unable to generate")
+
+
+def choose_mode(question: str, detail: str) -> str:
+    """'summary' (aggregates only) or 'narrative' (map-reduce over student lines)"""
+    if detail != "auto":
+        return detail
+    lowered = question.lower()
+    return "narrative" if any(hint in lowered for hint in NARRATIVE_HINTS) else "summary"
+
+
+def is_llm_failure(text: str) -> bool:
+    return text.startswith(LLM_FAILURES)
+
+
+def class_key(filters: Optional[SearchFilters]) -> str:
+    return json.dumps(filters.model_dump(exclude_none=True), sort_keys=True) if filters is not None else "{}"
+
+
+def student_line(student: Dict[str, Any], avg_marks: float, category: str) -> str:
+    """One compact line per student for map prompts"""
+    weakest = min(
+        ((subject, m["marks"] / m["total"] * 100) for subject, m in student["subjects"].items() if m["total"]),
+        key=lambda item: item[1],
+        default=None,
+    )
+    notes = (student.get("performance_notes") or "")[:NOTES_CHARS]
+    line = (
+        f"{student['student_id']} {student['name']}: avg {avg_marks:.1f}% ({category}), "
+        f"attendance {student['attendance']}%, assignments {student['assignments_submitted']}/{student['total_assignments']}"
+    )
+    if weakest is not None:
+        line += f", weakest {weakest[0]} {weakest[1]:.0f}%"
+    return f"{line}. Notes: {notes}" if notes else line
+
+
+class ClassAggregator:
+    """Streaming aggregates over a class plus an even sample of student lines"""
+
+    def __init__(self, sample_size: int, seed: str):
+        self.count = 0
+        self.sample_size = sample_size
+        self.sample: List[str] = []
+        self._rng = random.Random(seed)
+        self._categories: Counter = Counter()
+        self._subjects: Dict[str, Dict[str, float]] = {}
+        self._average_sum = 0.0
+        self._attendance_sum = 0.0
+        self._low_attendance = 0
+        self._submitted = 0
+        self._assigned = 0
+        self._lowest: List[Tuple[float, str, str]] = []  # max-heap via negated average
+        self._highest: List[Tuple[float, str, str]] = []
+
+    def add(self, student: Dict[str, Any]):
+        avg_marks = calculate_average_marks(student["subjects"])
+        attendance = student["attendance"]
+        category = categorize_performance(avg_marks, attendance)
+        self.count += 1
+        self._categories[category] += 1
+        self._average_sum += avg_marks
+        self._attendance_sum += attendance
+        self._low_attendance += attendance < config.LOW_ATTENDANCE
+        self._submitted += student["assignments_submitted"]
+        self._assigned += student["total_assignments"]
+        for subject, marks in student["subjects"].items():
+            if not marks["total"]:
+                continue
+            percent = marks["marks"] / marks["total"] * 100
+            stats = self._subjects.setdefault(subject, {"students": 0, "sum": 0.0, "below": 0, "min": percent, "max": percent})
+            stats["students"] += 1
+            stats["sum"] += percent
+            stats["below"] += percent < config.AVERAGE_THRESHOLD
+            stats["min"] = min(stats["min"], percent)
+            stats["max"] = max(stats["max"], percent)
+
+        entry = (student["student_id"], student["name"])
+        heapq.heappush(self._lowest, (-avg_marks, *entry))
+        heapq.heappush(self._highest, (avg_marks, *entry))
+        if len(self._lowest) > EXTREMES:
+            heapq.heappop(self._lowest)
+        if len(self._highest) > EXTREMES:
+            heapq.heappop(self._highest)
+
+        # Reservoir sampling keeps the map input bounded and evenly spread
+        if len(self.sample) < self.sample_size:
+            self.sample.append(student_line(student, avg_marks, category))
+        else:
+            slot = self._rng.randrange(self.count)
+            if slot < self.sample_size:
+                self.sample[slot] = student_line(student, avg_marks, category)
+
+    def summary(self) -> Dict[str, Any]:
+        if not self.count:
+            return {"students": 0}
+        subjects = sorted(
+            (
+                {
+                    "subject": subject,
+                    "students": int(stats["students"]),
+                    "average_percent": round(stats["sum"] / stats["students"], 1),
+                    "below_average": int(stats["below"]),
+                    "below_average_share": round(stats["below"] / stats["students"] * 100, 1),
+                    "min_percent": round(stats["min"], 1),
+                    "max_percent": round(stats["max"], 1),
+                }
+                for subject, stats in self._subjects.items()
+            ),
+            key=lambda s: s["average_percent"],
+        )
+        return {
+            "students": self.count,
+            "categories": dict(self._categories),
+            "average_marks": round(self._average_sum / self.count, 1),
+            "average_attendance": round(self._attendance_sum / self.count, 1),
+            "low_attendance_students": self._low_attendance,
+            "assignment_completion_percent": round(self._submitted / self._assigned * 100, 1) if self._assigned else None,
+            "subjects_weakest_first": subjects,
+            "lowest_students": [
+                {"student_id": sid, "name": name, "average_marks": round(-neg, 1)}
+                for neg, sid, name in sorted(self._lowest, reverse=True)
+            ],
+            "highest_students": [
+                {"student_id": sid, "name": name, "average_marks": round(avg, 1)}
+                for avg, sid, name in sorted(self._highest, reverse=True)
+            ],
+        }
+
+
+class ClassQueryCache:
+    """Per-worker LRU of class aggregates and answers, keyed by roster version"""
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[Tuple, Tuple[float, Any]]" = OrderedDict()
+
+    def get(self, kind: str, key: Tuple) -> Any:
+        with self._lock:
+            entry = self._entries.get((kind, *key))
+            if entry is not None and entry[0] < time.monotonic():
+                del self._entries[(kind, *key)]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end((kind, *key))
+        record_cache(f"class_{kind}", entry is not None)
+        return entry[1] if entry is not None else None
+
+    def put(self, kind: str, key: Tuple, value: Any, versioned: bool):
+        ttl = self.ttl if versioned else min(self.ttl, UNVERSIONED_CACHE_SECONDS)
+        with self._lock:
+            self._entries[(kind, *key)] = (time.monotonic() + ttl, value)
+            self._entries.move_to_end((kind, *key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+# Singleton instance
+_class_query_cache = None
+
+def get_class_query_cache() -> ClassQueryCache:
+    """Get or create the class query cache"""
+    global _class_query_cache
+    if _class_query_cache is None:
+        _class_query_cache = ClassQueryCache(config.CLASS_QUERY_CACHE_SECONDS, config.CLASS_QUERY_CACHE_SIZE)
+    return _class_query_cache
+
+
+# Bounded pool for map calls, shared by all class queries in the worker
+_class_map_executor = None
+
+def class_map_pool() -> ThreadPoolExecutor:
+    global _class_map_executor
+    if _class_map_executor is None:
+        _class_map_executor = ThreadPoolExecutor(max_workers=config.CLASS_MAP_WORKERS, thread_name_prefix="class-map")
+    return _class_map_executor
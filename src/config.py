@@ -10,25 +10,187 @@ class Config:
     
     # HuggingFace API Configuration
     HF_API_KEY = os.getenv("HF_API_KEY")
-    if not HF_API_KEY:
-        raise ValueError("HF_API_KEY must be set in .env file")
     
     # Supabase Configuration
     SUPABASE_URL = os.getenv("SUPABASE_URL")
     SUPABASE_KEY = os.getenv("SUPABASE_KEY")
-    if not SUPABASE_URL or not SUPABASE_KEY:
-        raise ValueError("SUPABASE_URL and SUPABASE_KEY must be set in .env file")
+    
+    # Settings each upstream client needs. Checked when the client is created
+    # (see Config.require) rather than at import, so the app can boot and
+    # report why it isn't ready instead of crashing.
+    REQUIRED_SETTINGS = {
+        "huggingface": ["HF_API_KEY"],
+        "supabase": ["SUPABASE_URL", "SUPABASE_KEY"],
+    }
     
     # Model Configuration
     EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "sentence-transformers/all-MiniLM-L6-v2")
     LLM_MODEL = os.getenv("LLM_MODEL", "deepseek-ai/DeepSeek-V3.2:novita")
     
+    # Embedding backend: "remote" (HF feature-extraction API) or "onnx"
+    # (bge-small in-process on CPU; needs onnxruntime, tokenizers, huggingface_hub)
+    EMBEDDING_BACKEND = os.getenv("EMBEDDING_BACKEND", "remote")
+    ONNX_MODEL_DIR = os.getenv("ONNX_MODEL_DIR", "./models/bge-small-en-v1.5")
+    ONNX_QUANTIZE = os.getenv("ONNX_QUANTIZE", "false").lower() == "true"
+    ONNX_BATCH_SIZE = int(os.getenv("ONNX_BATCH_SIZE", 32))
+    ONNX_THREADS = int(os.getenv("ONNX_THREADS", 1))
+    ONNX_POOL_WORKERS = int(os.getenv("ONNX_POOL_WORKERS", os.cpu_count() or 1))
+    
     # HuggingFace API endpoints
-    HF_ROUTER_ENDPOINT = "https://router.huggingface.co/hf-inference/models"
-    HF_CHAT_COMPLETIONS_ENDPOINT = "https://router.huggingface.co/v1/chat/completions"
+    # (overridable so load tests can point at the local stubs in loadtest/stubs.py)
+    HF_ROUTER_ENDPOINT = os.getenv("HF_ROUTER_ENDPOINT", "https://router.huggingface.co/hf-inference/models")
+    HF_CHAT_COMPLETIONS_ENDPOINT = os.getenv("HF_CHAT_COMPLETIONS_ENDPOINT", "https://router.huggingface.co/v1/chat/completions")
+    
+    # Outbound rate limits per upstream (token buckets shared by all processes
+    # on the host through RATE_LIMIT_DB; empty path = per-process only)
+    RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "true").lower() == "true"
+    RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "/tmp/ilearn-ratelimit.sqlite")
+    RATE_LIMIT_LLM_RPS = float(os.getenv("RATE_LIMIT_LLM_RPS", 2))
+    RATE_LIMIT_LLM_BURST = float(os.getenv("RATE_LIMIT_LLM_BURST", 10))
+    RATE_LIMIT_EMBEDDINGS_RPS = float(os.getenv("RATE_LIMIT_EMBEDDINGS_RPS", 1))
+    RATE_LIMIT_EMBEDDINGS_BURST = float(os.getenv("RATE_LIMIT_EMBEDDINGS_BURST", 5))
+    # Index builds and ingestion leave this share of each burst to API requests
+    RATE_LIMIT_BATCH_RESERVE = float(os.getenv("RATE_LIMIT_BATCH_RESERVE", 0.5))
+    # API requests give up (503 + Retry-After) rather than wait longer than this
+    # for a token; batch jobs wait as long as it takes
+    RATE_LIMIT_MAX_WAIT_SECONDS = float(os.getenv("RATE_LIMIT_MAX_WAIT_SECONDS", 10))
+    
+    # Responses smaller than this are sent uncompressed
+    COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", 1000))
+    
+    # Warm-up: ping the models after startup (costs one tiny request each)
+    WARMUP_PING_MODELS = os.getenv("WARMUP_PING_MODELS", "true").lower() == "true"
+    # Required warm-up steps (pipeline, Supabase) are retried with exponential
+    # backoff capped at WARMUP_RETRY_MAX_SECONDS until they succeed
+    WARMUP_RETRY_INITIAL_SECONDS = float(os.getenv("WARMUP_RETRY_INITIAL_SECONDS", 1))
+    WARMUP_RETRY_MAX_SECONDS = float(os.getenv("WARMUP_RETRY_MAX_SECONDS", 30))
+    
+    # Keep-warm: ping each HF model nobody has used for KEEP_WARM_INTERVAL_SECONDS
+    # (one process per host). Model state (warm / loading) is shared through
+    # MODEL_STATE_DB; a request finding a model loading for longer than
+    # MODEL_COLD_MAX_WAIT_SECONDS fails over or fails fast instead of sleeping
+    KEEP_WARM_ENABLED = os.getenv("KEEP_WARM_ENABLED", "true").lower() == "true"
+    KEEP_WARM_INTERVAL_SECONDS = float(os.getenv("KEEP_WARM_INTERVAL_SECONDS", 240))
+    MODEL_STATE_DB = os.getenv("MODEL_STATE_DB", "/tmp/ilearn-models.sqlite")
+    MODEL_COLD_MAX_WAIT_SECONDS = float(os.getenv("MODEL_COLD_MAX_WAIT_SECONDS", 2))
+    # Fail-over targets while the primary model is loading (unset = fail fast with 503)
+    LLM_FALLBACK_MODEL = os.getenv("LLM_FALLBACK_MODEL")
+    # Same vectors as the remote bge-small model (needs onnxruntime, tokenizers, huggingface_hub)
+    EMBEDDING_FALLBACK_ONNX = os.getenv("EMBEDDING_FALLBACK_ONNX", "false").lower() == "true"
+    
+    # Admin endpoints (profiling etc.) are disabled unless a token is set
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+    
+    # Shared-memory snapshot of students/contexts/vectors for all workers.
+    # Point at a tmpfs (e.g. /dev/shm/ilearn) to enable; unset = per-request Supabase reads
+    SHARED_DATA_DIR = os.getenv("SHARED_DATA_DIR")
+    SHARED_DATA_REFRESH_SECONDS = float(os.getenv("SHARED_DATA_REFRESH_SECONDS", 300))
+    
+    # Columns read from the students table (never select *); PARTITION_KEY is
+    # always added since partitions are derived from the student row
+    STUDENT_COLUMNS = os.getenv(
+        "STUDENT_COLUMNS",
+        "student_id,name,semester,subjects,attendance,assignments_submitted,total_assignments,performance_notes",
+    )
+    # Fetch record + average + category + rendered context in one round-trip
+    # (sql/get_student_context.sql); falls back to select + local formatting
+    STUDENT_CONTEXT_RPC = os.getenv("STUDENT_CONTEXT_RPC", "true").lower() == "true"
+    # Page size for keyset scans over students / student_embeddings
+    SCAN_PAGE_SIZE = int(os.getenv("SCAN_PAGE_SIZE", 1000))
+    # Bulk ingestion (python -m src.ingest): rows per upsert, batches in flight
+    INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 500))
+    INGEST_CONCURRENCY = int(os.getenv("INGEST_CONCURRENCY", 4))
+    
+    # Local SQLite read replica of students/student_embeddings (needs
+    # sql/replica_sync.sql); unset = read from Supabase. Reads fall back to
+    # Supabase when the last sync is older than REPLICA_MAX_STALENESS_SECONDS
+    REPLICA_PATH = os.getenv("REPLICA_PATH")
+    REPLICA_SYNC_SECONDS = float(os.getenv("REPLICA_SYNC_SECONDS", 5))
+    REPLICA_FULL_SYNC_SECONDS = float(os.getenv("REPLICA_FULL_SYNC_SECONDS", 3600))
+    REPLICA_MAX_STALENESS_SECONDS = float(os.getenv("REPLICA_MAX_STALENESS_SECONDS", 30))
+    
+    # Partitioned vector search (e.g. PARTITION_KEY=institution_id): partitions
+    # are loaded from student_embeddings on demand and kept in an LRU
+    PARTITIONED_SEARCH = os.getenv("PARTITIONED_SEARCH", "false").lower() == "true"
+    PARTITION_KEY = os.getenv("PARTITION_KEY", "semester")
+    PARTITION_CACHE_SIZE = int(os.getenv("PARTITION_CACHE_SIZE", 8))
+    PARTITION_TTL_SECONDS = float(os.getenv("PARTITION_TTL_SECONDS", 300))
+    PARTITION_SEARCH_WORKERS = int(os.getenv("PARTITION_SEARCH_WORKERS", 4))
+    
+    # Prefetched student contexts, used by the next turn only (also bounds how
+    # stale the student data of that first turn can be)
+    PREFETCH_TTL_SECONDS = float(os.getenv("PREFETCH_TTL_SECONDS", 120))
+    PREFETCH_MAX_ENTRIES = int(os.getenv("PREFETCH_MAX_ENTRIES", 1024))
+    # Speculatively answer the usual opening question when a student is selected
+    # (opt-in: every selection costs an LLM call from the shared HF budget)
+    PREFETCH_SPECULATE = os.getenv("PREFETCH_SPECULATE", "false").lower() == "true"
+    PREFETCH_OPENING_QUESTION = os.getenv("PREFETCH_OPENING_QUESTION", "How is this student doing?")
+    PREFETCH_WORKERS = int(os.getenv("PREFETCH_WORKERS", 2))
+    # A question arriving while its speculative answer is still being generated
+    # waits this long for it, then makes a live call instead
+    PREFETCH_SPECULATION_WAIT_SECONDS = float(os.getenv("PREFETCH_SPECULATION_WAIT_SECONDS", 3))
+    
+    # Class-level questions (/class/query): narrative answers summarize at most
+    # CLASS_MAP_MAX_STUDENTS students in chunks, CLASS_MAP_WORKERS LLM calls at a time
+    CLASS_MAP_CHUNK_SIZE = int(os.getenv("CLASS_MAP_CHUNK_SIZE", 25))
+    CLASS_MAP_MAX_STUDENTS = int(os.getenv("CLASS_MAP_MAX_STUDENTS", 500))
+    CLASS_MAP_WORKERS = int(os.getenv("CLASS_MAP_WORKERS", 4))
+    # Answers/aggregates are cached per roster version (needs sql/replica_sync.sql)
+    CLASS_QUERY_CACHE_SECONDS = float(os.getenv("CLASS_QUERY_CACHE_SECONDS", 3600))
+    CLASS_QUERY_CACHE_SIZE = int(os.getenv("CLASS_QUERY_CACHE_SIZE", 256))
+    
+    # Traffic capture of sampled /chat requests (replay with loadtest/replay.py).
+    # IDs are hashed and message text is redacted unless explicitly turned off
+    CAPTURE_ENABLED = os.getenv("CAPTURE_ENABLED", "false").lower() == "true"
+    CAPTURE_PATH = os.getenv("CAPTURE_PATH", "./captures/chat.jsonl")
+    CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", 1.0))
+    CAPTURE_REDACT_TEXT = os.getenv("CAPTURE_REDACT_TEXT", "true").lower() == "true"
+    CAPTURE_HASH_IDS = os.getenv("CAPTURE_HASH_IDS", "true").lower() == "true"
+    CAPTURE_SALT = os.getenv("CAPTURE_SALT", "")
+    
+    # Write-behind transcript and usage log of chat turns: "sqlite" (TRANSCRIPT_DB),
+    # "supabase" (chat_turns table, sql/chat_turns.sql) or "off". Turns are buffered
+    # in memory (at most TRANSCRIPT_BUFFER_SIZE) and written in batches every
+    # TRANSCRIPT_FLUSH_SECONDS, so a crash loses at most that window
+    TRANSCRIPT_SINK = os.getenv("TRANSCRIPT_SINK", "sqlite").lower()
+    TRANSCRIPT_DB = os.getenv("TRANSCRIPT_DB", "/tmp/ilearn-transcripts.sqlite")
+    TRANSCRIPT_FLUSH_SECONDS = float(os.getenv("TRANSCRIPT_FLUSH_SECONDS", 2))
+    TRANSCRIPT_BATCH_SIZE = int(os.getenv("TRANSCRIPT_BATCH_SIZE", 200))
+    TRANSCRIPT_BUFFER_SIZE = int(os.getenv("TRANSCRIPT_BUFFER_SIZE", 10000))
+    # Like the capture, IDs are salted hashes (same salt as the capture unless
+    # TRANSCRIPT_SALT is set) and message/response text is only stored when asked for
+    TRANSCRIPT_STORE_TEXT = os.getenv("TRANSCRIPT_STORE_TEXT", "false").lower() == "true"
+    TRANSCRIPT_HASH_IDS = os.getenv("TRANSCRIPT_HASH_IDS", "true").lower() == "true"
+    TRANSCRIPT_SALT = os.getenv("TRANSCRIPT_SALT", CAPTURE_SALT)
     
     # Data Paths (for reference/migration only)
     STUDENT_DATA_PATH = "./data/student_data.json"
+    VECTOR_STORE_PATH = os.getenv("VECTOR_STORE_PATH", "./vector_store")
+    
+    # Blue/green index builds (sql/index_versions.sql): create_index writes a new
+    # index version next to the active one and switches only once it holds a row
+    # per student and at least INDEX_MIN_RECALL of INDEX_VALIDATE_SAMPLE sampled
+    # students find themselves in their top INDEX_VALIDATE_TOP_K
+    INDEX_VALIDATE_SAMPLE = int(os.getenv("INDEX_VALIDATE_SAMPLE", 20))
+    INDEX_VALIDATE_TOP_K = int(os.getenv("INDEX_VALIDATE_TOP_K", 5))
+    INDEX_MIN_RECALL = float(os.getenv("INDEX_MIN_RECALL", 0.95))
+    # Retired versions are deleted INDEX_GC_GRACE_SECONDS after the switch,
+    # except the newest INDEX_KEEP_VERSIONS (kept for rollback)
+    INDEX_KEEP_VERSIONS = int(os.getenv("INDEX_KEEP_VERSIONS", 1))
+    INDEX_GC_GRACE_SECONDS = float(os.getenv("INDEX_GC_GRACE_SECONDS", 3600))
+    # How long a worker keeps using the active version it last read
+    INDEX_VERSION_CHECK_SECONDS = float(os.getenv("INDEX_VERSION_CHECK_SECONDS", 10))
+    
+    # "Similar students" kNN graph, rebuilt with the index
+    SIMILARITY_GRAPH_PATH = os.getenv("SIMILARITY_GRAPH_PATH", "./vector_store/similarity_graph.npz")
+    SIMILARITY_GRAPH_K = int(os.getenv("SIMILARITY_GRAPH_K", 10))
+    # Memory for one block of similarity scores while building/updating the graph
+    SIMILARITY_GRAPH_BLOCK_MB = float(os.getenv("SIMILARITY_GRAPH_BLOCK_MB", 256))
+    # Supabase Storage bucket the indexer publishes the graph to and API
+    # workers download it from (checked every SIMILARITY_GRAPH_CHECK_SECONDS);
+    # empty = local file only
+    SIMILARITY_GRAPH_BUCKET = os.getenv("SIMILARITY_GRAPH_BUCKET", "")
+    SIMILARITY_GRAPH_CHECK_SECONDS = float(os.getenv("SIMILARITY_GRAPH_CHECK_SECONDS", 60))
     
     # Performance Thresholds
     FANTASTIC_THRESHOLD = 85
@@ -37,5 +199,20 @@ class Config:
     # Attendance Thresholds
     GOOD_ATTENDANCE = 80
     LOW_ATTENDANCE = 70
+    
+    def missing_settings(self) -> list:
+        """Names of required settings that are not set"""
+        return [
+            name
+            for names in self.REQUIRED_SETTINGS.values()
+            for name in names
+            if not getattr(self, name)
+        ]
+    
+    def require(self, service: str):
+        """Raise if the settings needed by `service` are missing"""
+        missing = [name for name in self.REQUIRED_SETTINGS[service] if not getattr(self, name)]
+        if missing:
+            raise ValueError(f"{' and '.join(missing)} must be set in .env file")
 
 config = Config()
\ No newline at end of file
@@ -0,0 +1,97 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from typing import Any, Dict, Optional, Tuple
+from src.config import config
+from src.metrics import record_cache
+
+
+def normalize_question(message: str) -> str:
+    """Case/punctuation-insensitive form used to match speculative answers"""
+    return " ".join(message.lower().strip().rstrip("?!. ").split())
+
+
+class ContextCache:
+    """
+    Per-worker TTL/LRU cache of what a chat turn needs before the LLM call:
+    the student record, its rendered prompt context and performance category,
+    as loaded by a prefetch and used once by the student's next turn.
+    Also holds speculative opening answers (as futures, so a question asked
+    while the answer is still being generated waits for it instead of making
+    a second LLM call).
+    """
+
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._contexts: "OrderedDict[str, Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        self._answers: "OrderedDict[Tuple[str, str], Tuple[float, Future]]" = OrderedDict()
+
+    def _get(self, store: OrderedDict, key):
+        entry = store.get(key)
+        if entry is None:
+            return None
+        expires, value = entry
+        if expires < time.monotonic():
+            del store[key]
+            return None
+        store.move_to_end(key)
+        return value
+
+    def _put(self, store: OrderedDict, key, value):
+        store[key] = (time.monotonic() + self.ttl, value)
+        store.move_to_end(key)
+        while len(store) > self.max_entries:
+            store.popitem(last=False)
+
+    # --- prepared contexts ---------------------------------------------
+    def take_context(self, student_id: str) -> Optional[Dict[str, Any]]:
+        """Claim a prefetched {"student", "context", "performance_category"} (used once) or None"""
+        with self._lock:
+            entry = self._get(self._contexts, student_id)
+            if entry is not None:
+                del self._contexts[student_id]
+        record_cache("student_context", entry is not None)
+        return entry
+
+    def put_context(self, student_id: str, student: Dict[str, Any], context: str, performance_category: str):
+        with self._lock:
+            self._put(self._contexts, student_id, {
+                "student": student,
+                "context": context,
+                "performance_category": performance_category,
+            })
+
+    # --- speculative answers -------------------------------------------
+    def start_speculation(self, student_id: str, question: str) -> Optional[Future]:
+        """Reserve a slot for a speculative answer; None if one is already cached or in flight"""
+        key = (student_id, normalize_question(question))
+        with self._lock:
+            if self._get(self._answers, key) is not None:
+                return None
+            future: Future = Future()
+            self._put(self._answers, key, future)
+        return future
+
+    def take_speculation(self, student_id: str, question: str) -> Optional[Future]:
+        """Claim the speculative answer for a question (used once)"""
+        key = (student_id, normalize_question(question))
+        with self._lock:
+            future = self._get(self._answers, key)
+            if future is not None:
+                del self._answers[key]
+        record_cache("speculative_answer", future is not None)
+        return future
+
+
+# Singleton instance
+_context_cache = None
+
+def get_context_cache() -> ContextCache:
+    """Get or create the context cache"""
+    global _context_cache
+    if _context_cache is None:
+        _context_cache = ContextCache(config.PREFETCH_TTL_SECONDS, config.PREFETCH_MAX_ENTRIES)
+    return _context_cache
@@ -1,32 +1,64 @@
 import requests
+import threading
 import time
-from typing import List
+from typing import List, Union
 from src.config import config
+from src.metrics import UPSTREAM_RETRIES, UPSTREAM_503
+from src.tracing import get_logger, span
+from src.rate_limiter import RateLimitTimeout, get_rate_limiter, loading_wait
+from src.keep_warm import ModelColdError, get_model_availability
+
+logger = get_logger(__name__)
 
 class EmbeddingModel:
     def __init__(self):
         """Use BAAI/bge-small-en-v1.5 model (384 dimensions)"""
-        self.api_url = "https://router.huggingface.co/hf-inference/models/BAAI/bge-small-en-v1.5"
+        config.require("huggingface")
+        self.api_url = f"{config.HF_ROUTER_ENDPOINT}/BAAI/bge-small-en-v1.5"
         self.headers = {
             "Authorization": f"Bearer {config.HF_API_KEY}",
             "Content-Type": "application/json"
         }
-        print(f"Using BAAI/bge-small-en-v1.5 for embeddings")
+        # Keep-alive connection pool so requests after warm-up skip the TLS handshake
+        self.session = requests.Session()
+        self.rate_limit_key = "embeddings:BAAI/bge-small-en-v1.5"
+        # Local ONNX copy of the same model, loaded on first fail-over (False = unavailable)
+        self._fallback = None
+        self._fallback_lock = threading.Lock()
+        logger.info("Using BAAI/bge-small-en-v1.5 for embeddings")
     
-    def _call_api(self, text: str, retries: int = 3):
-        """Call API with retry"""
+    def _call_api(self, text: Union[str, List[str]], retries: int = 3):
+        """Call API with retry (a list of texts is embedded in one request)"""
+        limiter = get_rate_limiter()
+        availability = get_model_availability()
         for attempt in range(retries):
             try:
-                response = requests.post(
-                    self.api_url,
-                    headers=self.headers,
-                    json={"inputs": text, "options": {"wait_for_model": True}},
-                    timeout=30
-                )
+                # Fail fast (ModelColdError) rather than sleep through a model load
+                availability.check(self.rate_limit_key)
+                # Shared budget with other workers and the indexer (RateLimitTimeout
+                # after RATE_LIMIT_MAX_WAIT_SECONDS in the API)
+                limiter.acquire(self.rate_limit_key)
+                with span("upstream.embeddings", attempt=attempt + 1) as attrs:
+                    response = self.session.post(
+                        self.api_url,
+                        headers=self.headers,
+                        json={"inputs": text, "options": {"wait_for_model": False}},
+                        timeout=30
+                    )
+                    attrs["status"] = response.status_code
                 
+                # 429 pauses the bucket (Retry-After); 503 marks the model loading for
+                # estimated_time, and the next check() waits a short load out or fails fast
+                hint = loading_wait(response, default=20) if response.status_code == 503 else None
+                limiter.observe(self.rate_limit_key, response.status_code, response.headers)
+                availability.record(self.rate_limit_key, response.status_code, hint)
                 if response.status_code == 503:
-                    print(f"Model loading... wait 20s")
-                    time.sleep(20)
+                    UPSTREAM_503.labels(upstream="embeddings").inc()
+                    logger.warning("Embedding model loading", extra={"attempt": attempt + 1, "wait_seconds": hint})
+                    UPSTREAM_RETRIES.labels(upstream="embeddings").inc()
+                    continue
+                if response.status_code == 429:
+                    UPSTREAM_RETRIES.labels(upstream="embeddings").inc()
                     continue
                 
                 response.raise_for_status()
@@ -34,29 +66,85 @@ class EmbeddingModel:
                 
                 # Extract embedding
                 if isinstance(result, list):
+                    if isinstance(text, list):
+                        return result
                     if isinstance(result[0], list):
                         return result[0]
                     return result
                 
                 raise Exception(f"Bad format: {result}")
                 
+            except (ModelColdError, RateLimitTimeout):
+                raise
             except Exception as e:
                 if attempt == retries - 1:
                     raise e
                 time.sleep(5)
+                UPSTREAM_RETRIES.labels(upstream="embeddings").inc()
+        
+        availability.raise_if_loading(self.rate_limit_key)
+        raise Exception("Embedding model still unavailable after multiple attempts")
+    
+    def _fallback_model(self):
+        """Local ONNX model with the same vectors (EMBEDDING_FALLBACK_ONNX), or None"""
+        if self._fallback is None and config.EMBEDDING_FALLBACK_ONNX:
+            with self._fallback_lock:
+                if self._fallback is None:
+                    try:
+                        from src.onnx_embeddings import OnnxEmbeddingModel
+                        self._fallback = OnnxEmbeddingModel()
+                    except Exception as e:
+                        logger.error("ONNX embedding fallback unavailable", extra={"error": str(e)})
+                        self._fallback = False
+        return self._fallback or None
+    
+    def _embed(self, text: Union[str, List[str]]):
+        try:
+            return self._call_api(text)
+        except (ModelColdError, RateLimitTimeout) as e:
+            fallback = self._fallback_model()
+            if fallback is None:
+                raise
+            if isinstance(e, ModelColdError):
+                get_model_availability().failover(self.rate_limit_key, "onnx")
+            else:
+                logger.info("Embedding budget exhausted, using the local model", extra={"retry_after": round(e.retry_after, 1)})
+            return fallback.embed_text(text) if isinstance(text, str) else fallback.embed_batch(text)
+    
+    def ping(self) -> int:
+        """One tiny embedding (no retries) to keep the model loaded; returns the status code"""
+        limiter = get_rate_limiter()
+        limiter.acquire(self.rate_limit_key)
+        with span("upstream.embeddings", op="ping") as attrs:
+            response = self.session.post(
+                self.api_url,
+                headers=self.headers,
+                json={"inputs": "ping", "options": {"wait_for_model": False}},
+                timeout=30
+            )
+            attrs["status"] = response.status_code
+        limiter.observe(self.rate_limit_key, response.status_code, response.headers)
+        hint = loading_wait(response, default=20) if response.status_code == 503 else None
+        get_model_availability().record(self.rate_limit_key, response.status_code, hint)
+        return response.status_code
     
     def embed_text(self, text: str) -> List[float]:
         """Generate embedding"""
-        return self._call_api(text)
+        return self._embed(text)
+    
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for several texts in a single API call"""
+        if not texts:
+            return []
+        return self._embed(texts)
     
     def embed_texts(self, texts: List[str]) -> List[List[float]]:
-        """Generate multiple embeddings"""
+        """Generate multiple embeddings (paced by the shared rate limiter)"""
         embeddings = []
         for i, text in enumerate(texts):
-            print(f"Embedding {i+1}/{len(texts)}...")
+            logger.info("Embedding text", extra={"index": i + 1, "total": len(texts)})
             embedding = self.embed_text(text)
             embeddings.append(embedding)
-            time.sleep(1)
         return embeddings
 
 _embedding_model = None
@@ -64,5 +152,9 @@ _embedding_model = None
 def get_embedding_model() -> EmbeddingModel:
     global _embedding_model
     if _embedding_model is None:
-        _embedding_model = EmbeddingModel()
+        if config.EMBEDDING_BACKEND == "onnx":
+            from src.onnx_embeddings import OnnxEmbeddingModel
+            _embedding_model = OnnxEmbeddingModel()
+        else:
+            _embedding_model = EmbeddingModel()
     return _embedding_model
\ No newline at end of file
@@ -0,0 +1,314 @@
+"""
+Streaming bulk ingestion into the students table.
+
+    python -m src.ingest exports/term.jsonl --reembed
+    python -m src.ingest exports/students.csv.gz --batch-size 1000 --concurrency 8 --rejects rejects.jsonl
+
+Records are read one at a time from JSON (a top-level array), JSONL or CSV
+(optionally gzipped), validated against StudentRecord and upserted in
+batches of INGEST_BATCH_SIZE with at most INGEST_CONCURRENCY batches in
+flight, so memory stays constant however large the export is. Each batch
+first reads the existing rows back (projected, one request) and writes only
+the rows that are new or changed; with --reembed exactly those rows are
+re-embedded, and linked into the similarity graph in one update at the end
+of the run (their float16 vectors are kept until then).
+
+CSV: `subjects` is either a JSON column or one column pair per subject
+(`Mathematics.marks`, `Mathematics.total`). Invalid records are skipped and,
+with --rejects, written out with their validation errors.
+"""
+import argparse
+import csv
+import gzip
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, IO, Iterable, Iterator, List, Optional, Set, Tuple
+import numpy as np
+from pydantic import ValidationError
+from src.config import config
+from src.keep_warm import wait_for_models
+from src.models import StudentRecord
+from src.rate_limiter import reserve_for_api
+from src.similarity_graph import update_similarity_graph
+from src.tracing import get_logger
+
+logger = get_logger(__name__)
+
+FORMATS = ("json", "jsonl", "csv")
+
+
+def detect_format(path: str) -> str:
+    name = path[:-3] if path.endswith(".gz") else path
+    extension = os.path.splitext(name)[1].lstrip(".").lower()
+    if extension == "ndjson":
+        return "jsonl"
+    if extension not in FORMATS:
+        raise ValueError(f"Can't tell the format of {path}; pass --format")
+    return extension
+
+
+def iter_json_array(f: IO[str], chunk_size: int = 1 << 16) -> Iterator[Any]:
+    """Items of a top-level JSON array, decoded as the file is read"""
+    decoder = json.JSONDecoder()
+    buffer, pos, eof = "", 0, False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = f.read(chunk_size)
+        buffer, pos = buffer[pos:] + chunk, 0
+        eof = not chunk
+
+    def next_char() -> str:
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos].isspace():
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos] if pos < len(buffer) else ""
+            fill()
+
+    if next_char() != "[":
+        raise ValueError("Expected a JSON array of student records")
+    pos += 1
+    while True:
+        char = next_char()
+        if char == "]":
+            return
+        if char == ",":
+            pos += 1
+            continue
+        if not char:
+            raise ValueError("Unterminated JSON array")
+        try:
+            item, end = decoder.raw_decode(buffer, pos)
+        except json.JSONDecodeError:
+            if eof:
+                raise
+            fill()
+            continue
+        if end == len(buffer) and not eof:
+            # A number at the very end of the buffer may continue in the next chunk
+            fill()
+            continue
+        pos = end
+        yield item
+
+
+def csv_record(row: Dict[str, Any]) -> Dict[str, Any]:
+    """CSV row -> record dict (subjects from a JSON column or Subject.marks/Subject.total columns)"""
+    record: Dict[str, Any] = {}
+    subjects: Dict[str, Dict[str, str]] = {}
+    for column, value in row.items():
+        if column is None or value is None or value == "":
+            continue
+        subject, dot, part = column.rpartition(".")
+        if dot and part in ("marks", "total"):
+            subjects.setdefault(subject, {})[part] = value
+        elif column == "subjects":
+            try:
+                record["subjects"] = json.loads(value)
+            except ValueError:
+                record["subjects"] = value  # reported by validation
+        else:
+            record[column] = value
+    if subjects:
+        record.setdefault("subjects", {})
+        if isinstance(record["subjects"], dict):
+            record["subjects"].update(subjects)
+    return record
+
+
+def iter_records(path: str, fmt: Optional[str] = None) -> Iterator[Tuple[int, Any]]:
+    """(position, raw record) pairs; position is the item index (JSON) or line/row number"""
+    fmt = fmt or detect_format(path)
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", newline="" if fmt == "csv" else None) as f:
+        if fmt == "json":
+            yield from enumerate(iter_json_array(f))
+        elif fmt == "jsonl":
+            for line_number, line in enumerate(f, start=1):
+                if not line.strip():
+                    continue
+                try:
+                    yield line_number, json.loads(line)
+                except ValueError as e:
+                    yield line_number, e
+        else:
+            for row_number, row in enumerate(csv.DictReader(f), start=2):
+                yield row_number, csv_record(row)
+
+
+@dataclass
+class IngestStats:
+    read: int = 0
+    invalid: int = 0
+    unchanged: int = 0
+    written: int = 0
+    reembedded: int = 0
+
+
+class StudentIngestor:
+    """Validates records and upserts them in concurrent batches, re-embedding only changed rows"""
+
+    def __init__(
+        self,
+        store,
+        batch_size: int,
+        concurrency: int,
+        reembed: bool = False,
+        dry_run: bool = False,
+        rejects: Optional[IO[str]] = None,
+        max_errors: Optional[int] = None,
+    ):
+        self.store = store
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.reembed = reembed
+        self.dry_run = dry_run
+        self.rejects = rejects
+        self.max_errors = max_errors
+        self.columns = store.student_columns.split(",")
+        self.stats = IngestStats()
+        self._lock = threading.Lock()
+        # Re-embedded students, linked into the similarity graph once at the end
+        # of the run (float16, like the graph keeps them)
+        self._graph_changes: List[Tuple[str, str, np.ndarray]] = []
+
+    def _row(self, record: StudentRecord) -> Dict[str, Any]:
+        data = record.model_dump()
+        return {column: data.get(column) for column in self.columns}
+
+    def _reject(self, position: int, error: Any):
+        with self._lock:
+            self.stats.invalid += 1
+            invalid = self.stats.invalid
+        if self.rejects is not None:
+            errors = error.errors(include_url=False) if isinstance(error, ValidationError) else str(error)
+            self.rejects.write(json.dumps({"position": position, "errors": errors}, default=str) + "\n")
+        if self.max_errors is not None and invalid > self.max_errors:
+            raise ValueError(f"More than {self.max_errors} invalid records, stopping")
+
+    def _write_batch(self, rows: List[Dict[str, Any]]):
+        existing = {row["student_id"]: row for row in self.store.get_students([row["student_id"] for row in rows])}
+        changed = [row for row in rows if existing.get(row["student_id"]) != row]
+        if changed and not self.dry_run:
+            self.store.upsert_students(changed)
+        with self._lock:
+            self.stats.unchanged += len(rows) - len(changed)
+            self.stats.written += len(changed)
+        if changed and self.reembed and not self.dry_run:
+            embedded = self.store.embed_students(changed)
+            with self._lock:
+                self._graph_changes.extend(
+                    (student_id, name, vector.astype(np.float16)) for student_id, name, vector in embedded
+                )
+                self.stats.reembedded += len(embedded)
+
+    def run(self, records: Iterable[Tuple[int, Any]]) -> IngestStats:
+        pending: Set[Future] = set()
+        batch: Dict[str, Dict[str, Any]] = {}
+        started = time.monotonic()
+
+        def submit(rows: List[Dict[str, Any]]):
+            nonlocal pending
+            # Bounded in-flight batches keep memory constant
+            if len(pending) >= self.concurrency:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(pool.submit(self._write_batch, rows))
+
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="ingest") as pool:
+            for position, raw in records:
+                self.stats.read += 1
+                if isinstance(raw, Exception):
+                    self._reject(position, raw)
+                    continue
+                try:
+                    record = StudentRecord.model_validate(raw)
+                except ValidationError as e:
+                    self._reject(position, e)
+                    continue
+                # A later record for the same student in one batch wins (upsert can't touch a row twice)
+                batch[record.student_id] = self._row(record)
+                if len(batch) >= self.batch_size:
+                    submit(list(batch.values()))
+                    batch = {}
+                if self.stats.read % (self.batch_size * 20) == 0:
+                    logger.info("Ingest progress", extra={**asdict(self.stats), "elapsed_s": round(time.monotonic() - started, 1)})
+            if batch:
+                submit(list(batch.values()))
+            for future in pending:
+                future.result()
+        if self._graph_changes:
+            # One read-modify-write of the graph file per run, not per batch
+            update_similarity_graph(self._graph_changes)
+            self._graph_changes = []
+        return self.stats
+
+
+def ingest(
+    path: str,
+    fmt: Optional[str] = None,
+    batch_size: Optional[int] = None,
+    concurrency: Optional[int] = None,
+    reembed: bool = False,
+    dry_run: bool = False,
+    rejects_path: Optional[str] = None,
+    max_errors: Optional[int] = None,
+) -> IngestStats:
+    """Stream one export file into the students table"""
+    from src.supabase_vector_store import get_vector_store
+    if reembed:
+        wait_for_models()
+        reserve_for_api()
+    rejects = open(rejects_path, "w", encoding="utf-8") if rejects_path else None
+    try:
+        ingestor = StudentIngestor(
+            get_vector_store(),
+            batch_size or config.INGEST_BATCH_SIZE,
+            concurrency or config.INGEST_CONCURRENCY,
+            reembed=reembed,
+            dry_run=dry_run,
+            rejects=rejects,
+            max_errors=max_errors,
+        )
+        stats = ingestor.run(iter_records(path, fmt))
+    finally:
+        if rejects is not None:
+            rejects.close()
+    logger.info("Ingest complete", extra={"path": path, **asdict(stats)})
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stream a student export into Supabase")
+    parser.add_argument("path", help="JSON array, JSONL or CSV file (.gz ok)")
+    parser.add_argument("--format", choices=FORMATS, default=None, help="default: from the file extension")
+    parser.add_argument("--batch-size", type=int, default=None, help=f"rows per upsert (default {config.INGEST_BATCH_SIZE})")
+    parser.add_argument("--concurrency", type=int, default=None, help=f"batches in flight (default {config.INGEST_CONCURRENCY})")
+    parser.add_argument("--reembed", action="store_true", help="re-embed new/changed students and update the similarity graph")
+    parser.add_argument("--dry-run", action="store_true", help="validate and diff only, write nothing")
+    parser.add_argument("--rejects", default=None, help="write invalid records' errors here (JSONL)")
+    parser.add_argument("--max-errors", type=int, default=None, help="stop after this many invalid records")
+    args = parser.parse_args()
+
+    stats = ingest(
+        args.path,
+        args.format,
+        args.batch_size,
+        args.concurrency,
+        reembed=args.reembed,
+        dry_run=args.dry_run,
+        rejects_path=args.rejects,
+        max_errors=args.max_errors,
+    )
+    print(json.dumps(asdict(stats), indent=2))
+
+
+if __name__ == "__main__":
+    main()
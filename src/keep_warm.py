@@ -0,0 +1,244 @@
+"""
+Keep the HF models loaded, and know when they aren't.
+
+HF unloads a model nobody has called for a while; the next call gets 503
+"model loading" for 20+ seconds. Two pieces deal with that:
+- ModelAvailability: per-model state (warm, or loading until an expected
+  time) shared by every process on the host through MODEL_STATE_DB and
+  updated from every upstream response. Callers check it first: a model
+  known to be loading for longer than MODEL_COLD_MAX_WAIT_SECONDS raises
+  ModelColdError straight away (the caller fails over or the API answers
+  503 with Retry-After) instead of sleeping inside the request.
+- KeepWarmScheduler: one process per host (file lock) pings each model once
+  nothing has used it for KEEP_WARM_INTERVAL_SECONDS, so quiet periods don't
+  let it unload, and re-checks a loading model when it is due back.
+"""
+import fcntl
+import math
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from src.config import config
+from src.metrics import KEEP_WARM_PINGS, UPSTREAM_COLD
+from src.tracing import get_logger
+
+logger = get_logger(__name__)
+
+# Scheduler wake-up period (pings themselves follow KEEP_WARM_INTERVAL_SECONDS)
+TICK_SECONDS = 5.0
+
+
+class ModelColdError(Exception):
+    """The model is loading and won't be ready within MODEL_COLD_MAX_WAIT_SECONDS"""
+
+    def __init__(self, key: str, retry_after: float):
+        self.key = key
+        self.upstream = key.split(":", 1)[0]
+        self.retry_after = retry_after
+        super().__init__(f"{key} is loading, expected ready in {retry_after:.0f}s")
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+class ModelAvailability:
+    """Model state in SQLite: last success, and until when a model is loading"""
+
+    def __init__(self, path: str, max_wait: float):
+        self.path = path or ":memory:"
+        self.max_wait = max_wait
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS models (
+                key TEXT PRIMARY KEY,
+                last_ok REAL NOT NULL DEFAULT 0,
+                loading_until REAL NOT NULL DEFAULT 0,
+                last_ping REAL NOT NULL DEFAULT 0
+            )"""
+        )
+
+    def _set(self, key: str, column: str, value: float):
+        with self._lock:
+            self._conn.execute("INSERT OR IGNORE INTO models (key) VALUES (?)", (key,))
+            self._conn.execute(f"UPDATE models SET {column} = ? WHERE key = ?", (value, key))
+
+    def _row(self, key: str) -> Tuple[float, float, float]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT last_ok, loading_until, last_ping FROM models WHERE key = ?", (key,)
+            ).fetchone()
+        return row or (0.0, 0.0, 0.0)
+
+    def record(self, key: str, status_code: int, loading_seconds: Optional[float] = None):
+        """Update from an upstream response (2xx = warm, 503 = loading)"""
+        now = time.time()
+        if 200 <= status_code < 300:
+            last_ok, loading_until, _ = self._row(key)
+            if not loading_until and now - last_ok < TICK_SECONDS:
+                return  # recorded moments ago; skip the write on busy paths
+            with self._lock:
+                self._conn.execute(
+                    "INSERT INTO models (key, last_ok) VALUES (?, ?) "
+                    "ON CONFLICT(key) DO UPDATE SET last_ok = excluded.last_ok, loading_until = 0",
+                    (key, now),
+                )
+        elif status_code == 503:
+            self._set(key, "loading_until", now + (loading_seconds or 0))
+            logger.warning("Model loading", extra={"model": key, "ready_in_s": loading_seconds})
+
+    def loading_for(self, key: str) -> float:
+        """Seconds until a loading model is expected back (0 = not known to be loading)"""
+        return max(0.0, self._row(key)[1] - time.time())
+
+    def check(self, key: str):
+        """
+        Call before an upstream request: returns at once for a warm model,
+        waits out a short load, raises ModelColdError for a long one
+        """
+        wait = self.loading_for(key)
+        if wait > self.max_wait:
+            raise ModelColdError(key, wait)
+        if wait:
+            time.sleep(wait)
+
+    def raise_if_loading(self, key: str):
+        """After retries ran out: report a loading model as such rather than as a generic failure"""
+        wait = self.loading_for(key)
+        if wait:
+            raise ModelColdError(key, wait)
+
+    def reject(self, error: ModelColdError):
+        """Count a request answered 503 because no model was available"""
+        UPSTREAM_COLD.labels(upstream=error.upstream, outcome="rejected").inc()
+        logger.warning("Model cold, failing fast", extra={"model": error.key, "retry_after_s": round(error.retry_after, 1)})
+
+    def failover(self, key: str, to: str):
+        """Count a request sent to a fallback model because `key` is loading"""
+        UPSTREAM_COLD.labels(upstream=key.split(":", 1)[0], outcome="failover").inc()
+        logger.info("Model cold, failing over", extra={"model": key, "fallback": to})
+
+    def due_for_ping(self, key: str, interval: float) -> bool:
+        """Idle for `interval`, or loading and due back (pings at most every TICK_SECONDS)"""
+        last_ok, loading_until, last_ping = self._row(key)
+        now = time.time()
+        if now - last_ping < TICK_SECONDS:
+            return False
+        if loading_until:
+            return now >= loading_until
+        return now - max(last_ok, last_ping) >= interval
+
+    def pinged(self, key: str):
+        self._set(key, "last_ping", time.time())
+
+    def status(self, keys: List[str]) -> Dict[str, Dict[str, Any]]:
+        now = time.time()
+        status = {}
+        for key in keys:
+            last_ok, loading_until, _ = self._row(key)
+            status[key] = {
+                "state": "loading" if loading_until > now else "warm" if last_ok else "unknown",
+                "ready_in_s": round(loading_until - now, 1) if loading_until > now else None,
+                "idle_s": round(now - last_ok, 1) if last_ok else None,
+            }
+        return status
+
+
+class KeepWarmScheduler:
+    """Background pinger; every worker competes for the lock, the winner pings"""
+
+    def __init__(self, availability: ModelAvailability, interval: float, lock_path: Optional[str]):
+        self.availability = availability
+        self.interval = interval
+        self.lock_path = lock_path
+        self._lock_file = None
+
+    @staticmethod
+    def targets() -> List[Tuple[str, Callable[[], int]]]:
+        """(model key, ping returning the status code) for each remote model in use"""
+        from src.rag_pipeline import get_rag_pipeline
+        pipeline = get_rag_pipeline()
+        llm = pipeline.llm_handler
+        targets = [(llm.rate_limit_key, llm.ping)]
+        if llm.fallback_model:
+            targets.append((llm.fallback_rate_limit_key, lambda: llm.ping(llm.fallback_model)))
+        embeddings = pipeline.vector_store.embedding_model
+        if hasattr(embeddings, "ping"):
+            targets.append((embeddings.rate_limit_key, embeddings.ping))
+        return targets
+
+    def try_become_pinger(self) -> bool:
+        if self.lock_path is None or self._lock_file is not None:
+            return True
+        lock_file = open(self.lock_path, "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
+
+    def run_once(self):
+        from src.warmup import get_readiness
+        if not get_readiness().is_ready:
+            return  # warm-up pings the models itself
+        for key, ping in self.targets():
+            if not self.availability.due_for_ping(key, self.interval):
+                continue
+            self.availability.pinged(key)
+            try:
+                status = ping()
+            except Exception as e:
+                status = "error"
+                logger.warning("Keep-warm ping failed", extra={"model": key, "error": str(e)})
+            KEEP_WARM_PINGS.labels(upstream=key.split(":", 1)[0], status=str(status)).inc()
+
+    def start(self):
+        def loop():
+            while True:
+                if self.try_become_pinger():
+                    try:
+                        self.run_once()
+                    except Exception as e:
+                        logger.error("Keep-warm round failed", extra={"error": str(e)})
+                time.sleep(TICK_SECONDS)
+        threading.Thread(target=loop, name="keep-warm", daemon=True).start()
+
+
+def model_status() -> Dict[str, Dict[str, Any]]:
+    """State of each remote model in use, for /ready"""
+    return get_model_availability().status([key for key, _ in KeepWarmScheduler.targets()])
+
+
+# Singleton instances
+_availability = None
+_availability_lock = threading.Lock()
+
+def get_model_availability() -> ModelAvailability:
+    """Get or create the process-wide model availability tracker"""
+    global _availability
+    if _availability is None:
+        with _availability_lock:
+            if _availability is None:
+                _availability = ModelAvailability(config.MODEL_STATE_DB, config.MODEL_COLD_MAX_WAIT_SECONDS)
+    return _availability
+
+def wait_for_models():
+    """Batch jobs (indexing, ingestion) wait out model loads instead of failing fast"""
+    get_model_availability().max_wait = float("inf")
+
+_scheduler = None
+
+def start_keep_warm() -> Optional[KeepWarmScheduler]:
+    """Start the keep-warm pinger in this process (no-op when KEEP_WARM_ENABLED is off)"""
+    global _scheduler
+    if _scheduler is None and config.KEEP_WARM_ENABLED:
+        lock_path = f"{config.MODEL_STATE_DB}.lock" if config.MODEL_STATE_DB else None
+        _scheduler = KeepWarmScheduler(get_model_availability(), config.KEEP_WARM_INTERVAL_SECONDS, lock_path)
+        _scheduler.start()
+    return _scheduler
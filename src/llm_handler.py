@@ -1,19 +1,33 @@
+import json
 import requests
 import time
-from typing import List, Dict
+from typing import List, Dict, Iterator, Optional, Tuple
 from src.config import config
+from src.metrics import UPSTREAM_RETRIES, UPSTREAM_503
+from src.tracing import get_logger, record_span, span
+from src.rate_limiter import get_rate_limiter, loading_wait
+from src.keep_warm import ModelColdError, get_model_availability
+from src.transcripts import record_usage
+
+logger = get_logger(__name__)
 
 class LLMHandler:
     def __init__(self):
         """Initialize the LLM using HuggingFace Chat Completions API (OpenAI-compatible)"""
+        config.require("huggingface")
         self.api_url = config.HF_CHAT_COMPLETIONS_ENDPOINT
         self.headers = {
             "Authorization": f"Bearer {config.HF_API_KEY}",
             "Content-Type": "application/json"
         }
         self.model = config.LLM_MODEL
-        print(f"Using HuggingFace Chat Completions API for LLM: {config.LLM_MODEL}")
-        print("No models will be downloaded to your device!")
+        self.rate_limit_key = f"llm:{self.model}"
+        # Used while the primary model is loading (see src/keep_warm.py)
+        self.fallback_model = config.LLM_FALLBACK_MODEL
+        self.fallback_rate_limit_key = f"llm:{self.fallback_model}" if self.fallback_model else None
+        # Keep-alive connection pool so requests after warm-up skip the TLS handshake
+        self.session = requests.Session()
+        logger.info("Using HuggingFace Chat Completions API for LLM", extra={"model": config.LLM_MODEL})
     
     def create_conversation_messages(
         self, 
@@ -23,6 +37,10 @@ class LLMHandler:
     ) -> List[Dict[str, str]]:
         """Create OpenAI-compatible messages array with history"""
         
+        # Computed outside the f-string: backslashes aren't allowed in f-string
+        # expressions before Python 3.12
+        student_name = context.split('Name: ')[1].split('\n')[0] if 'Name:' in context else 'student'
+        
         system_prompt = f"""You are Zeeshan's Bot, an educational AI assistant specializing in student performance analysis. 
 
 Your personality:
@@ -44,7 +62,7 @@ Your responsibilities:
 7. Be encouraging and supportive
 
 Example interactions:
-- User: "Hi" → You: "Hi there! I'm Zeeshan's Bot. I'm here to help analyze {context.split('Name: ')[1].split('\\n')[0] if 'Name:' in context else 'student'} performance. What would you like to know?"
+- User: "Hi" → You: "Hi there! I'm Zeeshan's Bot. I'm here to help analyze {student_name} performance. What would you like to know?"
 - User: "How are you?" → You: "I'm doing great, thanks! Ready to discuss student performance whenever you are."
 - User: "Thanks" → You: "You're welcome! Let me know if you need anything else about the student's performance."
 
@@ -63,7 +81,45 @@ Always be helpful, natural, and student-focused."""
         messages.append({"role": "user", "content": current_message})
         
         return messages
-    
+
+    def create_class_map_messages(self, question: str, student_lines: List[str]) -> List[Dict[str, str]]:
+        """Map step of a class query: notes on one chunk of students"""
+        students = "\n".join(f"- {line}" for line in student_lines)
+        return [
+            {
+                "role": "system",
+                "content": "You are Zeeshan's Bot, an educational AI assistant. You are reading one group of "
+                           "students from a larger class. Write at most 5 short bullet points of observations "
+                           "from this group that help answer the teacher's question. Mention student IDs only "
+                           "when a student is a clear example. Do not answer the question itself."
+            },
+            {"role": "user", "content": f"Question: {question}\n\nStudents:\n{students}"}
+        ]
+
+    def create_class_reduce_messages(
+        self,
+        question: str,
+        aggregates: Dict,
+        notes: List[str],
+        sampled: bool
+    ) -> List[Dict[str, str]]:
+        """Reduce step of a class query: one answer from class aggregates and map notes"""
+        content = f"Question: {question}\n\nClass statistics (computed over every student):\n{json.dumps(aggregates, indent=1)}"
+        if notes:
+            scope = "a representative sample of the class" if sampled else "the whole class"
+            content += f"\n\nObservations from group summaries ({scope}):\n" + "\n\n".join(notes)
+        return [
+            {
+                "role": "system",
+                "content": "You are Zeeshan's Bot, an educational AI assistant specializing in student performance "
+                           "analysis. Answer the teacher's question about the whole class. Use the class statistics "
+                           "for numbers (they are exact) and the group observations for explanations. Be concise, "
+                           "reference concrete figures and end with actionable suggestions. Performance categories: "
+                           "Fantastic (≥85% + good attendance), Average (60-85%), Below Average (<60%)."
+            },
+            {"role": "user", "content": content}
+        ]
+
     def generate_response(self, messages: List[Dict[str, str]]) -> str:
         """Generate response using HuggingFace Chat Completions API"""
         payload = {
@@ -74,27 +130,35 @@ Always be helpful, natural, and student-focused."""
             "top_p": 0.95
         }
         
+        limiter = get_rate_limiter()
         max_retries = 3
         for attempt in range(max_retries):
+            # Raises ModelColdError (-> 503) when no model is available soon
+            payload["model"], key = self.available_model()
+            if key != self.rate_limit_key:
+                get_model_availability().failover(self.rate_limit_key, payload["model"])
             try:
-                response = requests.post(
-                    self.api_url,
-                    headers=self.headers,
-                    json=payload,
-                    timeout=60
-                )
+                limiter.acquire(key)
+                with span("upstream.llm", attempt=attempt + 1) as attrs:
+                    response = self.session.post(
+                        self.api_url,
+                        headers=self.headers,
+                        json=payload,
+                        timeout=60
+                    )
+                    attrs["status"] = response.status_code
                 
-                if response.status_code == 503:
-                    print(f"Model is loading... waiting 20 seconds (attempt {attempt + 1}/{max_retries})")
-                    time.sleep(20)
+                if self._must_retry(limiter, key, response, attempt, max_retries):
                     continue
                 
                 if response.status_code != 200:
-                    print(f"API Error {response.status_code}: {response.text}")
+                    logger.error("LLM API error", extra={"status": response.status_code, "body": response.text[:500]})
                 
                 response.raise_for_status()
                 result = response.json()
                 
+                record_usage(payload["model"], result.get("usage"))
+                
                 # Extract message from OpenAI-compatible response
                 if "choices" in result and len(result["choices"]) > 0:
                     message = result["choices"][0].get("message", {})
@@ -106,11 +170,143 @@ Always be helpful, natural, and student-focused."""
             except requests.exceptions.RequestException as e:
                 if attempt == max_retries - 1:
                     return f"Error generating response: {str(e)}"
-                print(f"Request failed (attempt {attempt + 1}/{max_retries}): {str(e)}")
+                logger.warning("LLM request failed", extra={"attempt": attempt + 1, "max_retries": max_retries, "error": str(e)})
                 time.sleep(5)
+                UPSTREAM_RETRIES.labels(upstream="llm").inc()
         
+        get_model_availability().raise_if_loading(key)
         return "Failed to generate response after multiple attempts."
     
+    def stream_response(self, messages: List[Dict[str, str]]) -> Iterator[str]:
+        """Generate a response as it is produced, yielding content deltas (server-sent events)"""
+        payload = {
+            "model": self.model,
+            "messages": messages,
+            "max_tokens": 512,
+            "temperature": 0.7,
+            "top_p": 0.95,
+            "stream": True,
+            # Token usage arrives in the final chunk
+            "stream_options": {"include_usage": True}
+        }
+        
+        limiter = get_rate_limiter()
+        max_retries = 3
+        for attempt in range(max_retries):
+            # Retries are only possible before the first token has been sent on
+            payload["model"], key = self.available_model()
+            if key != self.rate_limit_key:
+                get_model_availability().failover(self.rate_limit_key, payload["model"])
+            limiter.acquire(key)
+            # Timed by hand rather than with span(): the body is read across
+            # generator steps that may run on different threadpool workers
+            attrs = {"attempt": attempt + 1, "stream": True}
+            started = time.perf_counter()
+            try:
+                response = self.session.post(
+                    self.api_url,
+                    headers=self.headers,
+                    json=payload,
+                    timeout=60,
+                    stream=True
+                )
+                attrs["status"] = response.status_code
+                if self._must_retry(limiter, key, response, attempt, max_retries):
+                    response.close()
+                    continue
+                
+                if response.status_code != 200:
+                    logger.error("LLM API error", extra={"status": response.status_code, "body": response.text[:500]})
+                response.raise_for_status()
+                
+                with response:
+                    for line in response.iter_lines(decode_unicode=True):
+                        if not line or not line.startswith("data:"):
+                            continue
+                        data = line[len("data:"):].strip()
+                        if data == "[DONE]":
+                            return
+                        chunk = json.loads(data)
+                        if chunk.get("usage"):
+                            record_usage(payload["model"], chunk["usage"])
+                        choices = chunk.get("choices") or []
+                        if choices:
+                            content = choices[0].get("delta", {}).get("content")
+                            if content:
+                                if "first_token_ms" not in attrs:
+                                    attrs["first_token_ms"] = round((time.perf_counter() - started) * 1000, 3)
+                                yield content
+                return
+            except requests.exceptions.RequestException as e:
+                attrs["error"] = repr(e)
+                # Mid-answer the error ends the stream; before it, retry like generate_response
+                if "first_token_ms" in attrs or attempt == max_retries - 1:
+                    raise
+                logger.warning("LLM stream request failed", extra={"attempt": attempt + 1, "max_retries": max_retries, "error": str(e)})
+            except BaseException as e:
+                attrs["error"] = repr(e)
+                raise
+            finally:
+                record_span("upstream.llm", (time.perf_counter() - started) * 1000, **attrs)
+            time.sleep(5)
+            UPSTREAM_RETRIES.labels(upstream="llm").inc()
+        
+        get_model_availability().raise_if_loading(key)
+        raise requests.exceptions.RetryError("LLM still unavailable after multiple attempts")
+    
+    def available_model(self) -> Tuple[str, str]:
+        """
+        (model, rate-limit key) to call: LLM_MODEL, or LLM_FALLBACK_MODEL while
+        LLM_MODEL is known to be loading. Raises ModelColdError when neither
+        is available within MODEL_COLD_MAX_WAIT_SECONDS.
+        """
+        availability = get_model_availability()
+        try:
+            availability.check(self.rate_limit_key)
+            return self.model, self.rate_limit_key
+        except ModelColdError:
+            if not self.fallback_model:
+                raise
+            availability.check(self.fallback_rate_limit_key)
+            return self.fallback_model, self.fallback_rate_limit_key
+    
+    def _must_retry(self, limiter, key: str, response: requests.Response, attempt: int, max_retries: int) -> bool:
+        """
+        Feed the response to the shared rate limiter (429 / Retry-After pause
+        the bucket) and to the model availability tracker (503 = loading for
+        estimated_time); the next attempt's available_model() then waits out a
+        short load, fails over, or fails fast instead of sleeping
+        """
+        hint = loading_wait(response, default=20) if response.status_code == 503 else None
+        limiter.observe(key, response.status_code, response.headers)
+        get_model_availability().record(key, response.status_code, hint)
+        if response.status_code not in (429, 503):
+            return False
+        if response.status_code == 503:
+            UPSTREAM_503.labels(upstream="llm").inc()
+            logger.warning("LLM is loading", extra={"model": key, "attempt": attempt + 1, "max_retries": max_retries, "wait_seconds": hint})
+        UPSTREAM_RETRIES.labels(upstream="llm").inc()
+        return True
+    
+    def ping(self, model: Optional[str] = None) -> int:
+        """Send a minimal completion to open the connection and wake the model; returns the status code"""
+        model = model or self.model
+        key = f"llm:{model}"
+        payload = {
+            "model": model,
+            "messages": [{"role": "user", "content": "ping"}],
+            "max_tokens": 1
+        }
+        limiter = get_rate_limiter()
+        limiter.acquire(key)
+        with span("upstream.llm", op="ping") as attrs:
+            response = self.session.post(self.api_url, headers=self.headers, json=payload, timeout=30)
+            attrs["status"] = response.status_code
+        limiter.observe(key, response.status_code, response.headers)
+        hint = loading_wait(response, default=20) if response.status_code == 503 else None
+        get_model_availability().record(key, response.status_code, hint)
+        return response.status_code
+    
     def generate_suggestions(self, student_data: Dict, conversation_context: str) -> List[str]:
         """Generate contextual follow-up suggestions"""
         suggestions = []
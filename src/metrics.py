@@ -0,0 +1,132 @@
+import os
+import time
+from contextlib import contextmanager
+from typing import Tuple
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Latency buckets (seconds) - LLM calls routinely take several seconds,
+# so the upper buckets go well past the usual web defaults
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60)
+
+# HTTP layer
+REQUEST_COUNT = Counter(
+    "http_requests_total",
+    "Total HTTP requests",
+    ["method", "route", "status"]
+)
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds",
+    "HTTP request latency per route",
+    ["method", "route"],
+    buckets=LATENCY_BUCKETS
+)
+
+# RAG pipeline stages (student_fetch, prompt_build, llm_call, suggestions;
+# class queries: class_aggregate, class_map, class_reduce)
+PIPELINE_STAGE_LATENCY = Histogram(
+    "rag_pipeline_stage_duration_seconds",
+    "Latency of each RAGPipeline.process_query stage",
+    ["stage"],
+    buckets=LATENCY_BUCKETS
+)
+
+# Upstream (HuggingFace / Supabase) behaviour
+UPSTREAM_RETRIES = Counter(
+    "upstream_retries_total",
+    "Retried upstream calls",
+    ["upstream"]
+)
+UPSTREAM_503 = Counter(
+    "upstream_503_total",
+    "Upstream 503 (model loading) responses",
+    ["upstream"]
+)
+UPSTREAM_THROTTLED = Counter(
+    "upstream_throttled_total",
+    "Upstream 429 (rate limited) responses",
+    ["upstream"]
+)
+UPSTREAM_COLD = Counter(
+    "upstream_model_cold_total",
+    "Calls that found the model loading, by outcome (failover / rejected)",
+    ["upstream", "outcome"]
+)
+KEEP_WARM_PINGS = Counter(
+    "keep_warm_pings_total",
+    "Keep-warm pings sent, by response status",
+    ["upstream", "status"]
+)
+RATE_LIMIT_TIMEOUTS = Counter(
+    "rate_limit_timeouts_total",
+    "Calls that gave up because no rate-limit token was available within the max wait",
+    ["upstream"]
+)
+
+RATE_LIMIT_WAIT = Histogram(
+    "rate_limit_wait_seconds",
+    "Time spent waiting for an outbound rate-limit token",
+    ["upstream"],
+    buckets=LATENCY_BUCKETS
+)
+
+# LLM usage (chat-completions `usage`) and the write-behind transcript log
+LLM_TOKENS = Counter(
+    "llm_tokens_total",
+    "LLM tokens used, by kind (prompt / completion)",
+    ["kind"]
+)
+TRANSCRIPT_TURNS = Counter(
+    "transcript_turns_total",
+    "Chat turns handed to the transcript sink, by outcome (written / dropped)",
+    ["outcome"]
+)
+
+# Caches report hits/misses under their own name
+CACHE_HITS = Counter(
+    "cache_hits_total",
+    "Cache hits",
+    ["cache"]
+)
+CACHE_MISSES = Counter(
+    "cache_misses_total",
+    "Cache misses",
+    ["cache"]
+)
+
+
+@contextmanager
+def time_stage(stage: str):
+    """Observe the duration of a pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        PIPELINE_STAGE_LATENCY.labels(stage=stage).observe(time.perf_counter() - start)
+
+
+def record_cache(cache: str, hit: bool):
+    """Count a cache lookup"""
+    if hit:
+        CACHE_HITS.labels(cache=cache).inc()
+    else:
+        CACHE_MISSES.labels(cache=cache).inc()
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Render metrics in Prometheus text format.
+    With several uvicorn workers set PROMETHEUS_MULTIPROC_DIR so every
+    worker's samples are aggregated into one scrape.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
\ No newline at end of file
@@ -1,5 +1,6 @@
-from pydantic import BaseModel, Field
-from typing import Optional, List
+from pydantic import BaseModel, Field, model_validator
+from typing import Optional, List, Literal, Dict, Any, Union
+from src.config import config
 
 class Message(BaseModel):
     role: str = Field(..., description="Role: 'user' or 'assistant'")
@@ -9,6 +10,10 @@ class ChatRequest(BaseModel):
     student_id: str = Field(..., description="Student ID to query about")
     message: str = Field(..., description="User's message")
     conversation_history: Optional[List[Message]] = Field(default=[], description="Previous conversation")
+    response_mode: Literal["full", "delta"] = Field(
+        default="full",
+        description="'full' echoes the whole conversation_history; 'delta' returns only the new turn plus a history digest"
+    )
     
     class Config:
         json_schema_extra = {
@@ -24,7 +29,9 @@ class ChatResponse(BaseModel):
     message: str
     response: str
     performance_category: Optional[str] = None
-    conversation_history: List[Message]
+    conversation_history: Optional[List[Message]] = Field(default=None, description="Full history (response_mode='full' only)")
+    new_messages: List[Message] = Field(default=[], description="The turn added by this request")
+    history_digest: str = Field(default="", description="Chained SHA-256 of the history including the new turn")
     suggestions: List[str] = Field(default=[], description="Suggested follow-up questions")
     
     class Config:
@@ -39,6 +46,115 @@ class ChatResponse(BaseModel):
             }
         }
 
+class SearchFilters(BaseModel):
+    semester: Optional[int] = None
+    performance_category: Optional[Literal["Fantastic", "Average", "Below Average"]] = None
+    min_attendance: Optional[float] = None
+    max_attendance: Optional[float] = None
+    subject_min_marks: Optional[Dict[str, float]] = Field(default=None, description="Subject -> minimum percentage")
+    subject_max_marks: Optional[Dict[str, float]] = Field(default=None, description="Subject -> maximum percentage")
+    partition: Optional[str] = Field(default=None, description="Only this partition (value of PARTITION_KEY, e.g. an institution)")
+    
+    def is_empty(self) -> bool:
+        return all(value is None for value in self.model_dump().values())
+    
+    def to_rpc_params(self) -> Dict[str, Any]:
+        """Arguments for the match_student_embeddings_filtered/_batch RPCs"""
+        params = {
+            "filter_semester": self.semester,
+            "filter_category": self.performance_category,
+            "min_attendance": self.min_attendance,
+            "max_attendance": self.max_attendance,
+            "subject_min_marks": self.subject_min_marks,
+            "subject_max_marks": self.subject_max_marks,
+        }
+        if self.partition is not None:
+            params["filter_partition_key"] = config.PARTITION_KEY
+            params["filter_partition"] = self.partition
+        return params
+
+class SearchRequest(BaseModel):
+    queries: List[str] = Field(..., min_length=1, description="One or more search queries, embedded in a single call")
+    k: int = Field(default=5, ge=1, le=100)
+    filters: Optional[SearchFilters] = None
+    
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "queries": ["struggling with programming", "excellent attendance"],
+                "k": 5,
+                "filters": {"semester": 3, "min_attendance": 75, "subject_min_marks": {"Mathematics": 60}}
+            }
+        }
+
+class SearchResult(BaseModel):
+    query: str
+    students: List[Dict[str, Any]]
+
+class SearchResponse(BaseModel):
+    results: List[SearchResult]
+
+class ClassQueryRequest(BaseModel):
+    question: str = Field(..., description="Question about a whole class")
+    filters: Optional[SearchFilters] = Field(default=None, description="Which students make up the class (e.g. a semester)")
+    detail: Literal["auto", "summary", "narrative"] = Field(
+        default="auto",
+        description="'summary' answers from class statistics only; 'narrative' also reads students' notes (map-reduce); 'auto' picks from the question"
+    )
+    
+    class Config:
+        json_schema_extra = {
+            "example": {
+                "question": "Which subjects is semester 3 struggling with overall?",
+                "filters": {"semester": 3},
+                "detail": "auto"
+            }
+        }
+
+class ClassQueryResponse(BaseModel):
+    question: str
+    response: str
+    mode: Literal["summary", "narrative"]
+    students: int = Field(..., description="Students in the class")
+    aggregates: Dict[str, Any] = Field(default={}, description="Class statistics the answer was based on")
+    roster_version: Optional[str] = None
+    cached: bool = False
+
+class SubjectMarks(BaseModel):
+    # int first so "85" (CSV) stays 85 and renders the same as JSON input
+    marks: Union[int, float] = Field(..., ge=0)
+    total: Union[int, float] = Field(..., gt=0)
+    
+    @model_validator(mode="after")
+    def marks_within_total(self):
+        if self.marks > self.total:
+            raise ValueError(f"marks ({self.marks}) exceed total ({self.total})")
+        return self
+
+class StudentRecord(BaseModel):
+    """One row of the students table, as accepted by bulk ingestion (src/ingest.py)"""
+    student_id: str = Field(..., min_length=1)
+    name: str = Field(..., min_length=1)
+    semester: int = Field(..., ge=1)
+    subjects: Dict[str, SubjectMarks] = Field(..., min_length=1)
+    attendance: Union[int, float] = Field(..., ge=0, le=100)
+    assignments_submitted: int = Field(..., ge=0)
+    total_assignments: int = Field(..., ge=0)
+    performance_notes: str = ""
+    
+    class Config:
+        # Extra columns (e.g. the PARTITION_KEY) are kept
+        extra = "allow"
+        str_strip_whitespace = True
+    
+    @model_validator(mode="after")
+    def submitted_within_total(self):
+        if self.assignments_submitted > self.total_assignments:
+            raise ValueError(
+                f"assignments_submitted ({self.assignments_submitted}) exceeds total_assignments ({self.total_assignments})"
+            )
+        return self
+
 class HealthResponse(BaseModel):
     status: str
     message: str
\ No newline at end of file
@@ -0,0 +1,113 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import List
+import numpy as np
+from src.config import config
+from src.tracing import get_logger, span
+
+logger = get_logger(__name__)
+
+MODEL_REPO = "BAAI/bge-small-en-v1.5"
+MAX_SEQUENCE_LENGTH = 512
+
+
+class OnnxEmbeddingModel:
+    """
+    Runs BAAI/bge-small-en-v1.5 in-process on CPU with ONNX Runtime.
+
+    Produces the same 384-d, CLS-pooled, L2-normalized vectors as the remote
+    feature-extraction endpoint, so it can query an index built remotely and
+    vice versa. Batches are spread over a thread pool (ONNX Runtime releases
+    the GIL while running).
+    """
+
+    def __init__(self):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+
+        model_path, tokenizer_path = self._resolve_files()
+        if config.ONNX_QUANTIZE:
+            model_path = self._quantized(model_path)
+
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = config.ONNX_THREADS
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+        self.tokenizer = Tokenizer.from_file(tokenizer_path)
+        self.tokenizer.enable_truncation(max_length=MAX_SEQUENCE_LENGTH)
+        self.tokenizer.enable_padding(pad_id=0, pad_token="[PAD]")
+        # Tokenizer objects aren't safe to share across threads while padding is configured
+        self._tokenizer_lock = threading.Lock()
+
+        self.batch_size = config.ONNX_BATCH_SIZE
+        self.pool = ThreadPoolExecutor(max_workers=config.ONNX_POOL_WORKERS, thread_name_prefix="onnx-embed")
+        logger.info("Using local ONNX embeddings", extra={
+            "model": MODEL_REPO,
+            "path": model_path,
+            "quantized": config.ONNX_QUANTIZE,
+        })
+
+    @staticmethod
+    def _resolve_files():
+        """Use ONNX_MODEL_DIR if it has the files, otherwise download them from the Hub"""
+        local_model = os.path.join(config.ONNX_MODEL_DIR, "model.onnx")
+        local_tokenizer = os.path.join(config.ONNX_MODEL_DIR, "tokenizer.json")
+        if os.path.exists(local_model) and os.path.exists(local_tokenizer):
+            return local_model, local_tokenizer
+        from huggingface_hub import hf_hub_download
+        model_path = hf_hub_download(MODEL_REPO, "onnx/model.onnx")
+        tokenizer_path = hf_hub_download(MODEL_REPO, "tokenizer.json")
+        return model_path, tokenizer_path
+
+    @staticmethod
+    def _quantized(model_path: str) -> str:
+        """Dynamic int8 quantization of the weights, cached next to the other model files"""
+        os.makedirs(config.ONNX_MODEL_DIR, exist_ok=True)
+        quantized_path = os.path.join(config.ONNX_MODEL_DIR, "model.int8.onnx")
+        if not os.path.exists(quantized_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+            logger.info("Quantizing embedding model to int8", extra={"path": quantized_path})
+            tmp_path = quantized_path + ".tmp"
+            quantize_dynamic(model_path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, quantized_path)
+        return quantized_path
+
+    def _run_batch(self, texts: List[str]) -> np.ndarray:
+        with self._tokenizer_lock:
+            encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([e.ids for e in encodings], dtype=np.int64)
+        attention_mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+        last_hidden_state = self.session.run(None, feeds)[0]
+        # bge uses the [CLS] token as the sentence embedding, then L2-normalizes
+        cls = last_hidden_state[:, 0]
+        return cls / np.linalg.norm(cls, axis=1, keepdims=True).clip(min=1e-12)
+
+    def embed_text(self, text: str) -> List[float]:
+        """Generate embedding"""
+        with span("embed.onnx", texts=1):
+            return self._run_batch([text])[0].tolist()
+
+    def embed_texts(self, texts: List[str]) -> List[List[float]]:
+        """Generate multiple embeddings, batched and run in parallel"""
+        if not texts:
+            return []
+        # Sort by length so each batch pads to a similar length, then restore order
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        batches = [order[i:i + self.batch_size] for i in range(0, len(order), self.batch_size)]
+        with span("embed.onnx", texts=len(texts), batches=len(batches)):
+            results = self.pool.map(lambda batch: self._run_batch([texts[i] for i in batch]), batches)
+            embeddings: List[List[float]] = [None] * len(texts)
+            for batch, vectors in zip(batches, results):
+                for i, vector in zip(batch, vectors):
+                    embeddings[i] = vector.tolist()
+        return embeddings
+
+    def embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Generate embeddings for several texts (same as embed_texts locally)"""
+        return self.embed_texts(texts)
\ No newline at end of file
@@ -0,0 +1,206 @@
+"""
+Vector search partitioned by PARTITION_KEY (institution, semester, ...).
+
+Each partition's embeddings are pulled from student_embeddings on first use
+(`metadata->>PARTITION_KEY = value`) into an in-memory matrix and kept in an
+LRU of at most PARTITION_CACHE_SIZE partitions, refreshed after
+PARTITION_TTL_SECONDS or once another index version becomes active. A query filtered to one partition only touches that
+partition; otherwise it fans out to every partition in parallel (numpy
+releases the GIL in the matmul) and the per-partition top-k are merged.
+A fan-out over more partitions than the cache holds would evict and reload
+them on every query, so it is left to the unpartitioned database search.
+"""
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from src.config import config
+from src.metrics import record_cache
+from src.profiler import get_profiler
+from src.models import SearchFilters
+from src.tracing import get_logger, span
+from src.utils import matches_filters
+
+logger = get_logger(__name__)
+
+EMBEDDING_DIM = 384
+
+# (similarity, content, metadata)
+Match = Tuple[float, str, Dict[str, Any]]
+
+
+class Partition:
+    """One partition's normalized vectors plus the rows they belong to"""
+
+    def __init__(self, name: str, rows: Iterable[Dict[str, Any]], version: Optional[int] = None):
+        self.name = name
+        self.version = version
+        self.loaded_at = time.monotonic()
+        self.contents: List[str] = []
+        self.metadata: List[Dict[str, Any]] = []
+        vectors = []
+        for row in rows:
+            self.contents.append(row["content"])
+            self.metadata.append(row["metadata"])
+            vectors.append(row["embedding"])
+        matrix = np.array(vectors, dtype=np.float32).reshape(len(vectors), -1) if vectors \
+            else np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+        self.vectors = matrix / np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+
+    def __len__(self) -> int:
+        return len(self.contents)
+
+    def search(self, queries: np.ndarray, k: int, filters: Optional[SearchFilters]) -> List[List[Match]]:
+        """Top-k per query within this partition"""
+        if not len(self):
+            return [[] for _ in range(len(queries))]
+        scores = queries @ self.vectors.T
+        if filters is not None:
+            allowed = np.array([matches_filters(m, filters) for m in self.metadata], dtype=bool)
+            scores[:, ~allowed] = -np.inf
+        k = min(k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        results = []
+        for row_scores, row_top in zip(scores, top):
+            results.append([
+                (float(row_scores[i]), self.contents[i], self.metadata[i])
+                for i in row_top if np.isfinite(row_scores[i])
+            ])
+        return results
+
+
+class PartitionedIndex:
+    """LRU of loaded partitions with parallel fan-out search"""
+
+    def __init__(
+        self,
+        list_partitions: Callable[[], List[str]],
+        load_partition: Callable[[str], Iterable[Dict[str, Any]]],
+        max_loaded: int,
+        ttl: float,
+        workers: int,
+        current_version: Callable[[], Optional[int]] = lambda: None,
+    ):
+        self._list_partitions = list_partitions
+        self._load_partition = load_partition
+        self._current_version = current_version
+        self.max_loaded = max_loaded
+        self.ttl = ttl
+        self._loaded: "OrderedDict[str, Partition]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._load_locks: Dict[str, threading.Lock] = {}
+        self._names: Optional[List[str]] = None
+        self._names_loaded_at = 0.0
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="partition-search")
+
+    def partitions(self) -> List[str]:
+        """Known partition names (re-listed every `ttl` seconds)"""
+        now = time.monotonic()
+        if self._names is None or now - self._names_loaded_at > self.ttl:
+            with span("partitions.list"):
+                self._names = sorted(self._list_partitions())
+            self._names_loaded_at = now
+        return self._names
+
+    def get(self, name: str) -> Partition:
+        """Loaded partition, loading it on first use (one loader per partition)"""
+        version = self._current_version()
+
+        def is_current(partition: Optional[Partition]) -> bool:
+            return partition is not None and partition.version == version \
+                and time.monotonic() - partition.loaded_at <= self.ttl
+
+        with self._lock:
+            partition = self._loaded.get(name)
+            if is_current(partition):
+                self._loaded.move_to_end(name)
+                record_cache("partitions", True)
+                return partition
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+        record_cache("partitions", False)
+        with load_lock:
+            with self._lock:
+                partition = self._loaded.get(name)
+            if not is_current(partition):
+                with span("partitions.load", partition=name) as attrs:
+                    partition = Partition(name, self._load_partition(name), version)
+                    attrs["rows"] = len(partition)
+                with self._lock:
+                    self._loaded[name] = partition
+                    self._loaded.move_to_end(name)
+                    while len(self._loaded) > self.max_loaded:
+                        evicted, _ = self._loaded.popitem(last=False)
+                        logger.info("Evicted partition", extra={"partition": evicted})
+        return partition
+
+    def invalidate(self, name: Optional[str] = None):
+        """Drop one partition (or all) so the next query reloads it"""
+        with self._lock:
+            if name is None:
+                self._loaded.clear()
+                self._names = None
+            else:
+                self._loaded.pop(name, None)
+
+    def _targets(self, filters: Optional[SearchFilters]) -> List[str]:
+        if filters is not None and filters.partition is not None:
+            return [filters.partition]
+        if filters is not None and filters.semester is not None and config.PARTITION_KEY == "semester":
+            return [str(filters.semester)]
+        return self.partitions()
+
+    def search_many(
+        self,
+        query_embeddings: List[List[float]],
+        k: int,
+        filters: Optional[SearchFilters] = None
+    ) -> Optional[List[List[Match]]]:
+        """
+        Top-k per query over the targeted partitions, best first; None when
+        they don't all fit in the cache (the caller searches unpartitioned)
+        """
+        targets = self._targets(filters)
+        if len(targets) > self.max_loaded:
+            logger.debug("Fan-out exceeds the partition cache", extra={"partitions": len(targets), "max_loaded": self.max_loaded})
+            return None
+        queries = np.array(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True).clip(min=1e-12)
+
+        def search_partition(name: str) -> List[List[Match]]:
+            return self.get(name).search(queries, k, filters)
+
+        with span("partitions.search", partitions=len(targets), queries=len(queries)):
+            if len(targets) == 1:
+                per_partition = [search_partition(targets[0])]
+            else:
+                per_partition = list(self.pool.map(get_profiler().profiled(search_partition), targets))
+        return [
+            heapq.nlargest(k, (match for partition in per_partition for match in partition[q]), key=lambda m: m[0])
+            for q in range(len(queries))
+        ]
+
+
+# Singleton instance
+_partitioned_index = None
+_partitioned_index_lock = threading.Lock()
+
+def get_partitioned_index() -> Optional[PartitionedIndex]:
+    """Partitioned index over Supabase, or None when PARTITIONED_SEARCH is off"""
+    global _partitioned_index
+    if _partitioned_index is None and config.PARTITIONED_SEARCH:
+        with _partitioned_index_lock:
+            if _partitioned_index is None:
+                from src.supabase_vector_store import get_vector_store
+                store = get_vector_store()
+                _partitioned_index = PartitionedIndex(
+                    store.list_partitions,
+                    store.iter_partition,
+                    config.PARTITION_CACHE_SIZE,
+                    config.PARTITION_TTL_SECONDS,
+                    config.PARTITION_SEARCH_WORKERS,
+                    store.active_index_version,
+                )
+    return _partitioned_index
@@ -0,0 +1,174 @@
+import functools
+import sys
+import threading
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, Any, Iterable, Iterator, List, Optional
+from src.tracing import get_logger
+
+logger = get_logger(__name__)
+
+# Whether the current request is being profiled (copied into threadpool calls)
+_profiling: ContextVar[bool] = ContextVar("profiling", default=False)
+
+
+class SamplingProfiler:
+    """
+    Low-overhead sampling CPU profiler armed on demand for the next N requests.
+
+    A background thread snapshots the stacks of the threads doing a profiled
+    request's work every `interval` seconds and aggregates the samples as
+    collapsed stacks (the format consumed by flamegraph.pl and speedscope).
+    The request's work runs on threadpool workers, not on the event loop
+    (which would only show it idling in select), so the endpoints wrap what
+    they hand to the threadpool with profiled() / profiled_iter().
+    """
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._remaining = 0
+        self._active: Dict[int, int] = {}  # thread id -> in-flight profiled requests
+        self._samples: Counter = Counter()
+        self._total_samples = 0
+        self._profiled_requests = 0
+        self._sampler: Optional[threading.Thread] = None
+
+    def arm(self, requests: int, interval: Optional[float] = None):
+        """Profile the next `requests` requests, discarding previous samples"""
+        with self._lock:
+            self._remaining = max(0, requests)
+            if interval:
+                self.interval = interval
+            self._samples.clear()
+            self._total_samples = 0
+            self._profiled_requests = 0
+        logger.info("profiler armed", extra={"requests": requests, "interval": self.interval})
+
+    def begin_request(self) -> bool:
+        """Mark the current request as profiled if the profiler is armed"""
+        with self._lock:
+            if self._remaining <= 0:
+                return False
+            self._remaining -= 1
+            self._profiled_requests += 1
+        _profiling.set(True)
+        return True
+
+    def profiled(self, fn):
+        """Wrap fn so the thread running it is sampled while the current request is profiled"""
+        if not _profiling.get():
+            return fn
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            self._attach()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self._detach()
+        return wrapper
+
+    def profiled_iter(self, iterable: Iterable) -> Iterable:
+        """Like profiled() for a generator whose steps run on threadpool workers (streaming responses)"""
+        if not _profiling.get():
+            return iterable
+        return self._profiled_steps(iter(iterable))
+
+    def _profiled_steps(self, iterator: Iterator) -> Iterator:
+        try:
+            while True:
+                self._attach()
+                try:
+                    item = next(iterator, StopIteration)
+                finally:
+                    self._detach()
+                if item is StopIteration:
+                    return
+                yield item
+        finally:
+            # A client disconnect closes us; pass it on so the inner generator's cleanup runs
+            close = getattr(iterator, "close", None)
+            if close is not None:
+                close()
+
+    def _attach(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            self._active[thread_id] = self._active.get(thread_id, 0) + 1
+            if self._sampler is None or not self._sampler.is_alive():
+                self._sampler = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+                self._sampler.start()
+
+    def _detach(self):
+        thread_id = threading.get_ident()
+        with self._lock:
+            count = self._active.get(thread_id, 0) - 1
+            if count > 0:
+                self._active[thread_id] = count
+            else:
+                self._active.pop(thread_id, None)
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while True:
+            with self._lock:
+                targets = list(self._active)
+            if not targets:
+                return
+            frames = sys._current_frames()
+            stacks = []
+            for thread_id in targets:
+                frame = frames.get(thread_id)
+                if frame is not None and thread_id != own_id:
+                    stacks.append(self._collapse(frame))
+            with self._lock:
+                for stack in stacks:
+                    self._samples[stack] += 1
+                    self._total_samples += 1
+            time.sleep(self.interval)
+
+    @staticmethod
+    def _collapse(frame) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({code.co_filename}:{frame.f_lineno})")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+    def collapsed(self) -> str:
+        """Samples in collapsed-stack text format"""
+        with self._lock:
+            return "\n".join(f"{stack} {count}" for stack, count in self._samples.most_common())
+
+    def report(self, top: int = 25) -> Dict[str, Any]:
+        """Summary with the functions that appear most often at the top of the stack"""
+        with self._lock:
+            self_time: Counter = Counter()
+            for stack, count in self._samples.items():
+                self_time[stack.rsplit(";", 1)[-1]] += count
+            total = self._total_samples
+            hot: List[Dict[str, Any]] = [
+                {"function": fn, "samples": n, "percent": round(100 * n / total, 2) if total else 0}
+                for fn, n in self_time.most_common(top)
+            ]
+            return {
+                "remaining_requests": self._remaining,
+                "profiled_requests": self._profiled_requests,
+                "total_samples": total,
+                "interval": self.interval,
+                "hot_functions": hot,
+            }
+
+
+# Singleton instance
+_profiler = None
+
+def get_profiler() -> SamplingProfiler:
+    """Get or create the profiler instance"""
+    global _profiler
+    if _profiler is None:
+        _profiler = SamplingProfiler()
+    return _profiler
\ No newline at end of file
@@ -1,13 +1,132 @@
-from typing import Dict, Any, List
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Any, List, Iterator, Optional, Tuple
 from src.supabase_vector_store import get_vector_store
 from src.llm_handler import get_llm_handler
-from src.utils import calculate_average_marks, categorize_performance
+from src.metrics import time_stage
+from src.profiler import get_profiler
+from src.tracing import get_logger, span
+from src.context_cache import get_context_cache
+from src.class_query import (
+    UNVERSIONED_CACHE_SECONDS,
+    ClassAggregator,
+    choose_mode,
+    class_key,
+    class_map_pool,
+    get_class_query_cache,
+    is_llm_failure,
+)
+from src.models import SearchFilters
+from src.config import config
+
+logger = get_logger(__name__)
+
+@contextmanager
+def _stage(name: str):
+    """Trace a pipeline stage and record it in the stage latency histogram"""
+    with span(name), time_stage(name):
+        yield
 
 class RAGPipeline:
     def __init__(self):
         self.vector_store = get_vector_store()
         self.llm_handler = get_llm_handler()
     
+    def _load_student(self, student_id: str, prefetch: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Student record, rendered context and performance category. A prefetch
+        caches them for the student's next turn only; every other turn reads
+        them fresh, so ingested changes show up on the following turn.
+        """
+        cache = get_context_cache()
+        cached = None if prefetch else cache.take_context(student_id)
+        if cached is not None:
+            return cached
+        
+        # Step 1-3: Record, rendered context (for the LLM) and performance
+        # category in one round-trip, fresh from the students table
+        with _stage("student_fetch"):
+            loaded = self.vector_store.get_student_context(student_id)
+        
+        if not loaded:
+            return None
+        student_data, content, performance_category = loaded["student"], loaded["context"], loaded["performance_category"]
+        
+        if prefetch:
+            cache.put_context(student_id, student_data, content, performance_category)
+        return {"student": student_data, "context": content, "performance_category": performance_category}
+    
+    def _prepare(
+        self,
+        student_id: str,
+        message: str,
+        conversation_history: List[Dict[str, str]]
+    ) -> Optional[Tuple[Dict[str, Any], str, List[Dict[str, str]]]]:
+        """Fetch the student and build the LLM messages (None if the student is unknown)"""
+        loaded = self._load_student(student_id)
+        if loaded is None:
+            return None
+        
+        # Step 4: Build the conversational prompt with history
+        with _stage("prompt_build"):
+            messages = self.llm_handler.create_conversation_messages(message, loaded["context"], conversation_history)
+        
+        return loaded["student"], loaded["performance_category"], messages
+    
+    def _speculative_answer(self, student_id: str, message: str, conversation_history: List[Dict[str, str]]) -> Optional[str]:
+        """
+        Answer generated ahead of time by prefetch(), if this is the question it
+        anticipated. Waits at most PREFETCH_SPECULATION_WAIT_SECONDS for one still
+        being generated; None (make a live call) if it isn't ready or failed.
+        """
+        if conversation_history:
+            return None
+        future = get_context_cache().take_speculation(student_id, message)
+        if future is None:
+            return None
+        try:
+            return future.result(timeout=config.PREFETCH_SPECULATION_WAIT_SECONDS)
+        except Exception:
+            return None
+    
+    def prefetch(self, student_id: str, speculate: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Load and render a student's context ahead of the first question and,
+        optionally, start generating the answer to the usual opening question
+        in the background. Returns None if the student is unknown.
+        """
+        loaded = self._load_student(student_id, prefetch=True)
+        if loaded is None:
+            return None
+        speculating = False
+        if speculate:
+            question = config.PREFETCH_OPENING_QUESTION
+            future = get_context_cache().start_speculation(student_id, question)
+            if future is not None:
+                messages = self.llm_handler.create_conversation_messages(question, loaded["context"], [])
+                _speculation_pool().submit(self._speculate, future, messages)
+                speculating = True
+        return {"performance_category": loaded["performance_category"], "speculating": speculating}
+    
+    def _speculate(self, future, messages: List[Dict[str, str]]):
+        try:
+            response = self.llm_handler.generate_response(messages)
+        except Exception as e:
+            future.set_exception(e)
+            return
+        # generate_response reports failures as text; never serve that as an answer
+        if is_llm_failure(response):
+            future.set_exception(RuntimeError(response))
+        else:
+            future.set_result(response)
+    
+    @staticmethod
+    def _not_found_message(student_id: str) -> str:
+        return f"I don't have data for student ID {student_id}. Please select a student from the sidebar to begin our conversation."
+    
     def process_query(
         self, 
         student_id: str, 
@@ -19,54 +138,212 @@ class RAGPipeline:
         if conversation_history is None:
             conversation_history = []
         
-        # Step 1: First, try to get the student directly by ID (more reliable)
-        student_data = self.vector_store.get_student_by_id(student_id)
-        
-        if not student_data:
+        prepared = self._prepare(student_id, message, conversation_history)
+        if prepared is None:
             # If student not found, provide helpful message
             return {
-                "response": f"I don't have data for student ID {student_id}. Please select a student from the sidebar to begin our conversation.",
+                "response": self._not_found_message(student_id),
                 "performance_category": None,
-                "conversation_history": conversation_history,
+                "new_messages": [],
                 "suggestions": []
             }
+        student_data, performance_category, messages = prepared
         
-        # Step 2: Get the formatted content for this student (used for LLM context)
-        # Always format fresh data - don't rely on cached embeddings
-        from src.utils import format_student_data_for_embedding
-        content = format_student_data_for_embedding(student_data)
-        context = content
-        
-        # Step 3: Determine performance category
-        avg_marks = calculate_average_marks(student_data['subjects'])
-        performance_category = categorize_performance(avg_marks, student_data['attendance'])
+        # Step 5: Generate conversational response (or use the prefetched one)
+        with _stage("llm_call"):
+            response = self._speculative_answer(student_id, message, conversation_history)
+            if response is None:
+                response = self.llm_handler.generate_response(messages)
         
-        # Step 4: Generate conversational response with history
-        messages = self.llm_handler.create_conversation_messages(message, context, conversation_history)
-        response = self.llm_handler.generate_response(messages)
-        
-        # Step 5: Update conversation history
-        updated_history = conversation_history + [
+        # Step 6: The new turn only - callers append it to their history, so
+        # we don't copy the whole (ever-growing) conversation on every turn
+        new_messages = [
             {"role": "user", "content": message},
             {"role": "assistant", "content": response}
         ]
         
-        # Step 6: Generate contextual suggestions
-        suggestions = self.llm_handler.generate_suggestions(student_data, response)
+        # Step 7: Generate contextual suggestions
+        with _stage("suggestions"):
+            suggestions = self.llm_handler.generate_suggestions(student_data, response)
         
         return {
             "response": response,
             "performance_category": performance_category,
-            "conversation_history": updated_history,
+            "new_messages": new_messages,
+            "suggestions": suggestions
+        }
+    
+    def stream_query(
+        self,
+        student_id: str,
+        message: str,
+        conversation_history: List[Dict[str, str]] = None
+    ) -> Iterator[Dict[str, Any]]:
+        """
+        Like process_query, but returns an iterator of events so the answer can be
+        rendered as it is generated:
+            {"type": "start", "performance_category": ...}
+            {"type": "token", "content": ...}   (repeated)
+            {"type": "done", "new_messages": [...], "suggestions": [...]}
+        or {"type": "error", "detail": ...} if the LLM call fails mid-stream.
+        Retrieval and prompt building happen eagerly, before the first event.
+        """
+        if conversation_history is None:
+            conversation_history = []
+        prepared = self._prepare(student_id, message, conversation_history)
+        if prepared is not None:
+            # Fail fast (ModelColdError -> 503) before the response has started
+            self.llm_handler.available_model()
+        return self._stream_events(student_id, message, conversation_history, prepared)
+    
+    def _stream_events(
+        self,
+        student_id: str,
+        message: str,
+        conversation_history: List[Dict[str, str]],
+        prepared: Optional[Tuple[Dict[str, Any], str, List[Dict[str, str]]]]
+    ) -> Iterator[Dict[str, Any]]:
+        if prepared is None:
+            yield {"type": "start", "performance_category": None}
+            yield {"type": "token", "content": self._not_found_message(student_id)}
+            yield {"type": "done", "new_messages": [], "suggestions": []}
+            return
+        student_data, performance_category, messages = prepared
+        yield {"type": "start", "performance_category": performance_category}
+        
+        # Events are pulled from a worker thread per chunk, so only the stage
+        # histogram is recorded here (trace spans can't cross those threads)
+        parts = []
+        try:
+            with time_stage("llm_call"):
+                speculative = self._speculative_answer(student_id, message, conversation_history)
+                deltas = [speculative] if speculative is not None else self.llm_handler.stream_response(messages)
+                for delta in deltas:
+                    parts.append(delta)
+                    yield {"type": "token", "content": delta}
+        except Exception as e:
+            yield {"type": "error", "detail": f"Error generating response: {str(e)}"}
+            return
+        response = "".join(parts).strip()
+        
+        with time_stage("suggestions"):
+            suggestions = self.llm_handler.generate_suggestions(student_data, response)
+        yield {
+            "type": "done",
+            "new_messages": [
+                {"role": "user", "content": message},
+                {"role": "assistant", "content": response}
+            ],
             "suggestions": suggestions
         }
+    
+    def process_class_query(
+        self,
+        question: str,
+        filters: Optional[SearchFilters] = None,
+        detail: str = "auto"
+    ) -> Dict[str, Any]:
+        """
+        Answer a question about a whole class (see src/class_query.py):
+        local aggregation, parallel map calls over student chunks when the
+        question needs narrative detail, then a single reduce call
+        """
+        cache = get_class_query_cache()
+        mode = choose_mode(question, detail)
+        scope = class_key(filters)
+        
+        # Read before the roster: a change mid-scan can only make the entry
+        # newer than its version, never older
+        version = self.vector_store.roster_version()
+        versioned = version is not None
+        cache_version = version if versioned else f"t{int(time.time() // UNVERSIONED_CACHE_SECONDS)}"
+        answer_key = (cache_version, scope, mode, " ".join(question.lower().split()))
+        cached = cache.get("answers", answer_key)
+        if cached is not None:
+            return {**cached, "cached": True}
+        
+        # Step 1: Reduce the roster locally (one streaming pass)
+        aggregated = cache.get("aggregates", (cache_version, scope))
+        if aggregated is None:
+            with _stage("class_aggregate"):
+                aggregator = ClassAggregator(config.CLASS_MAP_MAX_STUDENTS, seed=f"{cache_version}:{scope}")
+                for student in self.vector_store.iter_roster(filters):
+                    aggregator.add(student)
+                aggregated = {"aggregates": aggregator.summary(), "sample": aggregator.sample}
+            cache.put("aggregates", (cache_version, scope), aggregated, versioned)
+        aggregates, sample = aggregated["aggregates"], aggregated["sample"]
+        
+        result = {
+            "question": question,
+            "mode": mode,
+            "students": aggregates["students"],
+            "aggregates": aggregates,
+            "roster_version": version,
+        }
+        if not aggregates["students"]:
+            return {**result, "response": "No students match these filters, so there is no class to analyze.", "cached": False}
+        
+        # Step 2: Map - summarize chunks of students in parallel
+        notes = []
+        if mode == "narrative":
+            with _stage("class_map"):
+                notes = self._map_class(question, sample)
+        
+        # Step 3: Reduce - one answer from the exact aggregates and the map notes
+        with _stage("class_reduce"):
+            messages = self.llm_handler.create_class_reduce_messages(
+                question, aggregates, notes, sampled=len(sample) < aggregates["students"]
+            )
+            response = self.llm_handler.generate_response(messages)
+        
+        result["response"] = response
+        if not is_llm_failure(response):
+            cache.put("answers", answer_key, result, versioned)
+        return {**result, "cached": False}
+    
+    def _map_class(self, question: str, sample: List[str]) -> List[str]:
+        """Notes from each CLASS_MAP_CHUNK_SIZE chunk of student lines (failed chunks are dropped)"""
+        size = config.CLASS_MAP_CHUNK_SIZE
+        chunks = [sample[start:start + size] for start in range(0, len(sample), size)]
+        # Each call runs in a copy of this context so its spans join the request trace
+        futures = [
+            class_map_pool().submit(
+                contextvars.copy_context().run,
+                get_profiler().profiled(self.llm_handler.generate_response),
+                self.llm_handler.create_class_map_messages(question, chunk),
+            )
+            for chunk in chunks
+        ]
+        notes = []
+        for future in futures:
+            try:
+                note = future.result()
+            except Exception as e:
+                logger.warning("Class map call failed", extra={"error": str(e)})
+                continue
+            if note and not is_llm_failure(note):
+                notes.append(note)
+        return notes
+
+# Bounded pool so prefetch speculation can't flood the LLM
+_speculation_executor = None
+
+def _speculation_pool() -> ThreadPoolExecutor:
+    global _speculation_executor
+    if _speculation_executor is None:
+        _speculation_executor = ThreadPoolExecutor(max_workers=config.PREFETCH_WORKERS, thread_name_prefix="speculate")
+    return _speculation_executor
 
 # Singleton instance
 _rag_pipeline = None
+_rag_pipeline_lock = threading.Lock()
 
 def get_rag_pipeline() -> RAGPipeline:
     """Get or create the RAG pipeline instance"""
     global _rag_pipeline
     if _rag_pipeline is None:
-        _rag_pipeline = RAGPipeline()
+        # Warm-up thread and early requests may race to build it
+        with _rag_pipeline_lock:
+            if _rag_pipeline is None:
+                _rag_pipeline = RAGPipeline()
     return _rag_pipeline
\ No newline at end of file
@@ -0,0 +1,323 @@
+"""
+Outbound rate shaping for HuggingFace calls, shared by every process on the host.
+
+Each upstream/model pair ("llm:meta-llama/...", "embeddings:BAAI/...") has a
+token bucket stored in a small SQLite database, so all uvicorn workers and
+the indexer draw from the same budget. Buckets adapt to what the provider
+tells us:
+- 429 halves the bucket's refill rate (slowly restored on success)
+- Retry-After (on 429/503), X-RateLimit-Remaining: 0 + X-RateLimit-Reset, or a
+  caller-supplied hint pause the bucket for every process until that time
+Callers wait exactly as long as the bucket says, never a fixed sleep, but at
+most RATE_LIMIT_MAX_WAIT_SECONDS in the API (RateLimitTimeout -> 503 with
+Retry-After), so a long provider pause can't pin every threadpool worker.
+Chat endpoints take their LLM token with acquire_async() on the event loop
+before handing the request to a worker; the worker's acquire() then uses that
+token instead of waiting again. Other calls (retries, class-query fan-out,
+embeddings, which fall back to local ONNX) still wait in the worker.
+Batch jobs (index builds, ingestion) call reserve_for_api(): they wait as
+long as it takes, and only take tokens while RATE_LIMIT_BATCH_RESERVE of the
+burst is left for API requests, which keeps query latency flat during a
+rebuild. Model
+loading (503 + `estimated_time`) is tracked separately, in src/keep_warm.py,
+so requests can fail fast instead of waiting a load out.
+"""
+import asyncio
+import math
+import sqlite3
+import threading
+import time
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from typing import Dict, Mapping, Optional, Tuple
+from src.config import config
+from src.metrics import RATE_LIMIT_TIMEOUTS, RATE_LIMIT_WAIT, UPSTREAM_THROTTLED
+from src.tracing import get_logger
+
+logger = get_logger(__name__)
+
+# Rate never drops below this fraction of the configured rate after 429s
+MIN_RATE_FRACTION = 0.1
+# Each success restores this fraction of the configured rate
+RECOVERY_FRACTION = 0.05
+
+# Tokens the current request already waited for with acquire_async(), by key
+_granted: ContextVar[Optional[Dict[str, float]]] = ContextVar("rate_limit_granted", default=None)
+
+
+class RateLimitTimeout(Exception):
+    """Raised when a token isn't available within the caller's max_wait"""
+
+    def __init__(self, key: str, max_wait: float, retry_after: float):
+        self.key = key
+        self.upstream = key.split(":", 1)[0]
+        self.retry_after = retry_after
+        super().__init__(f"No {self.upstream} capacity within {max_wait}s")
+
+    @property
+    def retry_after_header(self) -> str:
+        return str(max(1, math.ceil(self.retry_after)))
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After is either delay-seconds or an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def loading_wait(response, default: float) -> float:
+    """Seconds until a 503'd HF model is expected to be loaded (body field estimated_time)"""
+    try:
+        return float(response.json().get("estimated_time", default))
+    except (ValueError, AttributeError, TypeError):
+        return default
+
+
+class _Waiting:
+    """acquire()/acquire_async() on top of try_acquire(), which returns 0 or the seconds to wait"""
+
+    max_wait: Optional[float] = None
+
+    def try_acquire(self, key: str, tokens: float = 1.0) -> float:
+        raise NotImplementedError
+
+    def refund(self, key: str, tokens: float):
+        """Put back tokens that were taken but not used"""
+
+    def acquire(self, key: str, tokens: float = 1.0, max_wait: Optional[float] = None) -> float:
+        """
+        Block until tokens are granted; returns the time waited. Tokens this
+        request already got from acquire_async() are used first. Raises
+        RateLimitTimeout instead of waiting longer than max_wait (default:
+        self.max_wait, unbounded in batch jobs).
+        """
+        granted = _granted.get()
+        if granted and granted.get(key, 0.0) >= tokens:
+            granted[key] -= tokens
+            return 0.0
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.monotonic()
+        while True:
+            wait = self.try_acquire(key, tokens)
+            if wait == 0:
+                return self._waited(key, start)
+            self._check_wait(key, max_wait, start, wait)
+            time.sleep(wait)
+
+    async def acquire_async(self, key: str, tokens: float = 1.0, max_wait: Optional[float] = None) -> float:
+        """
+        Like acquire(), but waits on the event loop (asyncio.sleep) instead of
+        holding a threadpool worker. The tokens are kept for the current
+        request: the next acquire() of `key` in its threadpool work uses them.
+        Call return_unused() when the request ends.
+        """
+        max_wait = self.max_wait if max_wait is None else max_wait
+        start = time.monotonic()
+        while True:
+            wait = self.try_acquire(key, tokens)
+            if wait == 0:
+                break
+            self._check_wait(key, max_wait, start, wait)
+            await asyncio.sleep(wait)
+        granted = _granted.get()
+        if granted is None:
+            granted = {}
+            _granted.set(granted)
+        granted[key] = granted.get(key, 0.0) + tokens
+        return self._waited(key, start)
+
+    def return_unused(self):
+        """Refund tokens acquire_async() took for this request that no call used"""
+        granted = _granted.get()
+        if not granted:
+            return
+        for key, tokens in granted.items():
+            if tokens > 0:
+                self.refund(key, tokens)
+        granted.clear()
+
+    @staticmethod
+    def _check_wait(key: str, max_wait: Optional[float], start: float, wait: float):
+        if max_wait is not None and time.monotonic() - start + wait > max_wait:
+            RATE_LIMIT_TIMEOUTS.labels(upstream=key.split(":", 1)[0]).inc()
+            raise RateLimitTimeout(key, max_wait, wait)
+
+    @staticmethod
+    def _waited(key: str, start: float) -> float:
+        waited = time.monotonic() - start
+        RATE_LIMIT_WAIT.labels(upstream=key.split(":", 1)[0]).observe(waited)
+        return waited
+
+
+class RateLimiter(_Waiting):
+    """Token buckets in SQLite; all state transitions happen in one IMMEDIATE transaction"""
+
+    def __init__(self, path: str, limits: Dict[str, Tuple[float, float]]):
+        """`limits` maps an upstream name to (requests per second, burst size)"""
+        self.path = path or ":memory:"
+        self.limits = limits
+        # Share of each burst this process leaves to others, and the longest
+        # acquire() waits by default (None = unbounded; see reserve_for_api)
+        self.reserve = 0.0
+        self.max_wait: Optional[float] = config.RATE_LIMIT_MAX_WAIT_SECONDS
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+        if self.path != ":memory:":
+            self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS buckets (
+                key TEXT PRIMARY KEY,
+                tokens REAL NOT NULL,
+                rate REAL NOT NULL,
+                updated REAL NOT NULL,
+                blocked_until REAL NOT NULL DEFAULT 0
+            )"""
+        )
+
+    def _limits_for(self, key: str) -> Tuple[float, float]:
+        return self.limits[key.split(":", 1)[0]]
+
+    def _transaction(self, key: str, update):
+        """Run update(tokens, rate, blocked_until, now, base_rate) -> ((tokens, rate, blocked_until), result) atomically"""
+        base_rate, burst = self._limits_for(key)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                row = self._conn.execute(
+                    "SELECT tokens, rate, updated, blocked_until FROM buckets WHERE key = ?", (key,)
+                ).fetchone()
+                if row is None:
+                    row = (burst, base_rate, now, 0.0)
+                tokens, rate, updated, blocked_until = row
+                # Refill since the last visit by any process
+                tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+                (tokens, rate, blocked_until), result = update(tokens, rate, blocked_until, now, base_rate)
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, rate, updated, blocked_until) VALUES (?, ?, ?, ?, ?)",
+                    (key, tokens, rate, now, blocked_until),
+                )
+                self._conn.execute("COMMIT")
+                return result
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def try_acquire(self, key: str, tokens: float = 1.0) -> float:
+        """Take tokens if available; returns 0, or the seconds to wait before trying again"""
+        _, burst = self._limits_for(key)
+        needed = tokens + min(self.reserve * burst, max(0.0, burst - tokens))
+
+        def update(available, rate, blocked_until, now, base_rate):
+            if blocked_until > now:
+                return (available, rate, blocked_until), blocked_until - now
+            if available >= needed:
+                return (available - tokens, rate, blocked_until), 0.0
+            return (available, rate, blocked_until), (needed - available) / rate
+        return self._transaction(key, update)
+
+    def refund(self, key: str, tokens: float):
+        _, burst = self._limits_for(key)
+
+        def update(available, rate, blocked_until, now, base_rate):
+            return (min(burst, available + tokens), rate, blocked_until), None
+        self._transaction(key, update)
+
+    def block(self, key: str, seconds: float):
+        """Pause the bucket for every process (e.g. from Retry-After)"""
+        def update(available, rate, blocked_until, now, base_rate):
+            return (available, rate, max(blocked_until, now + seconds)), None
+        self._transaction(key, update)
+
+    def observe(self, key: str, status_code: int, headers: Mapping[str, str], hint: Optional[float] = None):
+        """Adapt the bucket to an upstream response"""
+        upstream = key.split(":", 1)[0]
+        pause = parse_retry_after(headers.get("Retry-After"))
+        if pause is None and headers.get("X-RateLimit-Remaining") == "0":
+            reset = parse_retry_after(headers.get("X-RateLimit-Reset"))
+            # Reset is sent as either seconds-from-now or an epoch timestamp
+            pause = reset - time.time() if reset is not None and reset > 1e9 else reset
+        if pause is None:
+            pause = hint
+
+        if status_code == 429:
+            UPSTREAM_THROTTLED.labels(upstream=upstream).inc()
+
+            def update(available, rate, blocked_until, now, base_rate):
+                rate = max(base_rate * MIN_RATE_FRACTION, rate / 2)
+                if pause:
+                    blocked_until = max(blocked_until, now + pause)
+                return (0.0, rate, blocked_until), rate
+            rate = self._transaction(key, update)
+            logger.warning("Upstream rate limited us", extra={"key": key, "retry_after": pause, "rate": round(rate, 3)})
+        elif pause:
+            self.block(key, pause)
+        elif 200 <= status_code < 300:
+            # Additive recovery towards the configured rate (no-op when already there)
+            base_rate, _ = self._limits_for(key)
+            with self._lock:
+                self._conn.execute(
+                    "UPDATE buckets SET rate = MIN(?, rate + ?) WHERE key = ? AND rate < ?",
+                    (base_rate, base_rate * RECOVERY_FRACTION, key, base_rate),
+                )
+
+
+class _Unlimited(_Waiting):
+    """
+    Stand-in when RATE_LIMIT_ENABLED is off: no budget, but a provider's
+    Retry-After still pauses this process's next acquire() of that key
+    """
+
+    reserve = 0.0
+
+    def __init__(self):
+        self.max_wait: Optional[float] = config.RATE_LIMIT_MAX_WAIT_SECONDS
+        self._blocked_until: Dict[str, float] = {}
+
+    def try_acquire(self, key: str, tokens: float = 1.0) -> float:
+        return max(0.0, self._blocked_until.get(key, 0.0) - time.time())
+
+    def block(self, key: str, seconds: float):
+        self._blocked_until[key] = max(self._blocked_until.get(key, 0.0), time.time() + seconds)
+
+    def observe(self, key: str, status_code: int, headers: Mapping[str, str], hint: Optional[float] = None):
+        pause = parse_retry_after(headers.get("Retry-After")) or hint
+        if pause and status_code in (429, 503):
+            self.block(key, pause)
+
+
+# Singleton instance
+_rate_limiter = None
+_rate_limiter_lock = threading.Lock()
+
+def get_rate_limiter() -> RateLimiter:
+    """Get or create the process-wide rate limiter"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        with _rate_limiter_lock:
+            if _rate_limiter is None:
+                if config.RATE_LIMIT_ENABLED:
+                    _rate_limiter = RateLimiter(config.RATE_LIMIT_DB, {
+                        "llm": (config.RATE_LIMIT_LLM_RPS, config.RATE_LIMIT_LLM_BURST),
+                        "embeddings": (config.RATE_LIMIT_EMBEDDINGS_RPS, config.RATE_LIMIT_EMBEDDINGS_BURST),
+                    })
+                else:
+                    _rate_limiter = _Unlimited()
+    return _rate_limiter
+
+def reserve_for_api():
+    """
+    Batch jobs leave RATE_LIMIT_BATCH_RESERVE of every bucket's burst to API
+    requests, and wait as long as the buckets say (there is no client to answer)
+    """
+    limiter = get_rate_limiter()
+    limiter.reserve = config.RATE_LIMIT_BATCH_RESERVE
+    limiter.max_wait = None
@@ -0,0 +1,419 @@
+"""
+Local SQLite (WAL) read replica of the students and student_embeddings tables.
+
+One process per host (whichever worker takes the file lock, or a dedicated
+`python -m src.replica`) keeps REPLICA_PATH up to date:
+- every REPLICA_SYNC_SECONDS it pulls the rows whose `version` is above the
+  last one it applied, plus tombstones of deleted rows (the version column,
+  triggers and tombstone table come from sql/replica_sync.sql)
+- every REPLICA_FULL_SYNC_SECONDS it re-reads both tables and drops local
+  rows that no longer exist upstream
+Only the active index version of student_embeddings is copied
+(sql/index_versions.sql); a switch to a new version triggers a full sync.
+All workers read the same file through per-thread connections, so a student
+lookup is a primary-key hit on local disk. Reads are trusted while the last
+successful sync is at most REPLICA_MAX_STALENESS_SECONDS old; past that the
+vector store goes back to Supabase, and only answers from the (stale) replica
+when Supabase itself fails.
+"""
+import fcntl
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import numpy as np
+from src.config import config
+from src.models import SearchFilters
+from src.tracing import get_logger, span
+from src.utils import format_student_data_for_embedding, matches_filters
+
+logger = get_logger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS students (
+    student_id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    record TEXT NOT NULL,
+    context TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    seen INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS embeddings (
+    student_id TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    metadata TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    version INTEGER NOT NULL,
+    seen INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    value REAL NOT NULL
+);
+"""
+
+# Upstream table -> local table
+TABLES = {"students": "students", "student_embeddings": "embeddings"}
+
+
+def _parse_embedding(value) -> List[float]:
+    # pgvector columns come back from PostgREST as the string "[0.1,0.2,...]"
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
+class Replica:
+    """Reader and (in one process) syncer of the local replica"""
+
+    def __init__(self, path: str, max_staleness: float, sync_interval: float, full_sync_interval: float):
+        self.path = path
+        self.max_staleness = max_staleness
+        self.sync_interval = sync_interval
+        self.full_sync_interval = full_sync_interval
+        self._local = threading.local()
+        self._syncer_lock_file = None
+        self._vectors: Optional[Tuple[float, List[str], np.ndarray, List[Dict[str, Any]]]] = None
+        self._vectors_lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=10)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(SCHEMA)
+        conn.close()
+
+    # --- reads ---------------------------------------------------------
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10)
+            conn.execute("PRAGMA query_only=ON")
+            self._local.conn = conn
+        return conn
+
+    def _state(self, name: str, conn: Optional[sqlite3.Connection] = None) -> float:
+        row = (conn or self._reader()).execute("SELECT value FROM sync_state WHERE name = ?", (name,)).fetchone()
+        return row[0] if row else 0.0
+
+    def lag(self) -> Optional[float]:
+        """Seconds since the last successful sync (None if never synced)"""
+        synced_at = self._state("synced_at")
+        return time.time() - synced_at if synced_at else None
+
+    def is_fresh(self) -> bool:
+        lag = self.lag()
+        return lag is not None and lag <= self.max_staleness
+
+    def get_record(self, student_id: str) -> Optional[Dict[str, Any]]:
+        row = self._reader().execute("SELECT record FROM students WHERE student_id = ?", (student_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get_context(self, student_id: str) -> Optional[Tuple[Dict[str, Any], str]]:
+        """(record, rendered context)"""
+        row = self._reader().execute(
+            "SELECT record, context FROM students WHERE student_id = ?", (student_id,)
+        ).fetchone()
+        return (json.loads(row[0]), row[1]) if row else None
+
+    def list_students(self) -> List[Dict[str, str]]:
+        rows = self._reader().execute("SELECT student_id, name FROM students ORDER BY student_id").fetchall()
+        return [{"student_id": student_id, "name": name} for student_id, name in rows]
+
+    def iter_students(self) -> Iterator[Dict[str, Any]]:
+        """Every student record, in student_id order"""
+        for (record,) in self._reader().execute("SELECT record FROM students ORDER BY student_id"):
+            yield json.loads(record)
+
+    def roster_version(self) -> str:
+        """Changes whenever a sync adds, changes or removes a student"""
+        conn = self._reader()
+        return "{}.{}.{}".format(
+            int(self._state("cursor:students", conn)),
+            int(self._state("cursor:replica_tombstones", conn)),
+            int(self._state("full_synced_at", conn)),
+        )
+
+    def _load_vectors(self) -> Tuple[List[str], np.ndarray, List[Dict[str, Any]]]:
+        """Normalized embedding matrix, reloaded when a sync changed the embeddings"""
+        version = self._state("embeddings_changed_at")
+        cached = self._vectors
+        if cached is not None and cached[0] == version:
+            return cached[1], cached[2], cached[3]
+        with self._vectors_lock:
+            cached = self._vectors
+            if cached is not None and cached[0] == version:
+                return cached[1], cached[2], cached[3]
+            with span("replica.load_vectors"):
+                rows = self._reader().execute(
+                    "SELECT student_id, metadata, embedding FROM embeddings ORDER BY student_id"
+                ).fetchall()
+                ids = [row[0] for row in rows]
+                metadata = [json.loads(row[1]) for row in rows]
+                matrix = np.frombuffer(b"".join(row[2] for row in rows), dtype=np.float32).reshape(len(rows), -1)
+                matrix = matrix / np.linalg.norm(matrix, axis=1, keepdims=True).clip(min=1e-12)
+            self._vectors = (version, ids, matrix, metadata)
+            return ids, matrix, metadata
+
+    def search_many(
+        self,
+        query_embeddings: List[List[float]],
+        k: int,
+        filters: Optional[SearchFilters] = None
+    ) -> Optional[List[Tuple[List[str], List[Dict[str, Any]]]]]:
+        """(contents, metadata) per query, best first; None while the replica holds no embeddings"""
+        ids, matrix, metadata = self._load_vectors()
+        if not ids:
+            return None
+        queries = np.array(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        queries /= np.linalg.norm(queries, axis=1, keepdims=True).clip(min=1e-12)
+        scores = queries @ matrix.T
+        if filters is not None and not filters.is_empty():
+            allowed = np.array([matches_filters(m, filters) for m in metadata], dtype=bool)
+            scores[:, ~allowed] = -np.inf
+        k = min(k, len(ids))
+        conn = self._reader()
+        results = []
+        for row_scores in scores:
+            top = np.argpartition(-row_scores, k - 1)[:k]
+            top = [i for i in top[np.argsort(-row_scores[top])] if np.isfinite(row_scores[i])]
+            contents, found = [], []
+            for i in top:
+                row = conn.execute("SELECT content FROM embeddings WHERE student_id = ?", (ids[i],)).fetchone()
+                if row is not None:  # deleted since the matrix was loaded
+                    contents.append(row[0])
+                    found.append(metadata[i])
+            results.append((contents, found))
+        return results
+
+    def status(self) -> Dict[str, Any]:
+        conn = self._reader()
+        lag = self.lag()
+        return {
+            "lag_seconds": round(lag, 3) if lag is not None else None,
+            "fresh": self.is_fresh(),
+            "students": conn.execute("SELECT COUNT(*) FROM students").fetchone()[0],
+            "embeddings": conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0],
+        }
+
+    # --- sync ----------------------------------------------------------
+    def _writer(self) -> sqlite3.Connection:
+        conn = getattr(self, "_writer_conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._writer_conn = conn
+        return conn
+
+    @staticmethod
+    def _set_state(conn: sqlite3.Connection, name: str, value: float):
+        conn.execute(
+            "INSERT INTO sync_state (name, value) VALUES (?, ?) ON CONFLICT(name) DO UPDATE SET value = excluded.value",
+            (name, value),
+        )
+
+    @staticmethod
+    def _student_row(row: Dict[str, Any], seen: int) -> Tuple:
+        version = row.pop("version")
+        return (
+            row["student_id"],
+            row["name"],
+            json.dumps(row, separators=(",", ":")),
+            format_student_data_for_embedding(row),
+            version,
+            seen,
+        )
+
+    @staticmethod
+    def _embedding_row(row: Dict[str, Any], seen: int) -> Tuple:
+        metadata = row["metadata"]
+        if isinstance(metadata, str):
+            metadata = json.loads(metadata)
+        return (
+            row["student_id"],
+            row["content"],
+            json.dumps(metadata, separators=(",", ":")),
+            np.asarray(_parse_embedding(row["embedding"]), dtype=np.float32).tobytes(),
+            row["version"],
+            seen,
+        )
+
+    def _apply(self, conn: sqlite3.Connection, table: str, rows: List[Tuple], only_newer: bool):
+        """Upsert rows; deltas never overwrite a newer local version"""
+        columns = ("student_id", "name", "record", "context", "version", "seen") if table == "students" \
+            else ("student_id", "content", "metadata", "embedding", "version", "seen")
+        updates = ", ".join(f"{c} = excluded.{c}" for c in columns[1:])
+        condition = f" WHERE excluded.version > {table}.version" if only_newer else ""
+        conn.executemany(
+            f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT(student_id) DO UPDATE SET {updates}{condition}",
+            rows,
+        )
+
+    def _pull(self, conn: sqlite3.Connection, store, full: bool, index_version: Optional[int]) -> Dict[str, int]:
+        """Apply one round of changes (or a full copy) page by page; returns rows applied per table"""
+        applied = {}
+        in_version = (lambda query: query.eq("index_version", index_version)) if index_version is not None else None
+        seen = int(time.time()) if full else 0
+        # A full copy already reflects every delete made before it started
+        tombstones = store.max_version("replica_tombstones") if full else None
+        for upstream, local in TABLES.items():
+            columns = store.student_columns if upstream == "students" else "student_id,content,metadata,embedding"
+            to_row = self._student_row if upstream == "students" else self._embedding_row
+            where = in_version if upstream == "student_embeddings" else None
+            cursor_name = f"cursor:{upstream}"
+            if full:
+                # Changes made while the scan runs are picked up by the next delta
+                cursor = store.max_version(upstream)
+                rows = store._scan(upstream, f"{columns},version", f"replica_full_{upstream}", where)
+            else:
+                cursor = int(self._state(cursor_name, conn))
+                rows = store.iter_changes(upstream, columns, cursor, where=where)
+            count = 0
+            page: List[Tuple] = []
+            for row in rows:
+                if not full:
+                    cursor = max(cursor, row["version"])
+                page.append(to_row(row, seen))
+                if len(page) >= config.SCAN_PAGE_SIZE:
+                    self._commit_page(conn, local, page, not full, cursor_name, cursor if not full else None)
+                    count += len(page)
+                    page = []
+            self._commit_page(conn, local, page, not full, cursor_name, cursor)
+            count += len(page)
+            if full:
+                conn.execute(f"DELETE FROM {local} WHERE seen != ?", (seen,))
+            applied[upstream] = count
+        if full:
+            self._set_state(conn, "cursor:replica_tombstones", tombstones)
+        else:
+            applied["deleted"] = self._apply_tombstones(conn, store)
+        return applied
+
+    def _commit_page(self, conn: sqlite3.Connection, table: str, page: List[Tuple], only_newer: bool,
+                     cursor_name: str, cursor: Optional[int]):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if page:
+                self._apply(conn, table, page, only_newer)
+            if cursor is not None:
+                self._set_state(conn, cursor_name, cursor)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def _apply_tombstones(self, conn: sqlite3.Connection, store) -> int:
+        cursor = int(self._state("cursor:replica_tombstones", conn))
+        deleted = 0
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for row in store.iter_changes("replica_tombstones", "table_name,student_id", cursor):
+                local = TABLES.get(row["table_name"])
+                if local is not None:
+                    # Only rows written before the delete; a re-insert carries a newer version
+                    deleted += conn.execute(
+                        f"DELETE FROM {local} WHERE student_id = ? AND version < ?",
+                        (row["student_id"], row["version"]),
+                    ).rowcount
+                cursor = max(cursor, row["version"])
+            self._set_state(conn, "cursor:replica_tombstones", cursor)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return deleted
+
+    def sync(self, full: Optional[bool] = None) -> Dict[str, int]:
+        """One sync round (full when due or requested); marks the replica fresh on success"""
+        from src.supabase_vector_store import get_vector_store
+        store = get_vector_store()
+        conn = self._writer()
+        if full is None:
+            full = time.time() - self._state("full_synced_at", conn) > self.full_sync_interval
+        # Rows of a newly activated index version were written before our cursor moved past them
+        index_version = store.active_index_version(fresh=True)
+        if index_version is not None and index_version != self._state("index_version", conn):
+            full = True
+        started = time.time()
+        with span("replica.sync", full=full) as attrs:
+            applied = self._pull(conn, store, full, index_version)
+            attrs.update(applied)
+        conn.execute("BEGIN IMMEDIATE")
+        self._set_state(conn, "synced_at", started)
+        if full:
+            self._set_state(conn, "full_synced_at", started)
+        if index_version is not None:
+            self._set_state(conn, "index_version", index_version)
+        if full or applied.get("student_embeddings") or applied.get("deleted"):
+            self._set_state(conn, "embeddings_changed_at", started)
+        conn.execute("COMMIT")
+        if full or any(applied.values()):
+            logger.info("Replica synced", extra={"full": full, **applied, "seconds": round(time.time() - started, 3)})
+        return applied
+
+    def try_become_syncer(self) -> bool:
+        """Take the syncer lock without blocking; only one process per host syncs"""
+        if self._syncer_lock_file is not None:
+            return True
+        lock_file = open(f"{self.path}.lock", "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._syncer_lock_file = lock_file
+        return True
+
+    def start_syncer(self):
+        """Background thread: every worker competes for the lock, the winner syncs"""
+        def loop():
+            while True:
+                if self.try_become_syncer():
+                    try:
+                        self.sync()
+                    except Exception as e:
+                        # Keep serving from the replica; freshness runs out on its own
+                        logger.error("Replica sync failed", extra={"error": str(e), "lag_s": self.lag()})
+                time.sleep(self.sync_interval)
+        threading.Thread(target=loop, name="replica-syncer", daemon=True).start()
+
+
+# Singleton instance
+_replica = None
+_replica_lock = threading.Lock()
+
+def get_replica() -> Optional[Replica]:
+    """Replica handle, or None when REPLICA_PATH is not configured"""
+    global _replica
+    if _replica is None and config.REPLICA_PATH:
+        with _replica_lock:
+            if _replica is None:
+                _replica = Replica(
+                    config.REPLICA_PATH,
+                    config.REPLICA_MAX_STALENESS_SECONDS,
+                    config.REPLICA_SYNC_SECONDS,
+                    config.REPLICA_FULL_SYNC_SECONDS,
+                )
+    return _replica
+
+
+if __name__ == "__main__":
+    # Dedicated syncer process: python -m src.replica [--full] [--once]
+    import argparse
+    parser = argparse.ArgumentParser(description="Keep the local students replica in sync with Supabase")
+    parser.add_argument("--full", action="store_true", help="start with a full copy")
+    parser.add_argument("--once", action="store_true", help="sync once and exit")
+    args = parser.parse_args()
+    replica = get_replica()
+    if replica is None:
+        raise SystemExit("Set REPLICA_PATH to enable the replica")
+    if not replica.try_become_syncer():
+        raise SystemExit("Another process is already syncing this replica")
+    replica.sync(full=True if args.full else None)
+    while not args.once:
+        time.sleep(replica.sync_interval)
+        try:
+            replica.sync()
+        except Exception as e:
+            logger.error("Replica sync failed", extra={"error": str(e), "lag_s": replica.lag()})
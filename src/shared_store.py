@@ -0,0 +1,305 @@
+"""
+Read-mostly data shared by all uvicorn workers through memory-mapped files.
+
+One process (whichever worker wins a file lock, or a dedicated
+`python -m src.shared_store` loader) periodically snapshots the students
+table, their rendered prompt contexts and the embedding vectors into a new
+generation directory, then atomically flips the CURRENT pointer. Workers
+mmap the active generation, so the page cache holds one copy no matter how
+many workers run, and lookups only parse the single record they need.
+
+Generation layout:
+    keys.npy      sorted structured array (student_id, offsets/lengths)
+    records.bin   concatenated JSON student records
+    contexts.bin  concatenated rendered contexts (format_student_data_for_embedding)
+    vectors.npy   float32 (n, 384) embeddings, row order = embedding_ids.npy
+    embedding_ids.npy
+"""
+import fcntl
+import json
+import mmap
+import os
+import shutil
+import threading
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from src.config import config
+from src.metrics import record_cache
+from src.tracing import get_logger
+from src.utils import format_student_data_for_embedding
+
+logger = get_logger(__name__)
+
+KEY_WIDTH = 32
+EMBEDDING_DIM = 384
+KEY_DTYPE = np.dtype([
+    ("student_id", f"S{KEY_WIDTH}"),
+    ("record_offset", "<u8"),
+    ("record_length", "<u4"),
+    ("context_offset", "<u8"),
+    ("context_length", "<u4"),
+])
+POINTER_FILE = "CURRENT"
+KEEP_GENERATIONS = 2
+# Embedding rows held in memory at a time while writing a snapshot
+SNAPSHOT_CHUNK_ROWS = 4096
+
+
+def _parse_embedding(value) -> List[float]:
+    # pgvector columns come back from PostgREST as the string "[0.1,0.2,...]"
+    if isinstance(value, str):
+        return json.loads(value)
+    return value
+
+
+class SnapshotWriter:
+    """Builds a generation directory and publishes it atomically"""
+
+    def __init__(self, base_dir: str):
+        self.base_dir = base_dir
+        os.makedirs(base_dir, exist_ok=True)
+
+    def write(self, students: Iterable[Dict[str, Any]], embeddings: Iterable[Tuple[str, List[float]]]) -> str:
+        generation = f"gen-{time.time_ns()}"
+        tmp_dir = os.path.join(self.base_dir, f".{generation}.tmp")
+        os.makedirs(tmp_dir)
+
+        keys = []
+        with open(os.path.join(tmp_dir, "records.bin"), "wb") as records, \
+                open(os.path.join(tmp_dir, "contexts.bin"), "wb") as contexts:
+            for student in students:
+                student_id = str(student["student_id"]).encode("utf-8")
+                if len(student_id) > KEY_WIDTH:
+                    logger.warning("Student ID too long for shared store, skipping", extra={"student_id": student["student_id"]})
+                    continue
+                record = json.dumps(student, separators=(",", ":")).encode("utf-8")
+                context = format_student_data_for_embedding(student).encode("utf-8")
+                keys.append((student_id, records.tell(), len(record), contexts.tell(), len(context)))
+                records.write(record)
+                contexts.write(context)
+        key_array = np.array(keys, dtype=KEY_DTYPE)
+        key_array.sort(order="student_id")
+        np.save(os.path.join(tmp_dir, "keys.npy"), key_array)
+
+        # Embeddings stream to raw files a chunk at a time and are then copied
+        # into .npy files, so memory stays flat however large the roster is
+        count, dim = 0, EMBEDDING_DIM
+        ids_raw = os.path.join(tmp_dir, "embedding_ids.raw")
+        vectors_raw = os.path.join(tmp_dir, "vectors.raw")
+        with open(ids_raw, "wb") as id_file, open(vectors_raw, "wb") as vector_file:
+            ids, vectors = [], []
+            for student_id, embedding in embeddings:
+                ids.append(str(student_id))
+                vectors.append(_parse_embedding(embedding))
+                if len(ids) >= SNAPSHOT_CHUNK_ROWS:
+                    dim = self._write_chunk(id_file, vector_file, ids, vectors)
+                    count += len(ids)
+                    ids, vectors = [], []
+            if ids:
+                dim = self._write_chunk(id_file, vector_file, ids, vectors)
+                count += len(ids)
+        self._save_raw(ids_raw, os.path.join(tmp_dir, "embedding_ids.npy"), np.dtype(f"S{KEY_WIDTH}"), (count,))
+        self._save_raw(vectors_raw, os.path.join(tmp_dir, "vectors.npy"), np.dtype(np.float32), (count, dim))
+
+        final_dir = os.path.join(self.base_dir, generation)
+        os.rename(tmp_dir, final_dir)
+        self._publish(generation)
+        self._collect_garbage(generation)
+        logger.info("Published shared snapshot", extra={"generation": generation, "students": len(keys), "vectors": count})
+        return generation
+
+    @staticmethod
+    def _write_chunk(id_file, vector_file, ids: List[str], vectors: List[List[float]]) -> int:
+        """Append a chunk of ids and vectors to the raw files; returns the vector dimension"""
+        id_file.write(np.array(ids, dtype=f"S{KEY_WIDTH}").tobytes())
+        chunk = np.array(vectors, dtype=np.float32)
+        vector_file.write(chunk.tobytes())
+        return chunk.shape[1]
+
+    @staticmethod
+    def _save_raw(raw_path: str, path: str, dtype: np.dtype, shape: Tuple[int, ...]):
+        """Copy a raw file of rows into a .npy file through memory maps, a chunk at a time"""
+        if shape[0] == 0:
+            np.save(path, np.zeros(shape, dtype=dtype))
+        else:
+            source = np.memmap(raw_path, dtype=dtype, mode="r", shape=shape)
+            target = np.lib.format.open_memmap(path, mode="w+", dtype=dtype, shape=shape)
+            for start in range(0, shape[0], SNAPSHOT_CHUNK_ROWS):
+                target[start:start + SNAPSHOT_CHUNK_ROWS] = source[start:start + SNAPSHOT_CHUNK_ROWS]
+            target.flush()
+            del source, target
+        os.remove(raw_path)
+
+    def _publish(self, generation: str):
+        pointer_tmp = os.path.join(self.base_dir, f".{POINTER_FILE}.tmp")
+        with open(pointer_tmp, "w") as f:
+            f.write(generation)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(pointer_tmp, os.path.join(self.base_dir, POINTER_FILE))
+
+    def _collect_garbage(self, current: str):
+        # Readers may still have an older generation mapped; unlinking is safe
+        # for them (the mapping stays valid) but keep one spare for slow starters
+        generations = sorted(d for d in os.listdir(self.base_dir) if d.startswith("gen-"))
+        for old in generations[:-KEEP_GENERATIONS]:
+            if old != current:
+                shutil.rmtree(os.path.join(self.base_dir, old), ignore_errors=True)
+
+
+class Snapshot:
+    """One mapped generation (read-only, zero-copy)"""
+
+    def __init__(self, path: str, generation: str):
+        self.generation = generation
+        self.keys = np.load(os.path.join(path, "keys.npy"), mmap_mode="r")
+        self._records = self._map(os.path.join(path, "records.bin"))
+        self._contexts = self._map(os.path.join(path, "contexts.bin"))
+        self.embedding_ids = np.load(os.path.join(path, "embedding_ids.npy"), mmap_mode="r")
+        self.vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+
+    @staticmethod
+    def _map(path: str):
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b""
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _find(self, student_id: str):
+        key = student_id.encode("utf-8")
+        i = int(np.searchsorted(self.keys["student_id"], key))
+        if i < len(self.keys) and self.keys["student_id"][i] == key:
+            return self.keys[i]
+        return None
+
+    def get_record(self, student_id: str) -> Optional[Dict[str, Any]]:
+        entry = self._find(student_id)
+        if entry is None:
+            return None
+        start = int(entry["record_offset"])
+        return json.loads(self._records[start:start + int(entry["record_length"])])
+
+    def get_context(self, student_id: str) -> Optional[str]:
+        entry = self._find(student_id)
+        if entry is None:
+            return None
+        start = int(entry["context_offset"])
+        return self._contexts[start:start + int(entry["context_length"])].decode("utf-8")
+
+    def search(self, query_embedding: List[float], k: int = 2) -> List[Tuple[str, float]]:
+        """Cosine top-k over the mapped vectors (bge embeddings are normalized)"""
+        if len(self.vectors) == 0:
+            return []
+        scores = self.vectors @ np.asarray(query_embedding, dtype=np.float32)
+        k = min(k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.embedding_ids[i].decode("utf-8"), float(scores[i])) for i in top]
+
+
+class SharedStore:
+    """
+    Worker-side handle on the shared snapshot. Re-checks the CURRENT pointer
+    at most every `check_interval` seconds and remaps when it changes.
+    """
+
+    def __init__(self, base_dir: str, refresh_interval: float, check_interval: float = 1.0):
+        self.base_dir = base_dir
+        self.refresh_interval = refresh_interval
+        self.check_interval = check_interval
+        self._snapshot: Optional[Snapshot] = None
+        self._last_check = 0.0
+        self._lock = threading.Lock()
+        self._loader_lock_file = None
+        os.makedirs(base_dir, exist_ok=True)
+
+    def snapshot(self) -> Optional[Snapshot]:
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval:
+            return self._snapshot
+        with self._lock:
+            if now - self._last_check < self.check_interval:
+                return self._snapshot
+            self._last_check = now
+            try:
+                with open(os.path.join(self.base_dir, POINTER_FILE)) as f:
+                    generation = f.read().strip()
+            except FileNotFoundError:
+                return self._snapshot
+            if self._snapshot is None or self._snapshot.generation != generation:
+                try:
+                    self._snapshot = Snapshot(os.path.join(self.base_dir, generation), generation)
+                    logger.info("Mapped shared snapshot", extra={"generation": generation})
+                except (FileNotFoundError, ValueError) as e:
+                    logger.warning("Could not map shared snapshot", extra={"generation": generation, "error": str(e)})
+            return self._snapshot
+
+    def get_record(self, student_id: str) -> Optional[Dict[str, Any]]:
+        snapshot = self.snapshot()
+        record = snapshot.get_record(student_id) if snapshot else None
+        record_cache("shared_students", record is not None)
+        return record
+
+    def get_context(self, student_id: str) -> Optional[str]:
+        snapshot = self.snapshot()
+        context = snapshot.get_context(student_id) if snapshot else None
+        record_cache("shared_contexts", context is not None)
+        return context
+
+    # --- loader --------------------------------------------------------
+    def try_become_loader(self) -> bool:
+        """Take the loader lock without blocking; only one process refreshes"""
+        if self._loader_lock_file is not None:
+            return True
+        lock_file = open(os.path.join(self.base_dir, "loader.lock"), "w")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            return False
+        self._loader_lock_file = lock_file
+        return True
+
+    def refresh(self):
+        """Snapshot Supabase into a new generation"""
+        from src.supabase_vector_store import get_vector_store
+        store = get_vector_store()
+        SnapshotWriter(self.base_dir).write(
+            store.iter_students(),
+            ((row["student_id"], row["embedding"]) for row in store.iter_embeddings()),
+        )
+
+    def start_loader(self):
+        """Background thread: every worker competes for the lock, the winner refreshes"""
+        def loop():
+            while True:
+                if self.try_become_loader():
+                    try:
+                        self.refresh()
+                    except Exception as e:
+                        logger.error("Shared snapshot refresh failed", extra={"error": str(e)})
+                time.sleep(self.refresh_interval)
+        threading.Thread(target=loop, name="shared-store-loader", daemon=True).start()
+
+
+# Singleton instance
+_shared_store = None
+
+def get_shared_store() -> Optional[SharedStore]:
+    """Shared store handle, or None when SHARED_DATA_DIR is not configured"""
+    global _shared_store
+    if _shared_store is None and config.SHARED_DATA_DIR:
+        _shared_store = SharedStore(config.SHARED_DATA_DIR, config.SHARED_DATA_REFRESH_SECONDS)
+    return _shared_store
+
+
+if __name__ == "__main__":
+    # Dedicated loader process: python -m src.shared_store
+    store = get_shared_store()
+    if store is None:
+        raise SystemExit("Set SHARED_DATA_DIR to enable the shared store")
+    while True:
+        if store.try_become_loader():
+            store.refresh()
+        time.sleep(store.refresh_interval)
\ No newline at end of file
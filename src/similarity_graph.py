@@ -0,0 +1,345 @@
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+import numpy as np
+from src.config import config
+from src.tracing import get_logger, span
+
+logger = get_logger(__name__)
+
+# Embeddings converted to float16 at a time during a full build
+BUILD_CHUNK_ROWS = 1024
+
+
+def _block_rows(columns: int) -> int:
+    """Rows per block so a float32 (rows x columns) score block stays within SIMILARITY_GRAPH_BLOCK_MB"""
+    return max(1, int(config.SIMILARITY_GRAPH_BLOCK_MB * 2**20) // (4 * max(1, columns)))
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    vectors = np.asarray(vectors, dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True).clip(min=1e-12)
+
+
+def _top_k(scores: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """Row-wise top-k (indices, scores) sorted by descending score"""
+    k = min(k, scores.shape[1])
+    if k == 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int32), np.empty((scores.shape[0], 0), dtype=np.float32)
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    top = np.take_along_axis(scores, idx, axis=1)
+    order = np.argsort(-top, axis=1)
+    return np.take_along_axis(idx, order, axis=1).astype(np.int32), np.take_along_axis(top, order, axis=1)
+
+
+class SimilarityGraph:
+    """
+    Precomputed k-nearest-neighbour graph over student embeddings (cosine).
+
+    Stored compactly as int32 neighbour indices and float16 scores, with the
+    vectors kept in float16 so changed students can be re-linked without
+    re-fetching every embedding. Lookups are a dict hit plus a row slice.
+    """
+
+    def __init__(self, ids: np.ndarray, names: np.ndarray, vectors: np.ndarray,
+                 neighbors: np.ndarray, scores: np.ndarray):
+        self.ids = ids
+        self.names = names
+        self.vectors = vectors
+        self.neighbors = neighbors
+        self.scores = scores
+        self.row_of: Dict[str, int] = {student_id: i for i, student_id in enumerate(ids.tolist())}
+
+    @property
+    def k(self) -> int:
+        return self.neighbors.shape[1]
+
+    # --- building ------------------------------------------------------
+    @classmethod
+    def build(cls, students: Iterable[Tuple[str, str, List[float]]], k: int) -> "SimilarityGraph":
+        """
+        Full build from (student_id, name, embedding) triples
+        Vectors are normalized and stored as float16 a chunk at a time, so a
+        streamed input never sits in memory as Python lists or float32.
+        """
+        ids, names, chunks, chunk = [], [], [], []
+        for student_id, name, embedding in students:
+            ids.append(student_id)
+            names.append(name)
+            chunk.append(embedding)
+            if len(chunk) >= BUILD_CHUNK_ROWS:
+                chunks.append(_normalize(np.array(chunk, dtype=np.float32)).astype(np.float16))
+                chunk = []
+        if chunk or not chunks:
+            chunks.append(_normalize(np.array(chunk, dtype=np.float32).reshape(len(chunk), -1)).astype(np.float16))
+        matrix = np.concatenate(chunks)
+        del chunks
+        with span("similarity_graph.build", students=len(ids), k=k):
+            neighbors, scores = cls._search(matrix, matrix, k, exclude_self=True)
+        return cls(
+            np.array(ids, dtype=object),
+            np.array(names, dtype=object),
+            matrix,
+            neighbors,
+            scores.astype(np.float16),
+        )
+
+    @staticmethod
+    def _search(queries: np.ndarray, corpus: np.ndarray, k: int, exclude_self: bool = False,
+                query_rows: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact inner-product top-k of queries against corpus, in blocks to bound memory"""
+        neighbors = np.empty((len(queries), min(k, max(0, len(corpus) - exclude_self))), dtype=np.int32)
+        scores = np.empty(neighbors.shape, dtype=np.float32)
+        if neighbors.shape[1] == 0:
+            return neighbors, scores
+        corpus = corpus.astype(np.float32, copy=False)
+        step = _block_rows(len(corpus))
+        for start in range(0, len(queries), step):
+            block = queries[start:start + step].astype(np.float32) @ corpus.T
+            if exclude_self:
+                rows = np.arange(start, start + len(block)) if query_rows is None else query_rows[start:start + len(block)]
+                block[np.arange(len(block)), rows] = -np.inf
+            neighbors[start:start + len(block)], scores[start:start + len(block)] = _top_k(block, neighbors.shape[1])
+        return neighbors, scores
+
+    def update(self, changed: Iterable[Tuple[str, str, List[float]]], removed: Iterable[str] = ()) -> int:
+        """
+        Re-link only what a roster change can affect:
+        - changed/new students get a fresh neighbour list
+        - students that had a changed or removed student as a neighbour are recomputed
+        - everyone else only checks whether a changed student now beats their k-th neighbour
+        Returns the number of rows fully recomputed.
+        """
+        changed = list(changed)
+        removed = set(removed)
+        k = max(self.k, config.SIMILARITY_GRAPH_K)
+        if not changed and not removed:
+            return 0
+
+        # Drop removed rows and remap neighbour indices
+        keep = np.array([student_id not in removed for student_id in self.ids.tolist()], dtype=bool)
+        remap = np.full(len(self.ids), -1, dtype=np.int64)
+        remap[keep] = np.arange(int(keep.sum()))
+        ids, names, vectors = self.ids[keep], self.names[keep], self.vectors[keep]
+        neighbors = remap[self.neighbors[keep]] if len(self.neighbors) else self.neighbors[keep].astype(np.int64)
+        scores = self.scores[keep].astype(np.float32)
+        dirty = np.zeros(len(ids), dtype=bool)
+        dirty |= (neighbors < 0).any(axis=1)
+
+        # Apply changed vectors (append new students)
+        row_of = {student_id: i for i, student_id in enumerate(ids.tolist())}
+        changed_rows = []
+        new_ids, new_names, new_vectors = [], [], []
+        for student_id, name, embedding in changed:
+            vector = _normalize(np.array([embedding], dtype=np.float32))[0].astype(np.float16)
+            if student_id in row_of:
+                row = row_of[student_id]
+                vectors[row] = vector
+                names[row] = name
+                changed_rows.append(row)
+            else:
+                new_ids.append(student_id)
+                new_names.append(name)
+                new_vectors.append(vector)
+        if new_ids:
+            first_new = len(ids)
+            ids = np.concatenate([ids, np.array(new_ids, dtype=object)])
+            names = np.concatenate([names, np.array(new_names, dtype=object)])
+            vectors = np.concatenate([vectors, np.array(new_vectors, dtype=np.float16)])
+            neighbors = np.concatenate([neighbors, np.full((len(new_ids), neighbors.shape[1]), -1)])
+            scores = np.concatenate([scores, np.full((len(new_ids), scores.shape[1]), -np.inf, dtype=np.float32)])
+            changed_rows.extend(range(first_new, len(ids)))
+            dirty = np.concatenate([dirty, np.zeros(len(new_ids), dtype=bool)])
+        changed_rows = np.array(sorted(set(changed_rows)), dtype=np.int64)
+
+        # Rows pointing at a changed student: their stored score is stale
+        if len(changed_rows):
+            dirty |= np.isin(neighbors, changed_rows).any(axis=1)
+            dirty[changed_rows] = True
+
+        # Neighbour lists hold min(k, n - 1) entries; adjust to the new roster size
+        width = max(0, min(k, len(ids) - 1))
+        if width < neighbors.shape[1]:
+            neighbors, scores = neighbors[:, :width], scores[:, :width]
+        elif width > neighbors.shape[1]:
+            pad = width - neighbors.shape[1]
+            neighbors = np.hstack([neighbors, np.full((len(ids), pad), -1)])
+            scores = np.hstack([scores, np.full((len(ids), pad), -np.inf, dtype=np.float32)])
+            dirty[:] = True
+
+        # Everyone else: does a changed student now enter their top-k?
+        if len(changed_rows) and not dirty.all():
+            changed_vectors = vectors[changed_rows].astype(np.float32)
+            kth = scores[:, -1] if scores.shape[1] else np.full(len(ids), -np.inf)
+            clean = np.where(~dirty)[0]  # changed rows are dirty, so never their own candidate
+            step = _block_rows(len(changed_rows))
+            for start in range(0, len(clean), step):
+                rows = clean[start:start + step]
+                cand = vectors[rows].astype(np.float32) @ changed_vectors.T  # (block, c)
+                hits = (cand > kth[rows, None]).any(axis=1)
+                for row, row_cand in zip(rows[hits], cand[hits]):
+                    merged_idx = np.concatenate([neighbors[row], changed_rows])
+                    merged_score = np.concatenate([scores[row], row_cand])
+                    merged_idx, unique = np.unique(merged_idx, return_index=True)
+                    merged_score = merged_score[unique]
+                    order = np.argsort(-merged_score)[:width]
+                    neighbors[row, :len(order)] = merged_idx[order]
+                    scores[row, :len(order)] = merged_score[order]
+
+        recompute = np.where(dirty)[0]
+        if len(recompute):
+            with span("similarity_graph.update", recomputed=len(recompute)):
+                neighbors[recompute], scores[recompute] = self._search(
+                    vectors[recompute], vectors, width, exclude_self=True, query_rows=recompute
+                )
+
+        self.ids, self.names, self.vectors = ids, names, vectors
+        self.neighbors = neighbors.astype(np.int32)
+        self.scores = scores.astype(np.float16)
+        self.row_of = {student_id: i for i, student_id in enumerate(ids.tolist())}
+        return len(recompute)
+
+    # --- lookup --------------------------------------------------------
+    def similar(self, student_id: str, k: Optional[int] = None) -> Optional[List[Dict[str, object]]]:
+        """Neighbours of a student, most similar first (None if unknown)"""
+        row = self.row_of.get(student_id)
+        if row is None:
+            return None
+        count = self.k if k is None else min(k, self.k)
+        return [
+            {
+                "student_id": self.ids[j],
+                "name": self.names[j],
+                "similarity": round(float(score), 4),
+            }
+            for j, score in zip(self.neighbors[row, :count].tolist(), self.scores[row, :count].tolist())
+        ]
+
+    # --- persistence ---------------------------------------------------
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = path + ".tmp.npz"
+        np.savez(
+            tmp_path,
+            ids=self.ids.astype(str),
+            names=self.names.astype(str),
+            vectors=self.vectors,
+            neighbors=self.neighbors,
+            scores=self.scores,
+        )
+        os.replace(tmp_path, path)
+        logger.info("Similarity graph saved", extra={"path": path, "students": len(self.ids), "k": self.k})
+
+    @classmethod
+    def load(cls, path: str) -> "SimilarityGraph":
+        data = np.load(path)
+        return cls(
+            data["ids"].astype(object),
+            data["names"].astype(object),
+            data["vectors"],
+            data["neighbors"],
+            data["scores"],
+        )
+
+
+# --- shared storage ----------------------------------------------------
+# The indexer usually runs on another machine than the API, so with
+# SIMILARITY_GRAPH_BUCKET set the file is also published to Supabase Storage
+# and API workers download it when it changes there.
+_remote_lock = threading.Lock()
+_remote_checked = 0.0
+_remote_updated_at = None
+
+def _bucket():
+    from src.supabase_vector_store import get_vector_store
+    return get_vector_store().supabase.storage.from_(config.SIMILARITY_GRAPH_BUCKET)
+
+
+def _object_name() -> str:
+    return os.path.basename(config.SIMILARITY_GRAPH_PATH)
+
+
+def publish_similarity_graph():
+    """Upload the local graph file to SIMILARITY_GRAPH_BUCKET (no-op without a bucket)"""
+    if not config.SIMILARITY_GRAPH_BUCKET:
+        return
+    with span("upstream.supabase", op="upload_similarity_graph"), open(config.SIMILARITY_GRAPH_PATH, "rb") as f:
+        _bucket().upload(_object_name(), f, {"upsert": "true", "content-type": "application/octet-stream"})
+    logger.info("Similarity graph published", extra={"bucket": config.SIMILARITY_GRAPH_BUCKET})
+
+
+def fetch_similarity_graph(force: bool = False):
+    """Download the graph from SIMILARITY_GRAPH_BUCKET if it changed there (checked at most every SIMILARITY_GRAPH_CHECK_SECONDS)"""
+    global _remote_checked, _remote_updated_at
+    if not config.SIMILARITY_GRAPH_BUCKET:
+        return
+    if not force and time.monotonic() - _remote_checked < config.SIMILARITY_GRAPH_CHECK_SECONDS:
+        return
+    # One check at a time; other requests keep serving the graph they have
+    if not _remote_lock.acquire(blocking=force):
+        return
+    try:
+        _remote_checked = time.monotonic()
+        bucket, name, path = _bucket(), _object_name(), config.SIMILARITY_GRAPH_PATH
+        try:
+            with span("upstream.supabase", op="check_similarity_graph"):
+                entry = next((o for o in bucket.list("", {"search": name}) if o.get("name") == name), None)
+            if entry is None or (entry.get("updated_at") == _remote_updated_at and os.path.exists(path)):
+                return
+            with span("upstream.supabase", op="download_similarity_graph"):
+                data = bucket.download(name)
+        except Exception as e:
+            logger.warning("Similarity graph check failed", extra={"error": str(e)})
+            return
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.download"
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        _remote_updated_at = entry.get("updated_at")
+        logger.info("Similarity graph downloaded", extra={"bytes": len(data), "updated_at": _remote_updated_at})
+    finally:
+        _remote_lock.release()
+
+
+def build_similarity_graph(students: Iterable[Tuple[str, str, List[float]]]) -> SimilarityGraph:
+    """Build and persist the graph (called when the vector index is rebuilt)"""
+    graph = SimilarityGraph.build(students, config.SIMILARITY_GRAPH_K)
+    graph.save(config.SIMILARITY_GRAPH_PATH)
+    publish_similarity_graph()
+    return graph
+
+
+def update_similarity_graph(changed: Iterable[Tuple[str, str, List[float]]], removed: Iterable[str] = ()) -> Optional[SimilarityGraph]:
+    """Incrementally re-link changed students in the persisted graph (once per ingest run: it rewrites the file)"""
+    fetch_similarity_graph(force=True)
+    if not os.path.exists(config.SIMILARITY_GRAPH_PATH):
+        return None
+    graph = SimilarityGraph.load(config.SIMILARITY_GRAPH_PATH)
+    recomputed = graph.update(changed, removed)
+    graph.save(config.SIMILARITY_GRAPH_PATH)
+    publish_similarity_graph()
+    logger.info("Similarity graph updated", extra={"recomputed_rows": recomputed})
+    return graph
+
+
+# Singleton instance, reloaded when the indexer writes a new file
+_graph = None
+_graph_mtime = None
+_graph_lock = threading.Lock()
+
+def get_similarity_graph() -> Optional[SimilarityGraph]:
+    """Get the persisted similarity graph (None until an index build creates it)"""
+    global _graph, _graph_mtime
+    fetch_similarity_graph()
+    try:
+        mtime = os.stat(config.SIMILARITY_GRAPH_PATH).st_mtime
+    except FileNotFoundError:
+        return None
+    if mtime != _graph_mtime:
+        with _graph_lock:
+            if mtime != _graph_mtime:
+                _graph = SimilarityGraph.load(config.SIMILARITY_GRAPH_PATH)
+                _graph_mtime = mtime
+    return _graph
\ No newline at end of file
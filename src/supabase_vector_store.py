@@ -1,92 +1,468 @@
+import json
+import random
 import time
-from typing import List, Tuple, Dict, Any, Optional
-from supabase import create_client, Client
+import numpy as np
+from datetime import datetime
+from typing import Callable, Iterable, Iterator, List, Tuple, Dict, Any, Optional, TYPE_CHECKING
 from src.config import config
 from src.embeddings import get_embedding_model
-from src.utils import load_student_data, format_student_data_for_embedding
+from src.utils import load_student_data, format_student_data_for_embedding, calculate_average_marks, categorize_performance, matches_filters
+from src.models import SearchFilters
+from src.metrics import record_cache
+from src.tracing import get_logger, span
+from src.shared_store import get_shared_store
+from src.similarity_graph import build_similarity_graph
+from src.partitioned_store import get_partitioned_index
+from src.replica import Replica, get_replica
+
+if TYPE_CHECKING:
+    from supabase import Client
+
+logger = get_logger(__name__)
+
+# PostgREST errors for a table that doesn't exist (sql/index_versions.sql not applied)
+MISSING_TABLE_CODES = ("42P01", "PGRST205")
+
+
+class IndexValidationError(Exception):
+    """A newly built index version failed validation and was not activated"""
+
 
 class SupabaseVectorStore:
     def __init__(self):
         """Initialize Supabase client with pgvector"""
-        self.supabase: Client = create_client(
-            config.SUPABASE_URL,
-            config.SUPABASE_KEY
-        )
-        self.embedding_model = get_embedding_model()
+        config.require("supabase")
+        self._supabase: Optional["Client"] = None
+        self._embedding_model = None
         self.table_name = "student_embeddings"
-        print(f"✅ Connected to Supabase: {config.SUPABASE_URL[:30]}...")
+        self._context_rpc = config.STUDENT_CONTEXT_RPC
+        self._partitions_rpc = True
+        # (expires at, active index version); versioning off until the migration is applied
+        self._index_version: Optional[Tuple[float, int]] = None
+        self._versioned_index = True
+    
+    @property
+    def supabase(self) -> "Client":
+        """Supabase client, imported and created on first use to keep startup fast"""
+        if self._supabase is None:
+            from supabase import create_client
+            self._supabase = create_client(config.SUPABASE_URL, config.SUPABASE_KEY)
+            logger.info("Connected to Supabase", extra={"url": config.SUPABASE_URL[:30]})
+        return self._supabase
+    
+    @property
+    def embedding_model(self):
+        """Embedding model, only needed for indexing and search"""
+        if self._embedding_model is None:
+            self._embedding_model = get_embedding_model()
+        return self._embedding_model
+    
+    def ping(self):
+        """Cheap query that opens the connection to Supabase"""
+        with span("upstream.supabase", op="ping"):
+            self.supabase.table("students").select("student_id").limit(1).execute()
         
-    def create_index(self):
+    @property
+    def student_columns(self) -> str:
+        """Projected students columns (STUDENT_COLUMNS plus the partition key)"""
+        columns = [c.strip() for c in config.STUDENT_COLUMNS.split(",") if c.strip()]
+        if config.PARTITION_KEY not in columns:
+            columns.append(config.PARTITION_KEY)
+        return ",".join(columns)
+    
+    def create_index(self, activate: bool = True) -> Optional[int]:
         """
-        Generate embeddings for all students in Supabase students table
-        and store them in student_embeddings table
+        Build a new index version next to the active one (blue/green)
+        Searches keep reading the active version while every student is
+        embedded into the new one; it is then caught up with students changed
+        meanwhile, validated (a row per student, sample recall) and activated
+        in one transaction. Students are streamed page by page and only a count
+        and a sample of ids are kept, so memory stays bounded on large rosters;
+        the similarity graph is built from a second scan of the new version.
+        Returns the new version (None without students).
         """
-        print("📊 Fetching students from Supabase...")
+        if self.active_index_version(fresh=True) is None:
+            raise RuntimeError("Blue/green index builds need sql/index_versions.sql applied in Supabase")
+        self.collect_index_garbage()
         
-        # Get all students from students table
-        result = self.supabase.table("students").select("*").execute()
+        version = self._begin_index_version()
+        logger.info("Building index version", extra={"version": version})
+        try:
+            cursors = self._change_cursors()
+            expected = 0
+            # Reservoir sample of student ids for the recall check
+            sample_ids: List[str] = []
+            page: List[Dict[str, Any]] = []
+            for student in self.iter_students():
+                expected += 1
+                if len(sample_ids) < config.INDEX_VALIDATE_SAMPLE:
+                    sample_ids.append(student["student_id"])
+                else:
+                    slot = random.randrange(expected)
+                    if slot < config.INDEX_VALIDATE_SAMPLE:
+                        sample_ids[slot] = student["student_id"]
+                page.append(student)
+                if len(page) >= config.SCAN_PAGE_SIZE:
+                    self.embed_students(page, version=version)
+                    logger.info("Embedded students", extra={"version": version, "count": expected})
+                    page = []
+            self.embed_students(page, version=version)
+            
+            if not expected:
+                logger.warning("No students found in database")
+                self._set_index_status(version, "failed")
+                return None
+            logger.info("Found students", extra={"count": expected})
+            
+            cursors, delta = self._catch_up(version, cursors)
+            self.validate_index_version(version, expected + delta, sample_ids)
+        except BaseException:
+            self._set_index_status(version, "failed")
+            raise
         
-        if not result.data:
-            print("⚠️  No students found in database!")
-            return
+        if not activate:
+            logger.info("Index version validated, not activated", extra={"version": version})
+            return version
+        self.activate_index_version(version)
+        # Students changed by an ingest while we validated went to the old version
+        self._catch_up(version, cursors)
         
-        students = result.data
-        print(f"✅ Found {len(students)} students")
+        logger.info("Building similarity graph")
+        build_similarity_graph(self.iter_index_vectors(version))
         
-        # Clear existing embeddings (optional - remove if you want to keep old data)
-        print("🗑️  Clearing old embeddings...")
-        self.supabase.table(self.table_name).delete().neq('id', 0).execute()
+        logger.info("Index creation complete", extra={"version": version})
+        return version
+    
+    def active_index_version(self, fresh: bool = False) -> Optional[int]:
+        """
+        Index version searches and scans read (sql/index_versions.sql), cached
+        for INDEX_VERSION_CHECK_SECONDS; None until the migration is applied
+        """
+        if not self._versioned_index:
+            return None
+        cached = self._index_version
+        if cached is not None and not fresh and time.monotonic() < cached[0]:
+            return cached[1]
+        try:
+            with span("upstream.supabase", op="active_index_version"):
+                result = self.supabase.table("index_versions").select("version").eq("status", "active").limit(1).execute()
+        except Exception as e:
+            if getattr(e, "code", None) not in MISSING_TABLE_CODES:
+                raise
+            logger.warning("index_versions table not found, reading unversioned embeddings", extra={"error": str(e)})
+            self._versioned_index = False
+            return None
+        version = result.data[0]["version"] if result.data else 0
+        self._index_version = (time.monotonic() + config.INDEX_VERSION_CHECK_SECONDS, version)
+        return version
+    
+    def _version_filter(self, version: Optional[int] = None):
+        """_scan `where` limiting student_embeddings to one index version (default: the active one)"""
+        version = self.active_index_version() if version is None else version
+        if version is None:
+            return None
+        return lambda query: query.eq("index_version", version)
+    
+    def _begin_index_version(self) -> int:
+        version = int(time.time())
+        with span("upstream.supabase", op="begin_index_version"):
+            self.supabase.table("index_versions").insert({"version": version, "status": "building"}).execute()
+        return version
+    
+    def _set_index_status(self, version: int, status: str, **fields):
+        with span("upstream.supabase", op="set_index_status", status=status):
+            self.supabase.table("index_versions").update({"status": status, **fields}).eq("version", version).execute()
+    
+    def _change_cursors(self) -> Optional[Tuple[int, int]]:
+        """Replication versions of students/tombstones before a build starts reading"""
+        try:
+            return self.max_version("students"), self.max_version("replica_tombstones")
+        except Exception as e:
+            logger.warning("Replication versions unavailable; students changed during the build are not caught up",
+                           extra={"error": str(e)})
+            return None
+    
+    def _catch_up(
+        self,
+        version: int,
+        cursors: Optional[Tuple[int, int]]
+    ) -> Tuple[Optional[Tuple[int, int]], int]:
+        """
+        Apply students added, changed or removed since `cursors` to an index
+        version (sql/replica_sync.sql); returns the cursors to continue from
+        and the change in the version's row count
+        """
+        if cursors is None:
+            return None, 0
+        students_cursor, tombstones_cursor = cursors
+        changed = []
+        for row in self.iter_changes("students", self.student_columns, students_cursor):
+            students_cursor = max(students_cursor, row.pop("version"))
+            changed.append(row)
+        removed = set()
+        for row in self.iter_changes("replica_tombstones", "table_name,student_id", tombstones_cursor):
+            tombstones_cursor = max(tombstones_cursor, row["version"])
+            if row["table_name"] == "students":
+                removed.add(row["student_id"])
+        # Deleted and added again: the current row wins
+        removed -= {student["student_id"] for student in changed}
         
-        print("🔄 Generating embeddings...")
-        for i, student in enumerate(students):
-            print(f"Processing {i+1}/{len(students)}: {student['name']}")
-            
-            # Format student data for embedding
-            content = format_student_data_for_embedding(student)
-            
-            # Generate embedding
-            embedding = self.embedding_model.embed_text(content)
-            
-            # Prepare data for insertion
-            data = {
-                "student_id": student["student_id"],
-                "student_name": student["name"],
-                "content": content,
-                "embedding": embedding,
-                "metadata": student  # Store full student data as JSON
-            }
-            
-            # Insert into Supabase
-            insert_result = self.supabase.table(self.table_name).insert(data).execute()
-            
-            if not insert_result.data:
-                print(f"❌ Failed to insert {student['student_id']}")
-            else:
-                print(f"✅ Embedded {student['student_id']}")
-            
-            # Rate limiting - wait 1 second between API calls
-            time.sleep(1)
+        delta = 0
+        if removed:
+            delta -= self._count_in_version(version, removed)
+            with span("upstream.supabase", op="delete_embeddings", rows=len(removed)):
+                self.supabase.table(self.table_name).delete()\
+                    .eq("index_version", version).in_("student_id", sorted(removed)).execute()
+        if changed:
+            delta += len(changed) - self._count_in_version(version, {student["student_id"] for student in changed})
+            self.embed_students(changed, version=version)
+        if changed or removed:
+            logger.info("Caught up index version", extra={"version": version, "changed": len(changed), "removed": len(removed)})
+        return (students_cursor, tombstones_cursor), delta
+    
+    def _count_in_version(self, version: int, student_ids: Iterable[str], chunk_size: int = 200) -> int:
+        """How many of these students already have a row in an index version"""
+        student_ids = sorted(student_ids)
+        count = 0
+        for start in range(0, len(student_ids), chunk_size):
+            with span("upstream.supabase", op="count_embeddings"):
+                result = self.supabase.table(self.table_name)\
+                    .select("student_id", count="exact")\
+                    .eq("index_version", version)\
+                    .in_("student_id", student_ids[start:start + chunk_size])\
+                    .limit(1)\
+                    .execute()
+            count += result.count or 0
+        return count
+    
+    def validate_index_version(self, version: int, expected: int, sample_ids: List[str]) -> Dict[str, Any]:
+        """
+        Check a built version before it goes live: exactly `expected` rows (one
+        per student), and at least INDEX_MIN_RECALL of the sampled students
+        found in their own top INDEX_VALIDATE_TOP_K through the version's
+        search, using their vectors as re-read from the version.
+        Raises IndexValidationError (the version is marked failed) otherwise.
+        """
+        with span("upstream.supabase", op="count_embeddings"):
+            result = self.supabase.table(self.table_name)\
+                .select("student_id", count="exact")\
+                .eq("index_version", version)\
+                .limit(1)\
+                .execute()
+        rows = result.count
+        sample = self._read_vectors(version, sample_ids)
+        # A sampled student whose row is missing counts as a miss
+        recall = self._sample_recall(version, sample) * len(sample) / len(sample_ids) if sample_ids else 1.0
+        report = {"version": version, "rows": rows, "expected_rows": expected, "recall": round(recall, 3)}
         
-        print("✅ Index creation complete!")
+        if rows != expected or recall < config.INDEX_MIN_RECALL:
+            self._set_index_status(version, "failed", rows=rows, recall=recall)
+            logger.error("Index version failed validation", extra=report)
+            raise IndexValidationError(
+                f"index version {version}: {rows} rows for {expected} students, "
+                f"recall@{config.INDEX_VALIDATE_TOP_K} {recall:.2f} (minimum {config.INDEX_MIN_RECALL})"
+            )
+        self._set_index_status(version, "validated", rows=rows, recall=recall)
+        logger.info("Index version validated", extra=report)
+        return report
+    
+    def _sample_recall(self, version: int, sample: List[Tuple[str, str, np.ndarray]]) -> float:
+        """Share of sampled students whose own vector finds them in the version's top-k"""
+        if not sample:
+            return 1.0
+        params = {
+            'query_embeddings': [vector.tolist() for _, _, vector in sample],
+            'match_count': config.INDEX_VALIDATE_TOP_K,
+            **SearchFilters().to_rpc_params(),
+            'filter_index_version': version
+        }
+        with span("upstream.supabase", op="match_student_embeddings_batch", queries=len(sample)):
+            result = self.supabase.rpc('match_student_embeddings_batch', params).execute()
+        found = {(item['query_index'], item['student_id']) for item in result.data or []}
+        hits = sum((i, student_id) in found for i, (student_id, _, _) in enumerate(sample))
+        return hits / len(sample)
+    
+    def _read_vectors(self, version: int, student_ids: List[str], chunk_size: int = 200) -> List[Tuple[str, str, np.ndarray]]:
+        """(student_id, name, vector) of these students as stored in an index version"""
+        vectors = []
+        for start in range(0, len(student_ids), chunk_size):
+            with span("upstream.supabase", op="read_embeddings"):
+                result = self.supabase.table(self.table_name)\
+                    .select("student_id,student_name,embedding")\
+                    .eq("index_version", version)\
+                    .in_("student_id", student_ids[start:start + chunk_size])\
+                    .execute()
+            vectors.extend(_vector_entry(row) for row in result.data or [])
+        return vectors
     
-    def search(self, query: str, k: int = 2) -> Tuple[List[str], List[Dict[str, Any]]]:
+    def activate_index_version(self, version: int):
+        """Switch searches to a validated version (or back to a retired one) in one transaction"""
+        with span("upstream.supabase", op="activate_index_version"):
+            self.supabase.rpc('activate_index_version', {'p_version': version}).execute()
+        self._index_version = None
+        partitioned = get_partitioned_index()
+        if partitioned is not None:
+            partitioned.invalidate()
+        logger.info("Index version activated", extra={"version": version})
+    
+    def list_index_versions(self) -> List[Dict[str, Any]]:
+        """Every index version with its status and validation results, newest first"""
+        with span("upstream.supabase", op="list_index_versions"):
+            result = self.supabase.table("index_versions")\
+                .select("version,status,rows,recall,created_at,activated_at,retired_at")\
+                .order("version", desc=True)\
+                .execute()
+        return result.data or []
+    
+    def collect_index_garbage(self, keep: Optional[int] = None, grace: Optional[float] = None) -> List[int]:
+        """
+        Delete the rows of failed builds, and of retired versions once they
+        have been retired for `grace` seconds (INDEX_GC_GRACE_SECONDS), except
+        the newest `keep` (INDEX_KEEP_VERSIONS). Returns the versions deleted.
+        """
+        from postgrest.types import ReturnMethod
+        keep = config.INDEX_KEEP_VERSIONS if keep is None else keep
+        grace = config.INDEX_GC_GRACE_SECONDS if grace is None else grace
+        versions = self.list_index_versions()
+        retired = sorted(
+            (v for v in versions if v["status"] == "retired"),
+            key=lambda v: _timestamp(v["retired_at"]),
+            reverse=True,
+        )
+        garbage = [v["version"] for v in versions if v["status"] == "failed"]
+        garbage += [v["version"] for v in retired[keep:] if time.time() - _timestamp(v["retired_at"]) >= grace]
+        for version in garbage:
+            with span("upstream.supabase", op="delete_index_version", version=version):
+                self.supabase.table(self.table_name)\
+                    .delete(returning=ReturnMethod.minimal)\
+                    .eq("index_version", version)\
+                    .execute()
+                self.supabase.table("index_versions").delete().eq("version", version).execute()
+            logger.info("Deleted index version", extra={"version": version})
+        return garbage
+    
+    @staticmethod
+    def _embedding_row(student: Dict[str, Any], content: str, embedding: List[float]) -> Dict[str, Any]:
+        """student_embeddings row for a student"""
+        avg_marks = calculate_average_marks(student["subjects"])
+        return {
+            "student_id": student["student_id"],
+            "student_name": student["name"],
+            "content": content,
+            "embedding": embedding,
+            # Full student data plus the derived fields search filters push down on
+            "metadata": {
+                **student,
+                "average_marks": round(avg_marks, 2),
+                "performance_category": categorize_performance(avg_marks, student["attendance"])
+            }
+        }
+    
+    def embed_students(
+        self,
+        students: List[Dict[str, Any]],
+        batch_size: int = 64,
+        version: Optional[int] = None
+    ) -> List[Tuple[str, str, np.ndarray]]:
+        """
+        Re-embed just these students (e.g. rows changed by an ingest): their old
+        embedding rows in `version` (default: the active index version) are
+        replaced. Returns (student_id, name, vector) for the similarity graph.
+        """
+        if version is None:
+            version = self.active_index_version(fresh=True)
+        embedded = []
+        for start in range(0, len(students), batch_size):
+            batch = students[start:start + batch_size]
+            contents = [format_student_data_for_embedding(student) for student in batch]
+            embeddings = self.embedding_model.embed_batch(contents)
+            rows = [self._embedding_row(s, c, e) for s, c, e in zip(batch, contents, embeddings)]
+            ids = [student["student_id"] for student in batch]
+            delete = self.supabase.table(self.table_name).delete().in_("student_id", ids)
+            if version is not None:
+                delete = delete.eq("index_version", version)
+                for row in rows:
+                    row["index_version"] = version
+            with span("upstream.supabase", op="replace_embeddings", rows=len(rows)):
+                delete.execute()
+                self.supabase.table(self.table_name).insert(rows).execute()
+            embedded.extend(
+                (student["student_id"], student["name"], np.asarray(embedding, dtype=np.float32))
+                for student, embedding in zip(batch, embeddings)
+            )
+        return embedded
+    
+    def search(
+        self, 
+        query: str, 
+        k: int = 2, 
+        filters: Optional[SearchFilters] = None
+    ) -> Tuple[List[str], List[Dict[str, Any]]]:
         """
         Search for similar students using pgvector cosine similarity
+        Filters are applied inside the RPC so only matching rows are ranked
         """
+        if filters is not None and filters.is_empty():
+            filters = None
+        
         # Generate query embedding
         query_embedding = self.embedding_model.embed_text(query)
         
+        # Partitioned deployments search only the partitions the query touches
+        partitioned = get_partitioned_index()
+        found = partitioned.search_many([query_embedding], k, filters) if partitioned is not None else None
+        if found is not None:
+            matches = found[0]
+            return [content for _, content, _ in matches], [metadata for _, _, metadata in matches]
+        
+        return self._read(
+            "search",
+            lambda replica: (replica.search_many([query_embedding], k, filters) or [None])[0],
+            lambda: self._search_supabase(query_embedding, k, filters),
+        )
+    
+    def _search_supabase(
+        self,
+        query_embedding: List[float],
+        k: int,
+        filters: Optional[SearchFilters]
+    ) -> Tuple[List[str], List[Dict[str, Any]]]:
+        """Ranked in Postgres (or in the shared snapshot when one is loaded)"""
+        if filters is not None:
+            with span("upstream.supabase", op="match_student_embeddings_filtered"):
+                result = self.supabase.rpc(
+                    'match_student_embeddings_filtered',
+                    {
+                        'query_embedding': query_embedding,
+                        'match_count': k,
+                        **filters.to_rpc_params()
+                    }
+                ).execute()
+            rows = result.data or []
+            return [item['content'] for item in rows], [item['metadata'] for item in rows]
+        
+        # Answer from the shared memory-mapped vectors when a snapshot is loaded
+        shared = get_shared_store()
+        snapshot = shared.snapshot() if shared is not None else None
+        if snapshot is not None and len(snapshot.vectors):
+            matches = snapshot.search(query_embedding, k)
+            return (
+                [snapshot.get_context(student_id) for student_id, _ in matches],
+                [snapshot.get_record(student_id) for student_id, _ in matches],
+            )
+        
         # Perform similarity search using Supabase RPC function
-        result = self.supabase.rpc(
-            'match_student_embeddings',
-            {
-                'query_embedding': query_embedding,
-                'match_count': k
-            }
-        ).execute()
+        with span("upstream.supabase", op="match_student_embeddings"):
+            result = self.supabase.rpc(
+                'match_student_embeddings',
+                {
+                    'query_embedding': query_embedding,
+                    'match_count': k
+                }
+            ).execute()
         
         if not result.data:
-            print("⚠️  No results found")
+            logger.info("No results found")
             return [], []
         
         # Extract content and metadata
@@ -95,40 +471,353 @@ class SupabaseVectorStore:
         
         return retrieved_docs, retrieved_metadata
     
+    def search_many(
+        self, 
+        queries: List[str], 
+        k: int = 2, 
+        filters: Optional[SearchFilters] = None
+    ) -> List[Tuple[List[str], List[Dict[str, Any]]]]:
+        """
+        Search several queries at once: one embedding call and one RPC round-trip
+        Returns one (docs, metadata) pair per query, in order
+        """
+        if not queries:
+            return []
+        query_embeddings = self.embedding_model.embed_batch(queries)
+        
+        partitioned = get_partitioned_index()
+        found = partitioned.search_many(query_embeddings, k, filters) if partitioned is not None else None
+        if found is not None:
+            return [
+                ([content for _, content, _ in matches], [metadata for _, _, metadata in matches])
+                for matches in found
+            ]
+        
+        return self._read(
+            "search",
+            lambda replica: replica.search_many(query_embeddings, k, filters),
+            lambda: self._search_many_supabase(query_embeddings, k, filters),
+        )
+    
+    def _search_many_supabase(
+        self,
+        query_embeddings: List[List[float]],
+        k: int,
+        filters: Optional[SearchFilters]
+    ) -> List[Tuple[List[str], List[Dict[str, Any]]]]:
+        params = {
+            'query_embeddings': query_embeddings,
+            'match_count': k,
+            **(filters or SearchFilters()).to_rpc_params()
+        }
+        with span("upstream.supabase", op="match_student_embeddings_batch", queries=len(query_embeddings)):
+            result = self.supabase.rpc('match_student_embeddings_batch', params).execute()
+        
+        grouped: List[Tuple[List[str], List[Dict[str, Any]]]] = [([], []) for _ in query_embeddings]
+        for item in result.data or []:
+            docs, metadata = grouped[item['query_index']]
+            docs.append(item['content'])
+            metadata.append(item['metadata'])
+        return grouped
+    
+    def _scan(
+        self,
+        table: str,
+        columns: str,
+        op: str,
+        where=None,
+        page_size: Optional[int] = None,
+        key: str = "student_id",
+        after: Any = None
+    ):
+        """
+        Yield every row of a table in `key` order, one page per request
+        Keyset pagination (key > last seen) keeps each page an index range
+        scan instead of an OFFSET that re-reads everything before it.
+        `columns` must include `key`; `where` narrows the query and `after`
+        starts past a known key.
+        """
+        page_size = page_size or config.SCAN_PAGE_SIZE
+        last = after
+        while True:
+            with span("upstream.supabase", op=op):
+                query = self.supabase.table(table).select(columns)
+                if where is not None:
+                    query = where(query)
+                if last is not None:
+                    query = query.gt(key, last)
+                result = query.order(key).limit(page_size).execute()
+            yield from result.data
+            if len(result.data) < page_size:
+                return
+            last = result.data[-1][key]
+    
+    def iter_changes(self, table: str, columns: str, since: int, page_size: Optional[int] = None, where=None):
+        """Rows whose replication `version` is above `since`, oldest change first (sql/replica_sync.sql)"""
+        return self._scan(
+            table,
+            f"{columns},version",
+            f"changes_{table}",
+            where,
+            page_size=page_size,
+            key="version",
+            after=since,
+        )
+    
+    def max_version(self, table: str) -> int:
+        """Highest replication version currently in a table (0 if empty)"""
+        with span("upstream.supabase", op="max_version", table=table):
+            result = self.supabase.table(table).select("version").order("version", desc=True).limit(1).execute()
+        return result.data[0]["version"] if result.data else 0
+    
+    def iter_students(self, page_size: Optional[int] = None):
+        """Yield every row of the students table (projected columns)"""
+        return self._scan("students", self.student_columns, "scan_students", page_size=page_size)
+    
+    def iter_embeddings(self, page_size: Optional[int] = None):
+        """Yield (student_id, embedding) rows of the active index version"""
+        return self._scan(self.table_name, "student_id,embedding", "scan_embeddings", self._version_filter(), page_size)
+    
+    def iter_index_vectors(self, version: int, page_size: Optional[int] = None) -> Iterator[Tuple[str, str, np.ndarray]]:
+        """Yield (student_id, name, vector) for every row of an index version"""
+        rows = self._scan(
+            self.table_name,
+            "student_id,student_name,embedding",
+            "scan_index_vectors",
+            self._version_filter(version),
+            page_size,
+        )
+        return (_vector_entry(row) for row in rows)
+    
+    def list_partitions(self, page_size: Optional[int] = None) -> List[str]:
+        """
+        Distinct PARTITION_KEY values present in the active index version: one
+        list_student_partitions RPC, or a scan of every row until it is deployed
+        """
+        if self._partitions_rpc:
+            try:
+                with span("upstream.supabase", op="list_student_partitions"):
+                    result = self.supabase.rpc('list_student_partitions', {
+                        'partition_key': config.PARTITION_KEY,
+                        'filter_index_version': self.active_index_version(),
+                    }).execute()
+            except Exception as e:
+                # PGRST202: function not deployed yet, stop trying in this process
+                if getattr(e, "code", None) != "PGRST202":
+                    raise
+                logger.warning("list_student_partitions RPC not found, scanning embeddings", extra={"error": str(e)})
+                self._partitions_rpc = False
+            else:
+                return sorted({"default" if row["partition"] is None else str(row["partition"]) for row in result.data or []})
+        rows = self._scan(
+            self.table_name,
+            f"student_id,partition:metadata->>{config.PARTITION_KEY}",
+            "list_partitions",
+            self._version_filter(),
+            page_size,
+        )
+        return sorted({"default" if row["partition"] is None else str(row["partition"]) for row in rows})
+    
+    def iter_partition(self, partition: str, page_size: Optional[int] = None):
+        """Yield content/metadata/embedding rows of one partition"""
+        column = f"metadata->>{config.PARTITION_KEY}"
+        version = self.active_index_version()
+        
+        def where(query):
+            if version is not None:
+                query = query.eq("index_version", version)
+            return query.is_(column, "null") if partition == "default" else query.eq(column, partition)
+        
+        for row in self._scan(self.table_name, "student_id,content,metadata,embedding", "scan_partition", where, page_size):
+            row["embedding"] = _parse_embedding(row["embedding"])
+            yield row
+    
+    def _read(self, name: str, from_replica: Callable[[Replica], Any], from_supabase: Callable[[], Any]) -> Any:
+        """
+        Serve a read from the local replica while it is within the staleness
+        bound, otherwise from Supabase; if Supabase fails, from the replica
+        however stale (None from the replica means "not there", ask Supabase)
+        """
+        replica = get_replica()
+        if replica is not None and replica.is_fresh():
+            result = from_replica(replica)
+            record_cache(f"replica_{name}", result is not None)
+            if result is not None:
+                return result
+        try:
+            return from_supabase()
+        except Exception as e:
+            result = from_replica(replica) if replica is not None else None
+            if result is None:
+                raise
+            logger.warning("Supabase read failed, serving from the replica", extra={
+                "read": name,
+                "replica_lag_s": replica.lag(),
+                "error": str(e),
+            })
+            return result
+    
     def get_student_by_id(self, student_id: str) -> Dict[str, Any]:
         """
         Retrieve specific student data by ID
-        Always fetches FRESH data from students table (not cached embeddings)
+        Served from the shared snapshot when enabled (at most
+        SHARED_DATA_REFRESH_SECONDS old) or the local replica (at most
+        REPLICA_MAX_STALENESS_SECONDS old), otherwise FRESH from the students table
         """
+        shared = get_shared_store()
+        if shared is not None:
+            student = shared.get_record(student_id)
+            if student is not None:
+                return student
+        
+        return self._read(
+            "students",
+            lambda replica: replica.get_record(student_id),
+            lambda: self._select_student(student_id),
+        )
+    
+    def _select_student(self, student_id: str) -> Optional[Dict[str, Any]]:
         # Fetch fresh data directly from students table, not from cached embeddings
-        result = self.supabase.table("students")\
-            .select("*")\
-            .eq("student_id", student_id)\
-            .execute()
+        with span("upstream.supabase", op="select_student"):
+            result = self.supabase.table("students")\
+                .select(self.student_columns)\
+                .eq("student_id", student_id)\
+                .execute()
         
         if result.data and len(result.data) > 0:
             return result.data[0]
         return None
     
+    def get_students(self, student_ids: List[str]) -> List[Dict[str, Any]]:
+        """Projected rows for several students in one request (unknown IDs are skipped)"""
+        if not student_ids:
+            return []
+        with span("upstream.supabase", op="select_students", count=len(student_ids)):
+            result = self.supabase.table("students")\
+                .select(self.student_columns)\
+                .in_("student_id", student_ids)\
+                .execute()
+        return result.data or []
+    
+    def upsert_students(self, students: List[Dict[str, Any]]):
+        """Insert or update students by student_id in one request (rows are not echoed back)"""
+        from postgrest.types import ReturnMethod
+        with span("upstream.supabase", op="upsert_students", count=len(students)):
+            self.supabase.table("students")\
+                .upsert(students, on_conflict="student_id", returning=ReturnMethod.minimal)\
+                .execute()
+    
+    def get_student_context(self, student_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Student record with its rendered context, average marks and performance
+        category: {"student", "context", "average_marks", "performance_category"}
+        Local when the shared snapshot or replica has it, otherwise one
+        get_student_context RPC round-trip; without the RPC, a projected select
+        formatted locally. None if the student is unknown.
+        """
+        shared = get_shared_store()
+        if shared is not None:
+            student = shared.get_record(student_id)
+            if student is not None:
+                return self._with_context(student, shared.get_context(student_id))
+        
+        def from_replica(replica) -> Optional[Dict[str, Any]]:
+            found = replica.get_context(student_id)
+            return self._with_context(*found) if found else None
+        
+        return self._read("contexts", from_replica, lambda: self._fetch_student_context(student_id))
+    
+    def _fetch_student_context(self, student_id: str) -> Optional[Dict[str, Any]]:
+        if self._context_rpc:
+            try:
+                with span("upstream.supabase", op="get_student_context"):
+                    result = self.supabase.rpc('get_student_context', {
+                        'p_student_id': student_id,
+                        'fantastic_threshold': config.FANTASTIC_THRESHOLD,
+                        'average_threshold': config.AVERAGE_THRESHOLD,
+                        'good_attendance': config.GOOD_ATTENDANCE,
+                    }).execute()
+            except Exception as e:
+                # PGRST202: function not deployed yet, stop trying in this process
+                if getattr(e, "code", None) != "PGRST202":
+                    raise
+                logger.warning("get_student_context RPC not found, using select", extra={"error": str(e)})
+                self._context_rpc = False
+            else:
+                if not result.data:
+                    return None
+                row = result.data[0]
+                return {
+                    "student": row["student"],
+                    "context": row["context"],
+                    "average_marks": row["average_marks"],
+                    "performance_category": row["performance_category"],
+                }
+        
+        student = self._select_student(student_id)
+        return self._with_context(student) if student else None
+    
+    @staticmethod
+    def _with_context(student: Dict[str, Any], context: Optional[str] = None) -> Dict[str, Any]:
+        avg_marks = calculate_average_marks(student["subjects"])
+        return {
+            "student": student,
+            "context": context if context is not None else format_student_data_for_embedding(student),
+            "average_marks": avg_marks,
+            "performance_category": categorize_performance(avg_marks, student["attendance"]),
+        }
+    
     def get_student_content_by_id(self, student_id: str) -> Tuple[Optional[str], Optional[Dict[str, Any]]]:
         """
         Retrieve student content and metadata by ID
-        Fetches fresh data from students table and formats it
+        Fresh from the students table, formatted server-side (see get_student_context)
         """
-        # Fetch fresh data from students table
-        result = self.supabase.table("students")\
-            .select("*")\
-            .eq("student_id", student_id)\
-            .execute()
-        
-        if result.data and len(result.data) > 0:
-            student_data = result.data[0]
-            # Format the fresh data for embedding format
-            from src.utils import format_student_data_for_embedding
-            content = format_student_data_for_embedding(student_data)
-            return content, student_data
-        return None, None
+        loaded = self.get_student_context(student_id)
+        if loaded is None:
+            return None, None
+        return loaded["context"], loaded["student"]
+
+    def roster_version(self) -> Optional[str]:
+        """
+        Token that changes whenever a student is added, changed or removed
+        (replication versions from sql/replica_sync.sql); None without them
+        """
+        def from_supabase() -> str:
+            return f"{self.max_version('students')}.{self.max_version('replica_tombstones')}"
+
+        try:
+            return self._read("roster_version", lambda replica: replica.roster_version(), from_supabase)
+        except Exception as e:
+            logger.warning("Roster version unavailable", extra={"error": str(e)})
+            return None
+
+    def iter_roster(self, filters: Optional[SearchFilters] = None) -> Iterator[Dict[str, Any]]:
+        """Every student matching `filters`, streamed from the fresh replica or a keyset scan"""
+        replica = get_replica()
+        fresh = replica is not None and replica.is_fresh()
+        if replica is not None:
+            record_cache("replica_roster", fresh)
+        if fresh:
+            students = replica.iter_students()
+        else:
+            semester = filters.semester if filters is not None else None
+            where = (lambda query: query.eq("semester", semester)) if semester is not None else None
+            students = self._scan("students", self.student_columns, "scan_roster", where)
+        for student in students:
+            if matches_filters(student, filters):
+                yield student
+
+def _timestamp(value: Optional[str]) -> float:
+    """Epoch seconds of a timestamptz from PostgREST (0 when unset)"""
+    return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp() if value else 0.0
+
+def _parse_embedding(value: Any) -> List[float]:
+    """pgvector columns come back from PostgREST as the string '[0.1,0.2,...]'"""
+    return json.loads(value) if isinstance(value, str) else value
 
+def _vector_entry(row: Dict[str, Any]) -> Tuple[str, str, np.ndarray]:
+    """(student_id, name, vector) from a student_embeddings row"""
+    return row["student_id"], row["student_name"], np.asarray(_parse_embedding(row["embedding"]), dtype=np.float32)
 
 # Singleton instance
 _vector_store = None
@@ -0,0 +1,147 @@
+import json
+import logging
+import os
+import sys
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, List, Optional
+
+# Per-request trace state (ContextVars follow the request across awaits)
+_trace_id: ContextVar[Optional[str]] = ContextVar("trace_id", default=None)
+_span_stack: ContextVar[tuple] = ContextVar("span_stack", default=())
+_spans: ContextVar[Optional[List[Dict[str, Any]]]] = ContextVar("spans", default=None)
+
+_RESERVED_LOG_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """Format log records as one JSON object per line"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+        }
+        trace_id = _trace_id.get()
+        if trace_id:
+            entry["trace_id"] = trace_id
+        stack = _span_stack.get()
+        if stack:
+            entry["span_id"] = stack[-1]
+        # Anything passed through `extra=` becomes a top-level field
+        for key, value in record.__dict__.items():
+            if key not in _RESERVED_LOG_ATTRS and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+_configured = False
+
+def configure_logging():
+    """Install the JSON formatter on the root logger (idempotent)"""
+    global _configured
+    if _configured:
+        return
+    handler = logging.StreamHandler(sys.stdout)
+    handler.setFormatter(JSONFormatter())
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    _configured = True
+
+
+def get_logger(name: str) -> logging.Logger:
+    """Get a structured logger"""
+    configure_logging()
+    return logging.getLogger(name)
+
+
+logger = get_logger(__name__)
+
+
+def start_trace(trace_id: Optional[str] = None) -> str:
+    """Begin a new trace for the current request"""
+    trace_id = trace_id or uuid.uuid4().hex
+    _trace_id.set(trace_id)
+    _span_stack.set(())
+    _spans.set([])
+    return trace_id
+
+
+def current_trace_id() -> Optional[str]:
+    return _trace_id.get()
+
+
+def finished_spans() -> List[Dict[str, Any]]:
+    """Spans completed so far in the current trace"""
+    return list(_spans.get() or [])
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Time a unit of work as a child of the current span.
+    The finished span is logged and kept on the trace for Server-Timing.
+    """
+    span_id = uuid.uuid4().hex[:16]
+    stack = _span_stack.get()
+    parent_id = stack[-1] if stack else None
+    token = _span_stack.set(stack + (span_id,))
+    start = time.perf_counter()
+    error = None
+    try:
+        yield attributes
+    except BaseException as e:
+        error = repr(e)
+        raise
+    finally:
+        duration_ms = (time.perf_counter() - start) * 1000
+        _span_stack.reset(token)
+        if error:
+            attributes["error"] = error
+        _finish_span(name, span_id, parent_id, duration_ms, attributes)
+
+
+def record_span(name: str, duration_ms: float, **attributes):
+    """
+    Record a span timed by the caller, as a child of the current span.
+    For work that spans several generator steps (a streamed upstream call),
+    which may run on different threadpool workers and so can't hold span() open.
+    """
+    stack = _span_stack.get()
+    _finish_span(name, uuid.uuid4().hex[:16], stack[-1] if stack else None, duration_ms, attributes)
+
+
+def _finish_span(name: str, span_id: str, parent_id: Optional[str], duration_ms: float, attributes: Dict[str, Any]):
+    record = {
+        "span": name,
+        "span_id": span_id,
+        "parent_id": parent_id,
+        "duration_ms": round(duration_ms, 3),
+        **attributes,
+    }
+    spans = _spans.get()
+    if spans is not None:
+        spans.append(record)
+    logger.debug("span finished", extra=record)
+
+
+def server_timing_header(spans: List[Dict[str, Any]], total_ms: Optional[float] = None) -> str:
+    """
+    Build a Server-Timing header value, summing spans that share a name
+    (e.g. several upstream retries) so the header stays short.
+    """
+    totals: Dict[str, float] = {}
+    for s in spans:
+        metric = "".join(c if c.isalnum() or c in "-_" else "_" for c in s["span"])
+        totals[metric] = totals.get(metric, 0.0) + s["duration_ms"]
+    parts = [f"{name};dur={dur:.1f}" for name, dur in totals.items()]
+    if total_ms is not None:
+        parts.append(f"total;dur={total_ms:.1f}")
+    return ", ".join(parts)
\ No newline at end of file
@@ -0,0 +1,277 @@
+"""
+Write-behind log of chat turns: what was asked, what was answered, how long
+it took and how many LLM tokens it cost.
+
+The request path only appends a dict to an in-memory buffer (bounded by
+TRANSCRIPT_BUFFER_SIZE; the oldest turns are dropped and counted when it is
+full). A background thread writes the buffer in batches of at most
+TRANSCRIPT_BATCH_SIZE every TRANSCRIPT_FLUSH_SECONDS, or as soon as a batch
+is full, to a local SQLite file or the Supabase chat_turns table
+(sql/chat_turns.sql). A crash loses at most the turns of one flush interval;
+a clean shutdown flushes everything. A failed write keeps its batch buffered
+and is retried on the next flush.
+
+Token counts come from the `usage` field of chat-completions responses (the
+final chunk when streaming), summed per request by record_usage().
+
+By default turns carry no message or answer text and student IDs are salted
+hashes, as in the traffic capture (src/capture.py).
+"""
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Deque, Dict, List, Optional
+from src.capture import anonymize_id
+from src.config import config
+from src.metrics import LLM_TOKENS, TRANSCRIPT_TURNS
+from src.tracing import current_trace_id, get_logger
+
+logger = get_logger(__name__)
+
+# Columns of chat_turns, in both sinks
+COLUMNS = (
+    "ts", "trace_id", "endpoint", "student_id", "status",
+    "message", "response", "performance_category", "history_length",
+    "duration_ms", "first_token_ms",
+    "model", "llm_calls", "prompt_tokens", "completion_tokens", "total_tokens",
+)
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens")
+
+# LLM usage of the current request (set by the endpoint, filled by LLMHandler)
+_usage: ContextVar[Optional[Dict[str, Any]]] = ContextVar("llm_usage", default=None)
+
+
+def start_usage() -> Dict[str, Any]:
+    """Start summing LLM usage for the current request (threadpool calls share the dict)"""
+    usage = {"model": None, "llm_calls": 0, **{field: 0 for field in USAGE_FIELDS}}
+    _usage.set(usage)
+    return usage
+
+
+def record_usage(model: str, usage: Optional[Dict[str, Any]]):
+    """Add one chat-completions call to the request's usage and the token metrics"""
+    usage = usage or {}
+    for kind in ("prompt", "completion"):
+        if usage.get(f"{kind}_tokens"):
+            LLM_TOKENS.labels(kind=kind).inc(usage[f"{kind}_tokens"])
+    current = _usage.get()
+    if current is None:
+        return
+    current["model"] = model
+    current["llm_calls"] += 1
+    for field in USAGE_FIELDS:
+        current[field] += usage.get(field) or 0
+
+
+class SQLiteTranscriptSink:
+    """chat_turns in a local SQLite (WAL) file, shared by every worker on the host"""
+
+    def __init__(self, path: str):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=10, isolation_level=None, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS chat_turns (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                ts REAL NOT NULL,
+                trace_id TEXT,
+                endpoint TEXT NOT NULL,
+                student_id TEXT,
+                status INTEGER NOT NULL,
+                message TEXT,
+                response TEXT,
+                performance_category TEXT,
+                history_length INTEGER,
+                duration_ms REAL,
+                first_token_ms REAL,
+                model TEXT,
+                llm_calls INTEGER,
+                prompt_tokens INTEGER,
+                completion_tokens INTEGER,
+                total_tokens INTEGER
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chat_turns_ts_idx ON chat_turns (ts)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS chat_turns_student_idx ON chat_turns (student_id, ts)")
+
+    def write(self, turns: List[Dict[str, Any]]):
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(
+                f"INSERT INTO chat_turns ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                [tuple(turn[column] for column in COLUMNS) for turn in turns],
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+
+
+class SupabaseTranscriptSink:
+    """chat_turns in Supabase (sql/chat_turns.sql), one insert per batch"""
+
+    def write(self, turns: List[Dict[str, Any]]):
+        from postgrest.types import ReturnMethod
+        from src.supabase_vector_store import get_vector_store
+        get_vector_store().supabase.table("chat_turns")\
+            .insert(turns, returning=ReturnMethod.minimal)\
+            .execute()
+
+
+class TranscriptLog:
+    """Bounded buffer of chat turns, written in batches by a background thread"""
+
+    def __init__(self, sink, flush_interval: float, batch_size: int, max_buffered: int, store_text: bool,
+                 hash_ids: bool = False, salt: str = ""):
+        self.sink = sink
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_buffered = max_buffered
+        self.store_text = store_text
+        self.hash_ids = hash_ids
+        self.salt = salt
+        self._buffer: Deque[Dict[str, Any]] = deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._failures = 0
+        self._write_lock = threading.Lock()
+        self._thread = threading.Thread(target=self._flush_loop, name="transcript-writer", daemon=True)
+        self._thread.start()
+
+    def record_turn(
+        self,
+        endpoint: str,
+        student_id: Optional[str],
+        message: str,
+        status: int,
+        started_at: float,
+        duration_ms: float,
+        usage: Optional[Dict[str, Any]],
+        response: str = "",
+        performance_category: Optional[str] = None,
+        history_length: int = 0,
+        first_token_ms: Optional[float] = None
+    ):
+        """Buffer one turn for writing (never blocks on I/O)"""
+        usage = usage or {}
+        if student_id is not None and self.hash_ids:
+            student_id = anonymize_id(student_id, self.salt)
+        turn = {
+            "ts": round(started_at, 6),
+            "trace_id": current_trace_id(),
+            "endpoint": endpoint,
+            "student_id": student_id,
+            "status": status,
+            "message": message if self.store_text else None,
+            "response": response if self.store_text else None,
+            "performance_category": performance_category,
+            "history_length": history_length,
+            "duration_ms": round(duration_ms, 3),
+            "first_token_ms": round(first_token_ms, 3) if first_token_ms is not None else None,
+            "model": usage.get("model"),
+            "llm_calls": usage.get("llm_calls", 0),
+            **{field: usage.get(field, 0) for field in USAGE_FIELDS},
+        }
+        with self._cond:
+            self._buffer.append(turn)
+            dropped = self._trim()
+            if len(self._buffer) >= self.batch_size:
+                self._cond.notify()
+        if dropped:
+            TRANSCRIPT_TURNS.labels(outcome="dropped").inc(dropped)
+
+    def _trim(self) -> int:
+        """Drop the oldest turns beyond max_buffered (caller holds the lock)"""
+        dropped = 0
+        while len(self._buffer) > self.max_buffered:
+            self._buffer.popleft()
+            dropped += 1
+        return dropped
+
+    def _take_batch(self) -> List[Dict[str, Any]]:
+        with self._cond:
+            return [self._buffer.popleft() for _ in range(min(self.batch_size, len(self._buffer)))]
+
+    def _write(self, batch: List[Dict[str, Any]]) -> bool:
+        try:
+            with self._write_lock:
+                self.sink.write(batch)
+        except Exception as e:
+            # Keep the batch for the next flush; the buffer bound still applies
+            with self._cond:
+                self._buffer.extendleft(reversed(batch))
+                dropped = self._trim()
+            if dropped:
+                TRANSCRIPT_TURNS.labels(outcome="dropped").inc(dropped)
+            self._failures += 1
+            if self._failures == 1 or self._failures % 100 == 0:
+                logger.error("Transcript write failed", extra={
+                    "error": str(e),
+                    "buffered": len(self._buffer),
+                    "failures": self._failures,
+                })
+            return False
+        self._failures = 0
+        TRANSCRIPT_TURNS.labels(outcome="written").inc(len(batch))
+        return True
+
+    def _flush_loop(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self._closed or len(self._buffer) >= self.batch_size,
+                    timeout=self.flush_interval,
+                )
+                if self._closed:
+                    return
+            batch = self._take_batch()
+            if batch and not self._write(batch):
+                time.sleep(self.flush_interval)
+
+    def close(self, timeout: float = 5.0):
+        """Stop the writer and flush what is buffered (called on shutdown)"""
+        with self._cond:
+            self._closed = True
+            self._cond.notify()
+        self._thread.join(timeout)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            batch = self._take_batch()
+            if not batch or not self._write(batch):
+                break
+        if self._buffer:
+            logger.warning("Transcript turns lost at shutdown", extra={"turns": len(self._buffer)})
+
+
+# Singleton instance
+_transcript_log = None
+_transcript_log_lock = threading.Lock()
+
+def get_transcript_log() -> Optional[TranscriptLog]:
+    """Transcript log, or None when TRANSCRIPT_SINK=off"""
+    global _transcript_log
+    if _transcript_log is None and config.TRANSCRIPT_SINK != "off":
+        with _transcript_log_lock:
+            if _transcript_log is None:
+                if config.TRANSCRIPT_SINK == "supabase":
+                    sink = SupabaseTranscriptSink()
+                elif config.TRANSCRIPT_SINK == "sqlite":
+                    sink = SQLiteTranscriptSink(config.TRANSCRIPT_DB)
+                else:
+                    raise ValueError(f"Unknown TRANSCRIPT_SINK: {config.TRANSCRIPT_SINK}")
+                _transcript_log = TranscriptLog(
+                    sink,
+                    config.TRANSCRIPT_FLUSH_SECONDS,
+                    config.TRANSCRIPT_BATCH_SIZE,
+                    config.TRANSCRIPT_BUFFER_SIZE,
+                    config.TRANSCRIPT_STORE_TEXT,
+                    config.TRANSCRIPT_HASH_IDS,
+                    config.TRANSCRIPT_SALT,
+                )
+                logger.info("Logging chat transcripts", extra={"sink": config.TRANSCRIPT_SINK})
+    return _transcript_log
@@ -1,3 +1,4 @@
+import hashlib
 import json
 from typing import List, Dict, Any
 from src.config import config
@@ -27,6 +28,38 @@ def categorize_performance(avg_marks: float, attendance: float) -> str:
     else:
         return "Below Average"
 
+def partition_of(student: Dict[str, Any]) -> str:
+    """Partition a student belongs to (value of PARTITION_KEY, as a string)"""
+    value = student.get(config.PARTITION_KEY)
+    return "default" if value is None else str(value)
+
+def matches_filters(student: Dict[str, Any], filters) -> bool:
+    """Check a student record against SearchFilters (used to pre-select FAISS ids)"""
+    if filters is None:
+        return True
+    if filters.semester is not None and student['semester'] != filters.semester:
+        return False
+    if filters.partition is not None and partition_of(student) != filters.partition:
+        return False
+    attendance = student['attendance']
+    if filters.min_attendance is not None and attendance < filters.min_attendance:
+        return False
+    if filters.max_attendance is not None and attendance > filters.max_attendance:
+        return False
+    if filters.performance_category is not None:
+        avg_marks = calculate_average_marks(student['subjects'])
+        if categorize_performance(avg_marks, attendance) != filters.performance_category:
+            return False
+    for thresholds, is_min in ((filters.subject_min_marks, True), (filters.subject_max_marks, False)):
+        for subject, threshold in (thresholds or {}).items():
+            marks = student['subjects'].get(subject)
+            if marks is None or not marks['total']:
+                return False
+            percent = marks['marks'] / marks['total'] * 100
+            if (is_min and percent < threshold) or (not is_min and percent > threshold):
+                return False
+    return True
+
 def format_student_data_for_embedding(student: Dict[str, Any]) -> str:
     """Convert student data to text format for embedding"""
     subjects_text = ", ".join([
@@ -48,4 +81,15 @@ Attendance: {student['attendance']}%
 Assignments Submitted: {student['assignments_submitted']}/{student['total_assignments']}
 Performance Notes: {student['performance_notes']}
 """
-    return text.strip()
\ No newline at end of file
+    return text.strip()
+
+def history_digest(history: List[Dict[str, str]], previous: str = "") -> str:
+    """
+    Chained SHA-256 over conversation turns.
+    digest(h + [m]) == history_digest([m], digest(h)), so clients holding only
+    the last digest can verify their local copy after appending a new turn.
+    """
+    digest = previous
+    for msg in history:
+        digest = hashlib.sha256(f"{digest}\x00{msg['role']}\x00{msg['content']}".encode("utf-8")).hexdigest()
+    return digest
\ No newline at end of file
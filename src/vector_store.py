@@ -2,10 +2,15 @@ import os
 import pickle
 import faiss
 import numpy as np
-from typing import List, Tuple, Dict, Any
+from typing import List, Tuple, Dict, Any, Optional
 from src.config import config
 from src.embeddings import get_embedding_model
-from src.utils import load_student_data, format_student_data_for_embedding
+from src.utils import load_student_data, format_student_data_for_embedding, matches_filters
+from src.models import SearchFilters
+from src.tracing import get_logger
+from src.similarity_graph import build_similarity_graph
+
+logger = get_logger(__name__)
 
 class VectorStore:
     def __init__(self):
@@ -16,17 +21,17 @@ class VectorStore:
         
     def create_index(self):
         """Create FAISS index from student data"""
-        print("Loading student data...")
+        logger.info("Loading student data")
         students = load_student_data()
         
-        print("Formatting student data for embedding...")
+        logger.info("Formatting student data for embedding")
         texts = [format_student_data_for_embedding(student) for student in students]
         
-        print("Generating embeddings...")
+        logger.info("Generating embeddings")
         embeddings = self.embedding_model.embed_texts(texts)
         embeddings_array = np.array(embeddings).astype('float32')
         
-        print(f"Creating FAISS index with {len(embeddings)} documents...")
+        logger.info("Creating FAISS index", extra={"documents": len(embeddings)})
         dimension = embeddings_array.shape[1]
         self.index = faiss.IndexFlatL2(dimension)
         self.index.add(embeddings_array)
@@ -34,7 +39,13 @@ class VectorStore:
         self.documents = texts
         self.metadata = students
         
-        print("Index created successfully!")
+        logger.info("Building similarity graph")
+        build_similarity_graph(
+            (student["student_id"], student["name"], embedding)
+            for student, embedding in zip(students, embeddings)
+        )
+        
+        logger.info("Index created successfully")
         
     def save_index(self):
         """Save FAISS index to disk"""
@@ -48,19 +59,19 @@ class VectorStore:
         with open(os.path.join(config.VECTOR_STORE_PATH, "metadata.pkl"), 'wb') as f:
             pickle.dump(self.metadata, f)
         
-        print(f"Index saved to {config.VECTOR_STORE_PATH}")
+        logger.info("Index saved", extra={"path": config.VECTOR_STORE_PATH})
     
     def load_index(self):
         """Load FAISS index from disk"""
         index_path = os.path.join(config.VECTOR_STORE_PATH, "index.faiss")
         
         if not os.path.exists(index_path):
-            print("Index not found. Creating new index...")
+            logger.info("Index not found, creating new index")
             self.create_index()
             self.save_index()
             return
         
-        print("Loading existing index...")
+        logger.info("Loading existing index")
         self.index = faiss.read_index(index_path)
         
         with open(os.path.join(config.VECTOR_STORE_PATH, "documents.pkl"), 'rb') as f:
@@ -69,18 +80,50 @@ class VectorStore:
         with open(os.path.join(config.VECTOR_STORE_PATH, "metadata.pkl"), 'rb') as f:
             self.metadata = pickle.load(f)
         
-        print("Index loaded successfully!")
+        logger.info("Index loaded successfully")
+    
+    def _search_params(self, filters: Optional[SearchFilters]):
+        """Restrict the FAISS scan to ids matching the filters (None = no restriction)"""
+        if filters is None or filters.is_empty():
+            return None
+        ids = np.array(
+            [i for i, student in enumerate(self.metadata) if matches_filters(student, filters)],
+            dtype='int64'
+        )
+        return faiss.SearchParameters(sel=faiss.IDSelectorBatch(ids))
     
-    def search(self, query: str, k: int = 2) -> Tuple[List[str], List[Dict[str, Any]]]:
+    def _collect(self, row) -> Tuple[List[str], List[Dict[str, Any]]]:
+        # FAISS pads with -1 when fewer than k vectors pass the selector
+        hits = [i for i in row if i >= 0]
+        return [self.documents[i] for i in hits], [self.metadata[i] for i in hits]
+    
+    def search(
+        self, 
+        query: str, 
+        k: int = 2, 
+        filters: Optional[SearchFilters] = None
+    ) -> Tuple[List[str], List[Dict[str, Any]]]:
         """Search for relevant documents"""
         query_embedding = np.array([self.embedding_model.embed_text(query)]).astype('float32')
         
-        distances, indices = self.index.search(query_embedding, k)
-        
-        retrieved_docs = [self.documents[i] for i in indices[0]]
-        retrieved_metadata = [self.metadata[i] for i in indices[0]]
+        distances, indices = self.index.search(query_embedding, k, params=self._search_params(filters))
         
-        return retrieved_docs, retrieved_metadata
+        return self._collect(indices[0])
+    
+    def search_many(
+        self, 
+        queries: List[str], 
+        k: int = 2, 
+        filters: Optional[SearchFilters] = None
+    ) -> List[Tuple[List[str], List[Dict[str, Any]]]]:
+        """Search several queries with one embedding call and one FAISS call"""
+        if not queries:
+            return []
+        query_embeddings = np.array(self.embedding_model.embed_batch(queries)).astype('float32')
+        
+        distances, indices = self.index.search(query_embeddings, k, params=self._search_params(filters))
+        
+        return [self._collect(row) for row in indices]
 
 # Singleton instance
 _vector_store = None
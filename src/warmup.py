@@ -0,0 +1,116 @@
+import threading
+import time
+from typing import Dict, Any, List, Optional
+from src.config import config
+from src.tracing import get_logger, span
+
+logger = get_logger(__name__)
+
+
+class Readiness:
+    """
+    Tracks background warm-up so /ready can tell the platform when this
+    instance is actually able to serve chats.
+
+    States: starting -> warming -> ready | failed
+
+    Required steps that fail are retried with capped backoff while the state
+    stays "warming"; only missing settings end in "failed".
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.state = "starting"
+        self.errors: List[str] = []
+        self.steps: Dict[str, float] = {}
+        self.attempts: Dict[str, int] = {}
+        self.started_at = time.time()
+        self.ready_at: Optional[float] = None
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def is_ready(self) -> bool:
+        return self.state == "ready"
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "errors": list(self.errors),
+                "steps_ms": dict(self.steps),
+                "attempts": dict(self.attempts),
+                "warmup_seconds": round(self.ready_at - self.started_at, 3) if self.ready_at else None,
+            }
+
+    def start(self):
+        """Run warm-up in a daemon thread so the server accepts connections immediately"""
+        if self._thread is not None:
+            return
+        self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+        self._thread.start()
+
+    def _step(self, name: str, fn, required: bool = True) -> bool:
+        start = time.perf_counter()
+        with self._lock:
+            self.attempts[name] = self.attempts.get(name, 0) + 1
+        try:
+            with span(f"warmup.{name}"):
+                fn()
+            with self._lock:
+                self.errors = [error for error in self.errors if not error.startswith(f"{name}: ")]
+            return True
+        except Exception as e:
+            level = logger.error if required else logger.warning
+            level("Warm-up step failed", extra={"step": name, "error": str(e), "attempt": self.attempts[name]})
+            with self._lock:
+                # Keep only the latest error of each step
+                self.errors = [error for error in self.errors if not error.startswith(f"{name}: ")]
+                self.errors.append(f"{name}: {e}")
+            return not required
+        finally:
+            with self._lock:
+                self.steps[name] = round((time.perf_counter() - start) * 1000, 1)
+
+    def _retry(self, name: str, fn):
+        """Run a required step until it succeeds (transient failures shouldn't fail the instance)"""
+        delay = config.WARMUP_RETRY_INITIAL_SECONDS
+        while not self._step(name, fn):
+            time.sleep(delay)
+            delay = min(delay * 2, config.WARMUP_RETRY_MAX_SECONDS)
+
+    def _run(self):
+        with self._lock:
+            self.state = "warming"
+        missing = config.missing_settings()
+        if missing:
+            with self._lock:
+                self.errors.append(f"missing settings: {', '.join(missing)}")
+                self.state = "failed"
+            logger.error("Cannot warm up, settings missing", extra={"missing": missing})
+            return
+
+        from src.rag_pipeline import get_rag_pipeline
+        self._retry("pipeline", get_rag_pipeline)
+        pipeline = get_rag_pipeline()
+        self._retry("supabase", pipeline.vector_store.ping)
+        if config.WARMUP_PING_MODELS:
+            # Model pings are best effort: a cold model shouldn't keep the
+            # instance out of rotation forever, the request path retries.
+            self._step("llm", pipeline.llm_handler.ping, required=False)
+            self._step("embeddings", lambda: pipeline.vector_store.embedding_model.embed_text("warm-up"), required=False)
+
+        with self._lock:
+            self.state = "ready"
+            self.ready_at = time.time()
+        logger.info("Warm-up finished", extra=self.snapshot())
+
+
+# Singleton instance
+_readiness = None
+
+def get_readiness() -> Readiness:
+    """Get or create the readiness tracker"""
+    global _readiness
+    if _readiness is None:
+        _readiness = Readiness()
+    return _readiness
\ No newline at end of file
@@ -4,6 +4,7 @@ import json
 
 # API Configuration
 API_URL = "http://127.0.0.1:8000"  # Changed from localhost to 127.0.0.1
+STUDENTS_TTL_SECONDS = 300  # Roster rarely changes; don't refetch it on every rerun
 
 st.set_page_config(
     page_title="Zeeshan's Bot - Student Performance",
@@ -11,6 +12,55 @@ st.set_page_config(
     layout="wide"
 )
 
+@st.cache_resource
+def get_session() -> requests.Session:
+    """One keep-alive connection pool shared by all reruns and browser sessions"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+@st.cache_data(ttl=STUDENTS_TTL_SECONDS, show_spinner=False)
+def fetch_students():
+    """Roster for the sidebar, cached across reruns"""
+    response = get_session().get(f"{API_URL}/students", timeout=10)
+    response.raise_for_status()
+    return response.json()["students"]
+
+def stream_chat(payload: dict, result: dict):
+    """
+    Yield answer tokens from /chat/stream as they arrive (for st.write_stream);
+    the start/done event fields are collected into `result`
+    """
+    with get_session().post(f"{API_URL}/chat/stream", json=payload, stream=True, timeout=(5, 60)) as response:
+        if response.status_code != 200:
+            result["error"] = response.json().get("detail", "Unknown error")
+            return
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["type"] == "token":
+                yield event["content"]
+            else:
+                result.update(event)
+
+def prefetch_student(student_id: str):
+    """Ask the backend to warm this student's context (and likely first answer)"""
+    try:
+        get_session().post(f"{API_URL}/students/{student_id}/prefetch", timeout=5)
+    except requests.exceptions.RequestException:
+        pass  # only an optimization
+
+def show_performance_badge(category):
+    if category == "Fantastic":
+        st.success(f"🌟 **{category}** Performance")
+    elif category == "Average":
+        st.info(f"📈 **{category}** Performance")
+    elif category == "Below Average":
+        st.warning(f"📉 **{category}** Performance")
+
 # Initialize session state for conversation
 if "conversation_history" not in st.session_state:
     st.session_state.conversation_history = []
@@ -28,9 +78,8 @@ with st.sidebar:
     
     # Fetch available students
     try:
-        response = requests.get(f"{API_URL}/students")
-        if response.status_code == 200:
-            students = response.json()["students"]
+        students = fetch_students()
+        if students:
             student_options = {f"{s['student_id']} - {s['name']}": s['student_id'] for s in students}
             
             selected = st.selectbox(
@@ -43,6 +92,7 @@ with st.sidebar:
             # If student changed, reset conversation
             if selected_student_id != st.session_state.current_student_id:
                 st.session_state.current_student_id = selected_student_id
+                prefetch_student(selected_student_id)
                 st.session_state.conversation_history = []
                 st.session_state.messages = []
                 st.rerun()
@@ -79,13 +129,7 @@ for message in st.session_state.messages:
         
         # Show performance badge if present
         if message["role"] == "assistant" and "performance_category" in message:
-            category = message["performance_category"]
-            if category == "Fantastic":
-                st.success(f"🌟 **{category}** Performance")
-            elif category == "Average":
-                st.info(f"📈 **{category}** Performance")
-            elif category == "Below Average":
-                st.warning(f"📉 **{category}** Performance")
+            show_performance_badge(message["performance_category"])
         
         # Show suggestions
         if message["role"] == "assistant" and "suggestions" in message and message["suggestions"]:
@@ -118,71 +162,56 @@ if user_message:
     with st.chat_message("user"):
         st.markdown(user_message)
     
-    # Get bot response
+    # Get bot response, rendered token by token as it streams in
     with st.chat_message("assistant"):
-        with st.spinner("Thinking..."):
-            try:
-                response = requests.post(
-                    f"{API_URL}/chat",
-                    json={
-                        "student_id": st.session_state.current_student_id,
-                        "message": user_message,
-                        "conversation_history": st.session_state.conversation_history
-                    },
-                    timeout=60
-                )
-                
-                if response.status_code == 200:
-                    data = response.json()
-                    bot_response = data["response"]
-                    
-                    # Display response
-                    st.markdown(bot_response)
-                    
-                    # Show performance category
-                    if data.get("performance_category"):
-                        category = data["performance_category"]
-                        if category == "Fantastic":
-                            st.success(f"🌟 **{category}** Performance")
-                        elif category == "Average":
-                            st.info(f"📈 **{category}** Performance")
-                        elif category == "Below Average":
-                            st.warning(f"📉 **{category}** Performance")
-                    
-                    # Show suggestions
-                    if data.get("suggestions"):
-                        st.markdown("**💭 Suggested questions:**")
-                        cols = st.columns(min(len(data["suggestions"]), 2))
-                        for idx, suggestion in enumerate(data["suggestions"][:4]):
-                            with cols[idx % 2]:
-                                # Unique key for new suggestions
-                                unique_key = f"sug_new_{len(st.session_state.messages)}_{idx}"
-                                if st.button(suggestion, key=unique_key, use_container_width=True):
-                                    st.session_state.pending_message = suggestion
-                                    st.rerun()
-                    
-                    # Update conversation history
-                    st.session_state.conversation_history = [
-                        {"role": msg["role"], "content": msg["content"]}
-                        for msg in data["conversation_history"]
-                    ]
-                    
-                    # Add to messages
-                    st.session_state.messages.append({
-                        "role": "assistant",
-                        "content": bot_response,
-                        "performance_category": data.get("performance_category"),
-                        "suggestions": data.get("suggestions", [])
-                    })
-                    
-                    st.rerun()
-                else:
-                    st.error(f"Error: {response.json().get('detail', 'Unknown error')}")
+        try:
+            result = {}
+            bot_response = st.write_stream(stream_chat(
+                {
+                    "student_id": st.session_state.current_student_id,
+                    "message": user_message,
+                    "conversation_history": st.session_state.conversation_history
+                },
+                result
+            ))
             
-            except requests.exceptions.ConnectionError:
-                st.error("❌ Cannot connect to API. Start server: `cd api && uvicorn main:app --reload`")
-            except Exception as e:
-                st.error(f"Error: {str(e)}")
+            if "error" in result:
+                st.error(f"Error: {result['error']}")
+            elif result.get("type") == "error":
+                st.error(result["detail"])
+            else:
+                # Show performance category
+                if result.get("performance_category"):
+                    show_performance_badge(result["performance_category"])
+                
+                # Show suggestions
+                if result.get("suggestions"):
+                    st.markdown("**💭 Suggested questions:**")
+                    cols = st.columns(min(len(result["suggestions"]), 2))
+                    for idx, suggestion in enumerate(result["suggestions"][:4]):
+                        with cols[idx % 2]:
+                            # Same key the message loop gives these buttons on the next run,
+                            # so a click on them is picked up without an extra rerun
+                            unique_key = f"sug_msg{len(st.session_state.messages)}_idx{idx}"
+                            if st.button(suggestion, key=unique_key, use_container_width=True):
+                                st.session_state.pending_message = suggestion
+                                st.rerun()
+                
+                # Append the new turn to the conversation history
+                st.session_state.conversation_history.extend(result.get("new_messages", []))
+                
+                # Add to messages (already rendered above, so no st.rerun() needed)
+                st.session_state.messages.append({
+                    "role": "assistant",
+                    "content": bot_response if isinstance(bot_response, str) else "".join(bot_response),
+                    "performance_category": result.get("performance_category"),
+                    "suggestions": result.get("suggestions", [])
+                })
+        
+        except requests.exceptions.ConnectionError:
+            st.error("❌ Cannot connect to API. Start server: `cd api && uvicorn main:app --reload`")
+        except Exception as e:
+            st.error(f"Error: {str(e)}")
 
 # Footer
 st.markdown("---")